@@ -0,0 +1,273 @@
+"""Job broker for child agents run by workers (on this host or others).
+
+spawn_agent_auto with runtime "worker" puts the child's context, model key and
+cwd on the broker's queue instead of starting a process. `chat.py --worker`
+processes on any host that can reach the broker take jobs, run them as headless
+agents and post the results back; wait_agents collects the results of its
+pending worker children from the broker.
+
+  python agent_broker.py [--listen HOST:PORT | --listen unix:/path/to.sock]
+
+Clients and workers find the broker through EG_BROKER (default 127.0.0.1:7788).
+With EG_BROKER_TOKEN set, requests must carry the same token.
+
+Protocol: one JSON object per line in each direction over a stream socket.
+  {"op": "put", "job": {...}}                 -> {"ok": true, "position": n}
+  {"op": "take", "worker": w, "timeout": s}   -> {"ok": true, "job": {...} or null}
+  {"op": "done", "job_id": id, "result": r}   -> {"ok": true}
+  {"op": "results", "job_ids": [...]}         -> {"ok": true, "results": {id: r}}  (handed out once, kept up to 1h)
+  {"op": "status"}                            -> {"ok": true, "queued": n, "running": [...], "workers": [...], "results": n}
+A job taken on a connection that closes before "done" goes back to the front of
+the queue, so a worker that dies mid-job does not lose it. State is in memory.
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_ADDRESS = "127.0.0.1:7788"
+MAX_TAKE_WAIT_SEC = 60
+# Results nobody collected (e.g. the parent read them from a shared registry) are dropped after this
+RESULT_TTL_SEC = 3600
+CONNECT_TIMEOUT_SEC = 5
+
+
+def address() -> str:
+    return os.environ.get("EG_BROKER", "").strip() or DEFAULT_ADDRESS
+
+
+def _parse_address(addr: str) -> Tuple[int, Any]:
+    if addr.startswith("unix:"):
+        return socket.AF_UNIX, addr[len("unix:"):]
+    host, _, port = addr.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+# ---- server -----------------------------------------------------------------
+
+class _Broker:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queue: "collections.deque[Dict[str, Any]]" = collections.deque()
+        # job_id -> (job, worker name, connection id)
+        self.running: Dict[str, Tuple[Dict[str, Any], str, int]] = {}
+        # job_id -> (result, posted at)
+        self.results: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        # connection id -> {worker, since}
+        self.workers: Dict[int, Dict[str, Any]] = {}
+
+    def put(self, job: Dict[str, Any]) -> int:
+        with self.cond:
+            jid = job["job_id"]
+            # Idempotent, so a client may resend after a dropped connection
+            if jid in self.running or jid in self.results or any(j["job_id"] == jid for j in self.queue):
+                return len(self.queue)
+            self.queue.append(job)
+            self.cond.notify()
+            return len(self.queue)
+
+    def take(self, conn_id: int, worker: str, timeout: float) -> Optional[Dict[str, Any]]:
+        with self.cond:
+            self.workers.setdefault(conn_id, {"worker": worker, "since": time.time()})
+            if not self.cond.wait_for(lambda: self.queue, timeout):
+                return None
+            job = self.queue.popleft()
+            self.running[job["job_id"]] = (job, worker, conn_id)
+            return job
+
+    def done(self, job_id: str, result: Dict[str, Any]):
+        with self.cond:
+            self.running.pop(job_id, None)
+            # A result posted after the worker's connection dropped settles the requeued copy too
+            for job in [j for j in self.queue if j.get("job_id") == job_id]:
+                self.queue.remove(job)
+            now = time.time()
+            for jid in [j for j, (_, t) in self.results.items() if now - t > RESULT_TTL_SEC]:
+                del self.results[jid]
+            self.results[job_id] = (result, now)
+
+    def pop_results(self, job_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self.cond:
+            return {jid: self.results.pop(jid)[0] for jid in job_ids if jid in self.results}
+
+    def release(self, conn_id: int):
+        """A connection closed: requeue the jobs it had taken but not finished."""
+        with self.cond:
+            self.workers.pop(conn_id, None)
+            lost = [jid for jid, (_, _, cid) in self.running.items() if cid == conn_id]
+            for jid in lost:
+                job, _, _ = self.running.pop(jid)
+                self.queue.appendleft(job)
+            if lost:
+                self.cond.notify(len(lost))
+
+    def status(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "queued": len(self.queue),
+                "running": [{"job_id": jid, "child_id": job.get("child_id"), "worker": w}
+                            for jid, (job, w, _) in self.running.items()],
+                "workers": sorted({w["worker"] for w in self.workers.values()}),
+                "results": len(self.results),
+            }
+
+
+_conn_ids = itertools.count(1)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        broker: _Broker = self.server.broker
+        conn_id = next(_conn_ids)
+        token = os.environ.get("EG_BROKER_TOKEN", "")
+        try:
+            for raw in self.rfile:
+                try:
+                    req = json.loads(raw.decode("utf-8"))
+                    if token and req.get("token") != token:
+                        resp = {"ok": False, "error": "bad token"}
+                    else:
+                        resp = self._dispatch(broker, conn_id, req)
+                except Exception as e:
+                    resp = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                self.wfile.write((json.dumps(resp) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            broker.release(conn_id)
+
+    def _dispatch(self, broker: _Broker, conn_id: int, req: Dict[str, Any]) -> Dict[str, Any]:
+        op = req.get("op")
+        if op == "put":
+            job = req["job"]
+            if not job.get("job_id"):
+                raise ValueError("job_id is required")
+            return {"ok": True, "position": broker.put(job)}
+        if op == "take":
+            timeout = min(float(req.get("timeout") or 0), MAX_TAKE_WAIT_SEC)
+            return {"ok": True, "job": broker.take(conn_id, str(req.get("worker") or conn_id), timeout)}
+        if op == "done":
+            broker.done(req["job_id"], req.get("result") or {})
+            return {"ok": True}
+        if op == "results":
+            return {"ok": True, "results": broker.pop_results([str(j) for j in req.get("job_ids") or []])}
+        if op == "status":
+            return dict(broker.status(), ok=True)
+        return {"ok": False, "error": f"unknown op: {op}"}
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(addr: Optional[str] = None) -> socketserver.BaseServer:
+    family, target = _parse_address(addr or address())
+    if family == socket.AF_UNIX:
+        try:
+            os.unlink(target)
+        except FileNotFoundError:
+            pass
+        server = _UnixServer(target, _Handler)
+    else:
+        server = _TCPServer(target, _Handler)
+    server.broker = _Broker()
+    return server
+
+
+# ---- client -----------------------------------------------------------------
+
+class BrokerClient:
+    """One connection to the broker; calls are serialized. Reconnects once on a broken connection."""
+
+    def __init__(self, addr: Optional[str] = None):
+        self.addr = addr or address()
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+
+    def _connect(self):
+        family, target = _parse_address(self.addr)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT_SEC)
+        sock.connect(target)
+        sock.settimeout(None)
+        self._sock, self._file = sock, sock.makefile("rwb")
+
+    def close(self):
+        try:
+            if self._file:
+                self._file.close()
+            if self._sock:
+                self._sock.close()
+        except OSError:
+            pass
+        self._sock = self._file = None
+
+    def call(self, op: str, **fields) -> Dict[str, Any]:
+        req = dict(fields, op=op)
+        token = os.environ.get("EG_BROKER_TOKEN", "")
+        if token:
+            req["token"] = token
+        data = (json.dumps(req) + "\n").encode("utf-8")
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._file is None:
+                        self._connect()
+                    self._file.write(data)
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("broker closed the connection")
+                    break
+                except OSError:
+                    self.close()
+                    if attempt:
+                        raise
+        resp = json.loads(line.decode("utf-8"))
+        if not resp.get("ok"):
+            raise RuntimeError(f"broker: {resp.get('error')}")
+        return resp
+
+
+_clients: Dict[str, BrokerClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(addr: Optional[str] = None) -> BrokerClient:
+    """Shared client for this process (spawning and collecting results)."""
+    addr = addr or address()
+    with _clients_lock:
+        if addr not in _clients:
+            _clients[addr] = BrokerClient(addr)
+        return _clients[addr]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Egg agent job broker")
+    parser.add_argument("--listen", default=None, help=f"HOST:PORT or unix:/path (default: EG_BROKER or {DEFAULT_ADDRESS})")
+    args = parser.parse_args()
+    server = make_server(args.listen)
+    print(f"Egg broker listening on {args.listen or address()}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Warm pool of idle, pre-spawned child agents.
+
+When EG_AGENT_POOL_SIZE is set to a positive number, each tree keeps that many
+chat.py processes running in panes with a constructed ChatClient and a warmed
+provider connection. spawn_agent/spawn_agent_auto claim an idle slot by handing
+it the child's environment (agent dir, init_context.txt, model key) instead of
+creating a pane and starting a process on the critical path.
+
+Layout: .egg/agents/<tree>/.pool/<slot>/
+  state.json   {status: starting|idle|expired, pid, pane_id, created_at}
+  claim.lock   created with O_EXCL by whoever takes the slot (claimer or the idle timeout)
+  claim.json   environment handed to the idle agent
+"""
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import tool_manager
+
+# Slots that never reported idle within this many seconds are considered dead
+STARTING_GRACE_SEC = 120
+CLAIM_POLL_SEC = 0.05
+
+
+def pool_size() -> int:
+    try:
+        return max(0, int(os.environ.get('EG_AGENT_POOL_SIZE', '0') or 0))
+    except ValueError:
+        return 0
+
+
+def idle_timeout() -> int:
+    try:
+        return max(1, int(os.environ.get('EG_AGENT_POOL_IDLE_SEC', '600') or 600))
+    except ValueError:
+        return 600
+
+
+def pool_dir(tree_id: str) -> Path:
+    return tool_manager.AGENTS_BASE / tree_id / '.pool'
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except (ProcessLookupError, ValueError, TypeError):
+        return False
+    except PermissionError:
+        return True
+
+
+def _atomic_write_json(path: Path, data: Dict):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _live_slots(tree_id: str) -> List[Path]:
+    """Return unclaimed slots that are starting or idle, removing dead ones on the way."""
+    root = pool_dir(tree_id)
+    out: List[Path] = []
+    if not root.exists():
+        return out
+    now = time.time()
+    for slot in root.iterdir():
+        if not slot.is_dir() or (slot / 'claim.lock').exists():
+            continue
+        st = tool_manager._read_json(slot / 'state.json') or {}
+        status = st.get('status')
+        if status == 'idle' and _pid_alive(st.get('pid')):
+            out.append(slot)
+        elif status == 'starting' and now - st.get('created_at', 0) < STARTING_GRACE_SEC:
+            out.append(slot)
+        else:
+            shutil.rmtree(slot, ignore_errors=True)
+    return out
+
+
+def _launch_slot(tree_id: str, parent_id: str, session: str, cwd: str):
+    slot = pool_dir(tree_id) / f"slot-{uuid.uuid4().hex[:8]}"
+    slot.mkdir(parents=True, exist_ok=True)
+    _atomic_write_json(slot / 'state.json', {"status": "starting", "created_at": time.time()})
+    run_sh_path = slot / 'run.sh'
+    tool_manager._write_run_script(run_sh_path, cwd, {"EG_POOL_SLOT_DIR": str(slot)}, tree_id)
+
+    def _on_pane(pane_id: str):
+        if not pane_id:
+            shutil.rmtree(slot, ignore_errors=True)
+
+    tool_manager._spawn_into_parent_layer(session, tree_id, parent_id, f"'{run_sh_path}'", on_pane=_on_pane)
+
+
+def refill(tree_id: str, parent_id: str, session: str, cwd: str):
+    """Top the pool up to pool_size() slots. Serialized across processes with a lock file."""
+    size = pool_size()
+    if size <= 0:
+        return
+    root = pool_dir(tree_id)
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / '.refill.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        missing = size - len(_live_slots(tree_id))
+        for _ in range(max(0, missing)):
+            _launch_slot(tree_id, parent_id, session, cwd)
+
+
+def refill_async(tree_id: str, parent_id: str, session: str, cwd: str):
+    if pool_size() <= 0:
+        return
+    threading.Thread(target=refill, args=(tree_id, parent_id, session, cwd), daemon=True).start()
+
+
+def claim(tree_id: str, env: Dict[str, str], model_key: str = "") -> Optional[str]:
+    """Hand a child's environment to an idle slot. Returns the slot's pane id, or None if none was free."""
+    root = pool_dir(tree_id)
+    if not root.exists():
+        return None
+    candidates = []
+    for slot in root.iterdir():
+        if not slot.is_dir():
+            continue
+        st = tool_manager._read_json(slot / 'state.json') or {}
+        if st.get('status') == 'idle' and _pid_alive(st.get('pid')):
+            candidates.append((st.get('created_at', 0), slot, st))
+    for _, slot, st in sorted(candidates, key=lambda c: c[0]):
+        try:
+            fd = os.open(slot / 'claim.lock', os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        except OSError:
+            continue
+        os.close(fd)
+        _atomic_write_json(slot / 'claim.json', {"env": env, "model_key": model_key, "claimed_at": time.time()})
+        return st.get('pane_id', '') or ''
+    return None
+
+
+def wait_for_claim(slot_dir: str, timeout: Optional[int] = None) -> Optional[Dict]:
+    """Called by an idle pooled agent. Blocks until claimed, or returns None after the idle timeout."""
+    slot = Path(slot_dir)
+    timeout = timeout or idle_timeout()
+    _atomic_write_json(slot / 'state.json', {
+        "status": "idle",
+        "pid": os.getpid(),
+        "pane_id": os.environ.get('TMUX_PANE', ''),
+        "created_at": time.time(),
+    })
+    deadline = time.time() + timeout
+    claim_path = slot / 'claim.json'
+    while True:
+        if claim_path.exists():
+            data = tool_manager._read_json(claim_path)
+            if isinstance(data, dict):
+                shutil.rmtree(slot, ignore_errors=True)
+                return data
+        elif time.time() > deadline:
+            # Take the slot ourselves so no claimer can race with the shutdown
+            try:
+                fd = os.open(slot / 'claim.lock', os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                shutil.rmtree(slot, ignore_errors=True)
+                return None
+            except FileExistsError:
+                pass
+        time.sleep(CLAIM_POLL_SEC)
+
+
+def apply_claim(claim_data: Dict):
+    """Adopt the claimed child's identity in this process."""
+    env = claim_data.get('env') or {}
+    for k, v in env.items():
+        os.environ[str(k)] = str(v)
+    os.environ.pop('EG_POOL_SLOT_DIR', None)
@@ -0,0 +1,419 @@
+"""Per-project SQLite registry of agent trees.
+
+All agent state (status, pane ids, model keys, results, timestamps) lives in
+.egg/agents/registry.db, opened in WAL mode so many agent processes can read
+while one writes. Child ids are allocated atomically from a counter table
+instead of scanning the children/ directory.
+
+The old per-agent files (state.json, result.json) are still written as an
+export for compatibility unless EG_AGENT_STATE_FILES=0. notify/done is always
+written because wait_agents uses it as a wake-up signal.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BASE = Path.cwd() / '.egg' / 'agents'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trees (
+    tree_id TEXT PRIMARY KEY,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS agents (
+    tree_id TEXT NOT NULL,
+    parent_id TEXT NOT NULL DEFAULT '',
+    agent_id TEXT NOT NULL,
+    label TEXT,
+    status TEXT NOT NULL DEFAULT 'active',
+    model_key TEXT,
+    cwd TEXT,
+    dir TEXT,
+    pane_id TEXT,
+    right_column_pane_id TEXT,
+    auto_approve INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    spawned_at REAL,
+    finished_at REAL,
+    updated_at REAL,
+    PRIMARY KEY (tree_id, parent_id, agent_id)
+);
+CREATE INDEX IF NOT EXISTS agents_by_id ON agents(tree_id, agent_id);
+CREATE INDEX IF NOT EXISTS agents_by_status ON agents(tree_id, status);
+CREATE TABLE IF NOT EXISTS child_counters (
+    tree_id TEXT NOT NULL,
+    parent_id TEXT NOT NULL,
+    label TEXT NOT NULL,
+    last INTEGER NOT NULL,
+    PRIMARY KEY (tree_id, parent_id, label)
+);
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    cwd TEXT,
+    files TEXT,
+    fingerprint TEXT,
+    source TEXT,
+    created_at REAL
+);
+"""
+
+# Columns added after the first schema; created on open when missing
+COLUMNS_ADDED = {
+    "runtime": "TEXT",
+    "pid": "INTEGER",
+    # Scheduler: queued children keep how to start them in launch (JSON)
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "provider": "TEXT",
+    "est_tokens": "INTEGER",
+    "launch": "TEXT",
+    "started_at": "REAL",
+}
+JSON_FIELDS = ("result", "launch")
+
+FIELDS = (
+    "label", "status", "model_key", "cwd", "dir", "pane_id", "right_column_pane_id",
+    "auto_approve", "result", "spawned_at", "finished_at", *COLUMNS_ADDED,
+)
+
+
+def export_files_enabled() -> bool:
+    return os.environ.get('EG_AGENT_STATE_FILES', '1').strip().lower() not in ("0", "false", "no", "off")
+
+
+def _atomic_write_json(path: Path, data: Any):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path) -> Any:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+class AgentRegistry:
+    def __init__(self, base: Path):
+        self.base = Path(base)
+        self.base.mkdir(parents=True, exist_ok=True)
+        self.path = self.base / 'registry.db'
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._imported: set = set()
+
+    def _migrate(self):
+        with self._lock:
+            have = {r["name"] for r in self._conn.execute("PRAGMA table_info(agents)")}
+            for name, decl in COLUMNS_ADDED.items():
+                if name not in have:
+                    try:
+                        self._conn.execute(f"ALTER TABLE agents ADD COLUMN {name} {decl}")
+                    except sqlite3.OperationalError:
+                        # Another process added it first
+                        pass
+
+    # ---- low level helpers -------------------------------------------------
+
+    def _tx(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(self._conn)
+                self._conn.execute("COMMIT")
+                return out
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _row_to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        d = dict(row)
+        for key in JSON_FIELDS:
+            if d.get(key):
+                try:
+                    d[key] = json.loads(d[key])
+                except (TypeError, ValueError):
+                    pass
+        return d
+
+    # ---- trees --------------------------------------------------------------
+
+    def ensure_tree(self, tree_id: str):
+        """Register a tree, importing agents from pre-registry state files once."""
+        if tree_id in self._imported:
+            return
+        with self._lock:
+            known = self._conn.execute("SELECT 1 FROM trees WHERE tree_id = ?", (tree_id,)).fetchone()
+        if not known:
+            self._import_tree_files(tree_id)
+        self._imported.add(tree_id)
+
+    def _import_tree_files(self, tree_id: str):
+        tree_dir = self.base / tree_id
+        rows: List[Tuple] = []
+        if tree_dir.is_dir():
+            for parent_dir in tree_dir.iterdir():
+                children_root = parent_dir / 'children'
+                if not parent_dir.is_dir() or not children_root.is_dir():
+                    continue
+                for c in children_root.iterdir():
+                    if not c.is_dir():
+                        continue
+                    st = _read_json(c / 'state.json') or {}
+                    res = _read_json(c / 'result.json')
+                    rows.append((
+                        tree_id, parent_dir.name, c.name,
+                        "done" if isinstance(res, dict) else st.get("status", "active"),
+                        st.get("model_key"), st.get("cwd"), str(c), st.get("pane_id"),
+                        json.dumps(res) if isinstance(res, dict) else None,
+                        st.get("spawned_at"), time.time(),
+                    ))
+
+        def _do(conn):
+            conn.execute("INSERT OR IGNORE INTO trees(tree_id, created_at) VALUES (?, ?)", (tree_id, time.time()))
+            conn.executemany(
+                "INSERT OR IGNORE INTO agents(tree_id, parent_id, agent_id, status, model_key, cwd, dir, pane_id, result, spawned_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._tx(_do)
+
+    # ---- agents -------------------------------------------------------------
+
+    def allocate_child_id(self, tree_id: str, parent_id: str, label: str, seed: Callable[[], int] = lambda: 0) -> str:
+        """Atomically reserve the next <label>-NNN id under parent_id."""
+        self.ensure_tree(tree_id)
+        normalized = label.replace(" ", "_").replace("/", "_").replace("\\", "_")
+
+        def _do(conn):
+            row = conn.execute(
+                "SELECT last FROM child_counters WHERE tree_id = ? AND parent_id = ? AND label = ?",
+                (tree_id, parent_id, normalized)).fetchone()
+            last = row["last"] if row else seed()
+            nxt = last + 1
+            conn.execute(
+                "INSERT INTO child_counters(tree_id, parent_id, label, last) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(tree_id, parent_id, label) DO UPDATE SET last = excluded.last",
+                (tree_id, parent_id, normalized, nxt))
+            return f"{normalized}-{nxt:03d}"
+        return self._tx(_do)
+
+    def upsert(self, tree_id: str, agent_id: str, parent_id: str = '', **fields) -> Dict[str, Any]:
+        """Insert or update an agent row and refresh its exported state.json."""
+        self.ensure_tree(tree_id)
+        fields = {k: v for k, v in fields.items() if k in FIELDS}
+        for key in JSON_FIELDS:
+            if isinstance(fields.get(key), (dict, list)):
+                fields[key] = json.dumps(fields[key])
+        now = time.time()
+
+        def _do(conn):
+            conn.execute(
+                "INSERT OR IGNORE INTO agents(tree_id, parent_id, agent_id, spawned_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (tree_id, parent_id, agent_id, now, now))
+            if fields:
+                sets = ", ".join(f"{k} = ?" for k in fields)
+                conn.execute(
+                    f"UPDATE agents SET {sets}, updated_at = ? WHERE tree_id = ? AND parent_id = ? AND agent_id = ?",
+                    (*fields.values(), now, tree_id, parent_id, agent_id))
+            return conn.execute(
+                "SELECT * FROM agents WHERE tree_id = ? AND parent_id = ? AND agent_id = ?",
+                (tree_id, parent_id, agent_id)).fetchone()
+        row = self._row_to_dict(self._tx(_do))
+        self._export_state(row)
+        return row
+
+    def get(self, tree_id: str, agent_id: str, parent_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        self.ensure_tree(tree_id)
+        with self._lock:
+            if parent_id is None:
+                row = self._conn.execute(
+                    "SELECT * FROM agents WHERE tree_id = ? AND agent_id = ? ORDER BY spawned_at DESC LIMIT 1",
+                    (tree_id, agent_id)).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT * FROM agents WHERE tree_id = ? AND parent_id = ? AND agent_id = ?",
+                    (tree_id, parent_id, agent_id)).fetchone()
+        return self._row_to_dict(row)
+
+    def find(self, tree_id: str, agent_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Map agent_id -> newest row for the given ids within a tree."""
+        ids = list(agent_ids)
+        if not ids:
+            return {}
+        self.ensure_tree(tree_id)
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for row in self._conn.execute(
+                        f"SELECT * FROM agents WHERE tree_id = ? AND agent_id IN ({marks}) ORDER BY spawned_at",
+                        (tree_id, *chunk)):
+                    out[row["agent_id"]] = self._row_to_dict(row)
+        return out
+
+    def children(self, tree_id: str, parent_id: Optional[str] = None, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """All non-root agents of a tree (optionally of one parent / with one status), oldest first."""
+        self.ensure_tree(tree_id)
+        sql = "SELECT * FROM agents WHERE tree_id = ? AND parent_id != ''"
+        params: List[Any] = [tree_id]
+        if parent_id is not None:
+            sql += " AND parent_id = ?"
+            params.append(parent_id)
+        if status is not None:
+            sql += " AND status = ?"
+            params.append(status)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY spawned_at, agent_id", params).fetchall()
+        return [self._row_to_dict(r) for r in rows]
+
+    def claim_queued(self, tree_id: str, pick: Callable[[List[Dict[str, Any]], List[Dict[str, Any]]], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Atomically move queued children to active.
+
+        pick(queued, running) receives the tree's queued rows (highest priority first) and its
+        active/recently started rows, and returns the queued rows to start now. The selection
+        and the status change happen in one write transaction, so concurrent dispatchers in
+        different processes never start the same child or exceed a limit together.
+        """
+        self.ensure_tree(tree_id)
+        now = time.time()
+
+        def _do(conn):
+            queued = [self._row_to_dict(r) for r in conn.execute(
+                "SELECT * FROM agents WHERE tree_id = ? AND status = 'queued' ORDER BY priority DESC, spawned_at, agent_id",
+                (tree_id,))]
+            if not queued:
+                return []
+            running = [self._row_to_dict(r) for r in conn.execute(
+                "SELECT * FROM agents WHERE tree_id = ? AND parent_id != '' AND (status = 'active' OR started_at > ?)",
+                (tree_id, now - 60))]
+            chosen = pick(queued, running)
+            for row in chosen:
+                conn.execute(
+                    "UPDATE agents SET status = 'active', started_at = ?, updated_at = ? WHERE tree_id = ? AND parent_id = ? AND agent_id = ?",
+                    (now, now, tree_id, row["parent_id"], row["agent_id"]))
+                row["status"], row["started_at"] = "active", now
+            return chosen
+        chosen = self._tx(_do)
+        for row in chosen:
+            self._export_state(row)
+        return chosen
+
+    def finish(self, tree_id: str, agent_id: str, parent_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Record an agent's result, export result.json/state.json and signal notify/done."""
+        row = self.upsert(tree_id, agent_id, parent_id, status=result.get("status", "done"),
+                          result=result, finished_at=time.time())
+        agent_dir = row.get("dir") if row else None
+        if agent_dir:
+            if export_files_enabled():
+                _atomic_write_json(Path(agent_dir) / 'result.json', result)
+            notify_dir = Path(agent_dir) / 'notify'
+            notify_dir.mkdir(parents=True, exist_ok=True)
+            (notify_dir / 'done').write_text('1')
+        if row and (row.get("launch") or {}).get("cache"):
+            import result_cache
+            result_cache.store(self, row, result)
+        return row
+
+    # ---- result cache -------------------------------------------------------
+
+    def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM result_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        d = dict(row)
+        for k in ("result", "files"):
+            try:
+                d[k] = json.loads(d[k]) if d[k] else None
+            except (TypeError, ValueError):
+                return None
+        return d
+
+    def cache_put(self, key: str, result: Dict[str, Any], cwd: str, files: List[str], fingerprint: str, source: str):
+        self._tx(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO result_cache(key, result, cwd, files, fingerprint, source, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(result), cwd, json.dumps(files), fingerprint, source, time.time())))
+
+    def cache_delete(self, key: str):
+        self._tx(lambda conn: conn.execute("DELETE FROM result_cache WHERE key = ?", (key,)))
+
+    def rename_tree(self, old_id: str, new_id: str, old_dir: str, new_dir: str):
+        """Re-key a renamed tree and rewrite the agent directories under it."""
+        def _do(conn):
+            conn.execute("UPDATE trees SET tree_id = ? WHERE tree_id = ?", (new_id, old_id))
+            conn.execute(
+                "UPDATE agents SET tree_id = ?, dir = ? || substr(dir, ?) WHERE tree_id = ?",
+                (new_id, new_dir, len(old_dir) + 1, old_id))
+            conn.execute("UPDATE child_counters SET tree_id = ? WHERE tree_id = ?", (new_id, old_id))
+        self._tx(_do)
+        self._imported.discard(old_id)
+
+    def _export_state(self, row: Optional[Dict[str, Any]]):
+        if not row or not row.get("dir") or not export_files_enabled():
+            return
+        state = {
+            "agent_id": row["agent_id"],
+            "parent_id": row["parent_id"],
+            "status": row["status"],
+            "model_key": row.get("model_key") or "",
+            "spawned_at": int(row.get("spawned_at") or 0),
+            "children": [],
+            "cwd": row.get("cwd") or "",
+        }
+        for key in ("pane_id", "right_column_pane_id"):
+            if row.get(key):
+                state[key] = row[key]
+        if row.get("auto_approve"):
+            state["auto_tool_approve"] = True
+        if row.get("runtime") and row["runtime"] != "pane":
+            state["runtime"] = row["runtime"]
+            if row.get("pid"):
+                state["pid"] = row["pid"]
+        try:
+            _atomic_write_json(Path(row["dir"]) / 'state.json', state)
+        except OSError:
+            pass
+
+
+_registries: Dict[Path, AgentRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(base: Optional[Path] = None) -> AgentRegistry:
+    base = Path(base) if base else DEFAULT_BASE
+    with _registries_lock:
+        reg = _registries.get(base)
+        if reg is None:
+            reg = AgentRegistry(base)
+            _registries[base] = reg
+        return reg
+
+
+def current_identity() -> Tuple[Optional[str], str, str]:
+    """(tree_id, agent_id, parent_id) of this process; the root agent has parent ''."""
+    tree_id = os.environ.get('EG_TREE_ID')
+    if not tree_id:
+        try:
+            tree_id = (DEFAULT_BASE / '.current_tree').read_text().strip() or None
+        except Exception:
+            tree_id = None
+    agent_id = os.environ.get('EG_AGENT_ID') or 'root'
+    parent_id = os.environ.get('EG_PARENT_ID', '') if agent_id != 'root' else ''
+    return tree_id, agent_id, parent_id
@@ -0,0 +1,145 @@
+"""Tree-level scheduler for child agents.
+
+When any limit is configured, spawn_agent/spawn_agent_auto record the child as
+`queued` (with its priority and how to start it) and dispatch() starts queued
+children while the limits allow:
+
+  EG_MAX_CHILDREN                  max concurrently active children per tree
+  providers.<name>.max_concurrent  max active children using that provider
+  providers.<name>.tokens_per_minute
+                                   budget for children started within the last
+                                   60 seconds, using an estimate of each child's
+                                   first request (context chars / 4 + a fixed
+                                   allowance for system prompt and tools)
+
+Higher priority starts first; children that do not fit a provider limit let
+others behind them start. dispatch() runs on spawn, whenever an agent finishes
+(in whichever process records the result) and periodically while wait_agents
+waits on queued children, so time-based budgets free up without new events.
+Selection and the queued -> active transition happen in one registry
+transaction, so it is safe to call from every agent process.
+"""
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import agent_registry
+from config import load_configs
+
+BASE_PROMPT_TOKENS = 2000
+TPM_WINDOW_SEC = 60
+
+_configs: Optional[tuple] = None
+
+
+def max_children() -> int:
+    try:
+        return max(0, int(os.environ.get('EG_MAX_CHILDREN', '0') or 0))
+    except ValueError:
+        return 0
+
+
+def _load():
+    global _configs
+    if _configs is None:
+        _configs = load_configs()
+    return _configs
+
+
+def provider_limits() -> Dict[str, Dict[str, int]]:
+    """provider -> {max_concurrent, tokens_per_minute} for providers that set any."""
+    out: Dict[str, Dict[str, int]] = {}
+    for name, cfg in (_load()[1] or {}).items():
+        if not isinstance(cfg, dict):
+            continue
+        limits = {k: int(cfg[k]) for k in ("max_concurrent", "tokens_per_minute") if isinstance(cfg.get(k), (int, float)) and cfg[k] > 0}
+        if limits:
+            out[name] = limits
+    return out
+
+
+def provider_of(model_key: str) -> str:
+    return ((_load()[0] or {}).get(model_key) or {}).get("provider", "") or ""
+
+
+def estimate_tokens(context_text: str) -> int:
+    return BASE_PROMPT_TOKENS + len(context_text or "") // 4
+
+
+def enabled() -> bool:
+    return max_children() > 0 or bool(provider_limits())
+
+
+def _pick(queued: List[Dict[str, Any]], running: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    limit = max_children()
+    limits = provider_limits()
+    now = time.time()
+    active = [r for r in running if r.get("status") == "active"]
+    n_active = len(active)
+    per_provider = Counter(r.get("provider") or "" for r in active)
+    window_tokens: Counter = Counter()
+    for r in running:
+        if (r.get("started_at") or 0) > now - TPM_WINDOW_SEC:
+            window_tokens[r.get("provider") or ""] += r.get("est_tokens") or 0
+
+    chosen = []
+    for row in queued:
+        if limit and n_active >= limit:
+            break
+        launch = row.get("launch") or {}
+        # In-process children can only be started by the process that owns them
+        if launch.get("owner_pid") and launch["owner_pid"] != os.getpid():
+            continue
+        prov = row.get("provider") or ""
+        pl = limits.get(prov, {})
+        if pl.get("max_concurrent") and per_provider[prov] >= pl["max_concurrent"]:
+            continue
+        est = row.get("est_tokens") or 0
+        # An empty window always admits one child, even if its estimate alone exceeds the budget
+        if pl.get("tokens_per_minute") and window_tokens[prov] and window_tokens[prov] + est > pl["tokens_per_minute"]:
+            continue
+        chosen.append(row)
+        n_active += 1
+        per_provider[prov] += 1
+        window_tokens[prov] += est
+    return chosen
+
+
+def dispatch(tree_id: Optional[str]) -> List[str]:
+    """Start the queued children of tree_id that fit the limits now. Returns their ids."""
+    if not tree_id:
+        return []
+    import tool_manager
+    reg = agent_registry.get_registry()
+    try:
+        rows = reg.claim_queued(tree_id, _pick)
+    except Exception:
+        return []
+    started = []
+    for row in rows:
+        try:
+            tool_manager._start_child(row)
+            started.append(row["agent_id"])
+        except Exception as e:
+            reg.finish(tree_id, row["agent_id"], row["parent_id"], {
+                "status": "error", "return_value": "", "error": f"failed to start: {e}",
+                "finished_at": int(time.time())})
+    return started
+
+
+def queue_state(tree_id: str) -> Dict[str, Any]:
+    """Queued children in start order plus the limits in effect, for list_agents."""
+    reg = agent_registry.get_registry()
+    queued = sorted(reg.children(tree_id, status="queued"), key=lambda r: (-(r.get("priority") or 0), r.get("spawned_at") or 0))
+    return {
+        "queue": [{
+            "child_id": r["agent_id"],
+            "parent_id": r["parent_id"],
+            "priority": r.get("priority") or 0,
+            "provider": r.get("provider") or "",
+            "position": i + 1,
+        } for i, r in enumerate(queued)],
+        "active": len(reg.children(tree_id, status="active")),
+        "limits": {"max_children": max_children(), "providers": provider_limits()},
+    }
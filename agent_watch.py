@@ -0,0 +1,106 @@
+"""Event-driven waiting on agent directories.
+
+wait_agents watches each pending child's notify/ directory (and the parents'
+children/ directories for ids that do not exist yet) and wakes as soon as a
+child finishes. On Linux this uses inotify through libc; elsewhere it falls back
+to a watcher that only re-checks the already known paths at a short interval,
+without listing directories.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Minimal inotify wrapper: add(dir) and wait(timeout) -> [(dir, name)]."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._wd_to_path: Dict[int, Path] = {}
+        self._watched: Dict[Path, int] = {}
+
+    def add(self, path: Path) -> bool:
+        path = Path(path)
+        if path in self._watched:
+            return True
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(path)), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            return False
+        self._wd_to_path[wd] = path
+        self._watched[path] = wd
+        return True
+
+    def wait(self, timeout: Optional[float]) -> List[Tuple[Path, str]]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events: List[Tuple[Path, str]] = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, _mask, _cookie, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_len].split(b"\0", 1)[0].decode("utf-8", "replace")
+            offset += name_len
+            path = self._wd_to_path.get(wd)
+            if path is not None:
+                events.append((path, name))
+        return events
+
+    def close(self):
+        try:
+            os.close(self._fd)
+        except OSError:
+            pass
+
+
+class PollingWatcher:
+    """Fallback watcher: reports every watched path after a short sleep so callers re-check known files."""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self._paths: List[Path] = []
+
+    def add(self, path: Path) -> bool:
+        path = Path(path)
+        if path not in self._paths:
+            self._paths.append(path)
+        return True
+
+    def wait(self, timeout: Optional[float]) -> List[Tuple[Path, str]]:
+        time.sleep(self.interval if timeout is None else max(0.0, min(self.interval, timeout)))
+        return [(p, "") for p in self._paths]
+
+    def close(self):
+        pass
+
+
+def make_watcher():
+    """Return an InotifyWatcher when available, else a PollingWatcher."""
+    if os.environ.get("EG_WAIT_POLLING", "").strip().lower() in ("1", "true", "yes", "on"):
+        return PollingWatcher()
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
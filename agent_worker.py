@@ -0,0 +1,121 @@
+"""Worker loop for `chat.py --worker`: run child agents taken from the broker.
+
+Each slot holds its own broker connection, takes one job at a time and runs it
+as a headless agent (the same run.sh + `chat.py --headless` a local headless
+child uses) in the job's cwd when it exists on this host, otherwise in the
+worker's own cwd. When the agent exits, its result from that directory's agent
+registry (or an error with the tail of its output.log) is posted back.
+"""
+import os
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import agent_broker
+import agent_registry
+import tool_manager
+
+TAKE_WAIT_SEC = 30
+RECONNECT_MAX_SEC = 30
+LOG_TAIL_LINES = 40
+
+# Running agent processes, terminated when the worker is interrupted
+_procs: Dict[str, subprocess.Popen] = {}
+
+
+def _log(msg: str):
+    print(f"[{time.strftime('%H:%M:%S')}] {msg}", flush=True)
+
+
+def _log_tail(path: Path) -> str:
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return "".join(f.readlines()[-LOG_TAIL_LINES:])
+    except OSError:
+        return ""
+
+
+def run_job(job: Dict[str, Any], default_cwd: str, worker: str) -> Dict[str, Any]:
+    tree_id, parent_id, child_id = job["tree_id"], job["parent_id"], job["child_id"]
+    cwd = job.get("cwd") if os.path.isdir(job.get("cwd") or "") else default_cwd
+    agents_base = Path(cwd) / '.egg' / 'agents'
+    agent_dir = agents_base / tree_id / parent_id / 'children' / child_id
+    (agent_dir / 'notify').mkdir(parents=True, exist_ok=True)
+    init_file = agent_dir / 'init_context.txt'
+    if not init_file.exists():
+        init_file.write_text(job.get("context_text") or '', encoding='utf-8')
+
+    proc = tool_manager._popen_headless(cwd, str(agent_dir), child_id, tree_id, parent_id, extra_env=job.get("extra_env") or None)
+    _procs[job["job_id"]] = proc
+    try:
+        proc.wait()
+    finally:
+        _procs.pop(job["job_id"], None)
+
+    row = agent_registry.get_registry(agents_base).get(tree_id, child_id, parent_id) or {}
+    res = row.get('result')
+    if not isinstance(res, dict):
+        res = agent_registry._read_json(agent_dir / 'result.json')
+    if not isinstance(res, dict):
+        res = {"status": "error", "return_value": "",
+               "error": f"agent exited with code {proc.returncode} without popContext on {worker}",
+               "log_tail": _log_tail(agent_dir / 'output.log'),
+               "finished_at": int(time.time())}
+    return dict(res, worker=worker)
+
+
+def _slot_loop(slot: int, addr: str, default_cwd: str, stop: threading.Event):
+    worker = f"{socket.gethostname()}:{os.getpid()}/{slot}"
+    client = agent_broker.BrokerClient(addr)
+    backoff = 1.0
+    while not stop.is_set():
+        try:
+            job = client.call("take", worker=worker, timeout=TAKE_WAIT_SEC).get("job")
+            backoff = 1.0
+        except Exception as e:
+            _log(f"{worker}: broker {addr} unavailable ({e}); retrying in {backoff:.0f}s")
+            stop.wait(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX_SEC)
+            continue
+        if not job:
+            continue
+        _log(f"{worker}: running {job['tree_id']}/{job['child_id']}")
+        try:
+            result = run_job(job, default_cwd, worker)
+        except Exception as e:
+            result = {"status": "error", "return_value": "", "error": f"worker failed to run job: {e}",
+                      "worker": worker, "finished_at": int(time.time())}
+        if stop.is_set():
+            # Interrupted mid-job: let the broker requeue it rather than report a kill as a result
+            break
+        try:
+            client.call("done", job_id=job["job_id"], result=result)
+            _log(f"{worker}: {job['child_id']} {result.get('status')}")
+        except Exception as e:
+            _log(f"{worker}: could not post result for {job['child_id']}: {e}")
+    client.close()
+
+
+def run(addr: Optional[str] = None, slots: int = 1, cwd: Optional[str] = None):
+    """Serve jobs until interrupted."""
+    addr = addr or agent_broker.address()
+    default_cwd = str(Path(cwd or os.getcwd()).resolve())
+    stop = threading.Event()
+    _log(f"Egg worker: {slots} slot(s), broker {addr}, default cwd {default_cwd}")
+    threads = [threading.Thread(target=_slot_loop, args=(i, addr, default_cwd, stop), daemon=True)
+               for i in range(max(1, slots))]
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for proc in list(_procs.values()):
+            try:
+                os.killpg(proc.pid, 15)
+            except OSError:
+                pass
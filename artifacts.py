@@ -0,0 +1,126 @@
+"""Content-addressed store for large tool outputs.
+
+Output that output_shaper cuts to fit its token budget (from a tool call or a
+`$` command) is written once to .egg/artifacts/<id[:2]>/<id>.txt, where id is a
+prefix of the output's sha256, so repeated output is stored once and names
+never collide. The transcript only gets the shaped head/tail and the id; the
+model pages through the rest with the read_artifact tool.
+
+With EG_ARTIFACT_COMPRESS=1 artifacts are stored gzipped (<id>.txt.gz).
+"""
+import gzip
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Optional
+
+ID_LEN = 20
+DEFAULT_PAGE_LINES = 200
+MAX_PAGE_CHARS = 20000
+
+
+def artifacts_dir() -> Path:
+    return Path.cwd() / ".egg" / "artifacts"
+
+
+def _compress() -> bool:
+    return os.environ.get('EG_ARTIFACT_COMPRESS', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def put(text: str) -> str:
+    """Store text (if not stored already) and return its id."""
+    data = text.encode('utf-8', errors='replace')
+    artifact_id = hashlib.sha256(data).hexdigest()[:ID_LEN]
+    if path_of(artifact_id):
+        return artifact_id
+    d = artifacts_dir() / artifact_id[:2]
+    d.mkdir(parents=True, exist_ok=True)
+    path = d / (f"{artifact_id}.txt.gz" if _compress() else f"{artifact_id}.txt")
+    tmp = d / f".{path.name}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(gzip.compress(data) if path.suffix == '.gz' else data)
+    os.replace(tmp, path)
+    return artifact_id
+
+
+class ArtifactWriter:
+    """Builds an artifact incrementally (e.g. a command's output as it streams); close() returns its id."""
+
+    def __init__(self):
+        d = artifacts_dir() / "tmp"
+        d.mkdir(parents=True, exist_ok=True)
+        self._hash = hashlib.sha256()
+        self._tmp = d / f"{os.getpid()}_{id(self):x}.part"
+        self._gz = _compress()
+        self._f = gzip.open(self._tmp, 'wb') if self._gz else open(self._tmp, 'wb')
+        self.size = 0
+
+    def write(self, data: bytes):
+        self._hash.update(data)
+        self._f.write(data)
+        self.size += len(data)
+
+    def close(self) -> str:
+        self._f.close()
+        artifact_id = self._hash.hexdigest()[:ID_LEN]
+        if path_of(artifact_id):
+            self._tmp.unlink()
+            return artifact_id
+        d = artifacts_dir() / artifact_id[:2]
+        d.mkdir(parents=True, exist_ok=True)
+        os.replace(self._tmp, d / (f"{artifact_id}.txt.gz" if self._gz else f"{artifact_id}.txt"))
+        return artifact_id
+
+
+def path_of(artifact_id: str) -> Optional[Path]:
+    """File holding the artifact; a unique id prefix of at least 6 characters is accepted."""
+    artifact_id = (artifact_id or '').strip().lower()
+    if not re.fullmatch(r"[0-9a-f]{6,64}", artifact_id):
+        return None
+    d = artifacts_dir() / artifact_id[:2]
+    for name in (f"{artifact_id}.txt", f"{artifact_id}.txt.gz"):
+        if (d / name).is_file():
+            return d / name
+    matches = sorted(d.glob(f"{artifact_id}*.txt*")) if d.is_dir() else []
+    return matches[0] if len(matches) == 1 else None
+
+
+def get(artifact_id: str) -> Optional[str]:
+    path = path_of(artifact_id)
+    if path is None:
+        return None
+    data = path.read_bytes()
+    if path.suffix == '.gz':
+        data = gzip.decompress(data)
+    return data.decode('utf-8', errors='replace')
+
+
+def read(artifact_id: str, start_line: int = 1, num_lines: int = DEFAULT_PAGE_LINES, pattern: Optional[str] = None) -> str:
+    """A page of an artifact with line numbers, or the lines matching pattern (a regex)."""
+    text = get(artifact_id)
+    if text is None:
+        return f"Error: no artifact {artifact_id!r} (give the id shown in the truncated output)."
+    lines = text.split('\n')
+    start = max(1, int(start_line or 1))
+    count = max(1, int(num_lines or DEFAULT_PAGE_LINES))
+    if pattern:
+        try:
+            rx = re.compile(pattern)
+        except re.error as e:
+            return f"Error: invalid pattern: {e}"
+        selected = [(i, l) for i, l in enumerate(lines[start - 1:], start) if rx.search(l)][:count]
+        header = f"artifact {artifact_id}: {len(selected)} matching line(s) from line {start} ({len(lines)} lines total)"
+    else:
+        selected = list(enumerate(lines[start - 1:start - 1 + count], start))
+        end = selected[-1][0] if selected else start - 1
+        header = f"artifact {artifact_id}: lines {start}-{end} of {len(lines)}"
+    out, size = [header], len(header)
+    for i, l in selected:
+        row = f"{i}: {l}"
+        if size + len(row) > MAX_PAGE_CHARS:
+            out.append(f"... [page cut at {MAX_PAGE_CHARS} chars; continue with start_line={i}]")
+            break
+        out.append(row)
+        size += len(row) + 1
+    return '\n'.join(out)
@@ -0,0 +1,275 @@
+"""Chrome DevTools Protocol client for the javascript tool.
+
+Talks to a Chrome/Chromium started with --remote-debugging-port directly:
+the tab list comes from its /json HTTP endpoint (cached for
+EG_CDP_TARGETS_TTL_SEC seconds, default 5), each tab keeps one open
+websocket for the life of the process, and scripts run through
+Runtime.evaluate. No driver binary is downloaded, no tab is focused, and
+nothing is torn down after a call.
+
+The websocket is a minimal stdlib RFC 6455 client (text frames, masking,
+fragmentation, ping/pong), which is all CDP needs. EG_CDP_ADDRESS
+(default 127.0.0.1:9222) points it elsewhere, e.g. at
+script/fake_cdp_server.py.
+"""
+import base64
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+import executors
+
+DEFAULT_ADDRESS = "127.0.0.1:9222"
+DEFAULT_TARGETS_TTL_SEC = 5
+DEFAULT_TIMEOUT_SEC = 30
+PAGE_LOAD_TIMEOUT_SEC = 30
+
+
+class CDPError(Exception):
+    pass
+
+
+def address() -> str:
+    return os.environ.get("EG_CDP_ADDRESS", DEFAULT_ADDRESS).strip() or DEFAULT_ADDRESS
+
+
+class _WebSocket:
+    """Blocking websocket client, text messages only."""
+
+    def __init__(self, url: str, timeout: float):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != "ws":
+            raise CDPError(f"unsupported websocket URL {url!r}")
+        self.sock = socket.create_connection((parts.hostname, parts.port or 80), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buf = b""
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        self.sock.sendall((f"GET {path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\nUpgrade: websocket\r\n"
+                           f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        while b"\r\n\r\n" not in self._buf:
+            self._fill()
+        head, self._buf = self._buf.split(b"\r\n\r\n", 1)
+        status = head.split(b"\r\n", 1)[0]
+        if b" 101 " not in status + b" ":
+            raise CDPError(f"websocket handshake failed: {status.decode(errors='replace')}")
+
+    def _fill(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("websocket closed by the browser")
+        self._buf += data
+
+    def _take(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            self._fill()
+        data, self._buf = self._buf[:n], self._buf[n:]
+        return data
+
+    def _send_frame(self, opcode: int, payload: bytes):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | n)
+        elif n < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, n)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, n)
+        mask = os.urandom(4)
+        # XOR the whole payload at once through big ints instead of byte by byte
+        masked = (int.from_bytes(payload, "big") ^ int.from_bytes((mask * (n // 4 + 1))[:n], "big")).to_bytes(n, "big") if n else b""
+        self.sock.sendall(header + mask + masked)
+
+    def send(self, text: str):
+        self._send_frame(0x1, text.encode("utf-8"))
+
+    def recv(self, timeout: float) -> str:
+        self.sock.settimeout(timeout)
+        parts = []
+        while True:
+            b0, b1 = self._take(2)
+            opcode, n = b0 & 0x0F, b1 & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", self._take(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", self._take(8))[0]
+            mask = self._take(4) if b1 & 0x80 else b""
+            payload = self._take(n)
+            if mask:
+                payload = (int.from_bytes(payload, "big") ^ int.from_bytes((mask * (n // 4 + 1))[:n], "big")).to_bytes(n, "big")
+            if opcode == 0x9:
+                self._send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            if opcode == 0x8:
+                raise ConnectionError("websocket closed by the browser")
+            parts.append(payload)
+            if b0 & 0x80:
+                return b"".join(parts).decode("utf-8", errors="replace")
+
+    def close(self):
+        try:
+            self._send_frame(0x8, b"")
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class Connection:
+    """One tab's debugger websocket; call() sends a command and waits for its reply, skipping events."""
+
+    def __init__(self, ws_url: str, timeout: float = DEFAULT_TIMEOUT_SEC):
+        self.ws = _WebSocket(ws_url, timeout)
+        self._id = 0
+        self._lock = threading.Lock()
+
+    def call(self, method: str, params: Optional[Dict[str, Any]] = None, timeout: float = DEFAULT_TIMEOUT_SEC) -> Dict[str, Any]:
+        with self._lock:
+            self._id += 1
+            msg_id = self._id
+            self.ws.send(json.dumps({"id": msg_id, "method": method, "params": params or {}}))
+            deadline = time.monotonic() + timeout
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise TimeoutError(f"{method} got no reply within {timeout:g}s")
+                reply = json.loads(self.ws.recv(left))
+                if reply.get("id") != msg_id:
+                    continue
+                if "error" in reply:
+                    raise CDPError(f"{method}: {reply['error'].get('message', reply['error'])}")
+                return reply.get("result") or {}
+
+    def close(self):
+        self.ws.close()
+
+
+def url_matches(url_filter: str, candidate: str, mode: str = "exact_query") -> bool:
+    """exact: the whole URL is equal. exact_query: scheme, host and path are equal and every query
+    parameter of the filter has the same value in the candidate (order and extra parameters ignored)."""
+    if mode == "exact":
+        return candidate == url_filter
+    f, c = urllib.parse.urlparse(url_filter), urllib.parse.urlparse(candidate)
+    if (f.scheme, f.netloc, f.path) != (c.scheme, c.netloc, c.path):
+        return False
+    f_qs = dict(urllib.parse.parse_qsl(f.query, keep_blank_values=True))
+    c_qs = dict(urllib.parse.parse_qsl(c.query, keep_blank_values=True))
+    return all(c_qs.get(k) == v for k, v in f_qs.items())
+
+
+class Browser:
+    def __init__(self, addr: str):
+        self.addr = addr
+        self._targets: List[Dict[str, Any]] = []
+        self._targets_at = 0.0
+        self._connections: Dict[str, Connection] = {}
+        self._lock = threading.Lock()
+
+    def _http(self, path: str, method: str = "GET") -> Any:
+        req = urllib.request.Request(f"http://{self.addr}{path}", method=method)
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return json.loads(resp.read().decode("utf-8") or "null")
+
+    def targets(self, refresh: bool = False) -> List[Dict[str, Any]]:
+        """Open tabs (type "page"), from the cache unless it is older than the TTL."""
+        ttl = executors._env_number("EG_CDP_TARGETS_TTL_SEC", DEFAULT_TARGETS_TTL_SEC, float)
+        if refresh or time.monotonic() - self._targets_at > ttl:
+            self._targets = [t for t in self._http("/json") if t.get("type") == "page"]
+            self._targets_at = time.monotonic()
+            live = {t.get("id") for t in self._targets}
+            for target_id in [k for k in self._connections if k not in live]:
+                self._connections.pop(target_id).close()
+        return self._targets
+
+    def find(self, url_filter: str, mode: str = "exact_query") -> Optional[Dict[str, Any]]:
+        for refresh in (False, True):
+            for t in self.targets(refresh):
+                if url_matches(url_filter, t.get("url", ""), mode):
+                    return t
+        return None
+
+    def new_tab(self, url: str) -> Dict[str, Any]:
+        quoted = urllib.parse.quote(url, safe=":/?&=%#+,;@")
+        try:
+            target = self._http(f"/json/new?{quoted}", "PUT")
+        except Exception:
+            # Chrome before 111 only accepts GET here
+            target = self._http(f"/json/new?{quoted}")
+        self._targets_at = 0.0
+        return target
+
+    def connection(self, target: Dict[str, Any]) -> Connection:
+        conn = self._connections.get(target["id"])
+        if conn is None:
+            ws_url = target.get("webSocketDebuggerUrl")
+            if not ws_url:
+                raise CDPError("the tab has no webSocketDebuggerUrl (is another DevTools client attached to it?)")
+            conn = self._connections[target["id"]] = Connection(ws_url)
+        return conn
+
+    def _evaluate(self, conn: Connection, expression: str, timeout: float) -> Any:
+        res = conn.call("Runtime.evaluate", {"expression": expression, "returnByValue": True, "awaitPromise": True,
+                                             "userGesture": True}, timeout)
+        if res.get("exceptionDetails"):
+            d = res["exceptionDetails"]
+            raise CDPError((d.get("exception") or {}).get("description") or d.get("text") or "script threw")
+        return (res.get("result") or {}).get("value")
+
+    def run(self, script: str, url_filter: str = "", mode: str = "exact_query", timeout: Optional[float] = None) -> Any:
+        """Run script as a function body (use return for a value) in the matching tab, opening one if needed."""
+        timeout = timeout or executors._env_number("EG_CDP_TIMEOUT_SEC", DEFAULT_TIMEOUT_SEC, float)
+        with self._lock:
+            opened = False
+            if url_filter:
+                target = self.find(url_filter, mode)
+                if target is None:
+                    target, opened = self.new_tab(url_filter), True
+            else:
+                tabs = self.targets()
+                if not tabs:
+                    raise CDPError("No Chrome tabs found.")
+                target = tabs[0]
+            for attempt in (1, 2):
+                conn = self.connection(target)
+                try:
+                    if opened:
+                        # Like a driver's get(): wait for the new page to finish loading
+                        deadline = time.monotonic() + PAGE_LOAD_TIMEOUT_SEC
+                        while self._evaluate(conn, "document.readyState", timeout) != "complete" and time.monotonic() < deadline:
+                            time.sleep(0.1)
+                    return self._evaluate(conn, f"(async function() {{\n{script}\n}})()", timeout)
+                except TimeoutError:
+                    # A reply may still arrive mid-frame; never reuse the socket
+                    self._drop(target)
+                    raise
+                except ConnectionError:
+                    # Stale socket (tab closed its debugger session, browser restarted): reconnect once
+                    self._drop(target)
+                    if attempt == 2:
+                        raise
+
+    def _drop(self, target: Dict[str, Any]):
+        conn = self._connections.pop(target["id"], None)
+        if conn is not None:
+            conn.close()
+
+
+_browsers: Dict[str, Browser] = {}
+_browsers_lock = threading.Lock()
+
+
+def browser() -> Browser:
+    with _browsers_lock:
+        addr = address()
+        if addr not in _browsers:
+            _browsers[addr] = Browser(addr)
+        return _browsers[addr]
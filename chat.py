@@ -1,11 +1,13 @@
 import os
-import re
+import argparse
+import datetime
 import json
 import sys
 import time
 from pathlib import Path
 from rich.console import Console
 from rich.panel import Panel
+from rich.table import Table
 from rich.text import Text
 from rich.markdown import Markdown
 from prompt_toolkit import PromptSession
@@ -13,7 +15,12 @@ from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 from prompt_toolkit.document import Document
 
-from chat_client import ChatClient
+import agent_registry
+import agent_scheduler
+import output_shaper
+import chat_index
+import chat_journal
+from chat_client import ChatClient, HEADLESS_NUDGE, SUBAGENT_INSTRUCTION, headless_max_nudges
 from completer import PtkCompleter
 from executors import run_bash_script
 
@@ -32,43 +39,233 @@ def ensure_tree_id(console: Console):
 
 
 def _record_tmux_pane_if_available(console: Console):
-    """Record TMUX_PANE into this agent's state.json if running as an agent inside tmux."""
-    agent_dir = os.environ.get('EG_AGENT_DIR')
+    """Record TMUX_PANE into this agent's registry entry if running as an agent inside tmux."""
     pane = os.environ.get('TMUX_PANE', '')
-    if not agent_dir or not pane:
+    tree_id, agent_id, parent_id = agent_registry.current_identity()
+    if not tree_id or not pane:
         return
     try:
-        state_path = Path(agent_dir) / 'state.json'
-        if state_path.exists():
+        reg = agent_registry.get_registry()
+        row = reg.get(tree_id, agent_id, parent_id) or {}
+        if row.get('pane_id') != pane:
+            fields = {"pane_id": pane}
+            if agent_id == 'root':
+                fields["dir"] = str(agent_registry.DEFAULT_BASE / tree_id / 'root')
+            reg.upsert(tree_id, agent_id, parent_id, **fields)
+    except Exception as e:
+        console.print(f"[yellow]Warning: could not record TMUX_PANE: {e}[/yellow]")
+
+
+def _wait_in_pool(client: ChatClient, console: Console):
+    """Idle as a warm pool slot, then adopt the identity of the child that claimed us."""
+    import agent_pool
+    client.warm_connection()
+    console.print(Panel("Idle in agent pool, waiting to be claimed...", title="[bold]Agent Pool[/bold]", border_style="magenta"))
+    claim = agent_pool.wait_for_claim(os.environ['EG_POOL_SLOT_DIR'])
+    if not claim:
+        pane = os.environ.get('TMUX_PANE', '')
+        if pane:
+            run_bash_script(f"tmux kill-pane -t {pane} 2>/dev/null || true")
+        sys.exit(0)
+    agent_pool.apply_claim(claim)
+    model_key = claim.get('model_key') or os.environ.get('EG_CHILD_MODEL')
+    if model_key and model_key != client.current_model_key:
+        client.switch_model(model_key)
+    else:
+        client._persist_model_to_state()
+    if os.environ.get('EG_YES_TOOL_FLAG', '').strip().lower() in ("1", "true", "yes", "on"):
+        client.yesToolFlag = True
+
+
+def _inject_initial_context(client: ChatClient, console: Console) -> bool:
+    """Send a child agent's init_context.txt as its first turn. Returns True if it was sent."""
+    try:
+        agent_dir = os.environ.get('EG_AGENT_DIR')
+        init_ctx_file = os.environ.get('EG_INIT_CONTEXT_FILE')
+        # Propagate model to child via environment or parent state
+        if agent_dir:
             try:
-                with open(state_path, 'r') as f:
-                    st = json.load(f)
+                # If DEFAULT_MODEL present, use it; else attempt to copy parent's model_key
+                default_model_env = os.environ.get('DEFAULT_MODEL')
+                if not default_model_env:
+                    parent_id = os.environ.get('EG_PARENT_ID')
+                    tree_id = os.environ.get('EG_TREE_ID')
+                    if tree_id and parent_id:
+                        try:
+                            pst = agent_registry.get_registry().get(tree_id, parent_id) or {}
+                            mk = pst.get('model_key')
+                            if isinstance(mk, str) and mk:
+                                os.environ['DEFAULT_MODEL'] = mk
+                        except Exception:
+                            pass
             except Exception:
-                st = {}
-        else:
-            st = {}
-        if st.get('pane_id') != pane:
-            st['pane_id'] = pane
-            with open(state_path, 'w') as f:
-                json.dump(st, f, indent=2)
+                pass
+        consumed_marker = os.path.join(agent_dir, '.context_consumed') if agent_dir else None
+        if init_ctx_file and os.path.isfile(init_ctx_file) and (not consumed_marker or not os.path.exists(consumed_marker)):
+            with open(init_ctx_file, 'r', encoding='utf-8') as f:
+                init_text = f.read().strip()
+            if init_text:
+                instruction = SUBAGENT_INSTRUCTION
+                # Ensure the model sees the instruction inline in the prompt
+                client.messages.append({"role": "user", "content": f"{init_text}\n\n{instruction}"})
+                # Display subagent info and initial context visibly
+                tree_id = os.environ.get('EG_TREE_ID')
+                parent_id = os.environ.get('EG_PARENT_ID')
+                agent_id = os.environ.get('EG_AGENT_ID')
+                if client.headless:
+                    console.print(f"Subagent {agent_id} (tree {tree_id}, parent {parent_id})\n\n{init_text}", markup=False)
+                else:
+                    console.print(Panel(
+                        f"Subagent active.\nTree: {tree_id}\nParent: {parent_id}\nAgent: {agent_id}\n\nWhen finished, run: /popContext <return_value>",
+                        title="[bold]Subagent Context[/bold]",
+                        border_style=client.get_border_style("magenta"),
+                        box=client.boxStyle
+                    ))
+                    console.print(Panel(Text(init_text), title="[bold]Initial Context[/bold]", border_style=client.get_border_style("cyan"), box=client.boxStyle))
+                    console.print(Panel(Text(instruction), title="[bold]How to Finish[/bold]", border_style=client.get_border_style("yellow"), box=client.boxStyle))
+                client.send_message("")
+                if consumed_marker:
+                    with open(consumed_marker, 'w') as cf:
+                        cf.write('1')
+                return True
+    except Exception:
+        pass
+    return False
+
+
+def _run_headless(client: ChatClient, console: Console):
+    """Run a child agent without a prompt: send its task, re-prompt until popContext, then give up."""
+    # Nobody can answer approval prompts; pop_context exits the process when the agent finishes
+    client.yesToolFlag = True
+    if _inject_initial_context(client, console):
+        for _ in range(headless_max_nudges()):
+            client.in_single_turn_auto_execute_calls = False
+            client.display_manager.render_message({"role": "user", "content": HEADLESS_NUDGE})
+            client.send_message(HEADLESS_NUDGE)
+        reason = f"agent did not call popContext after {headless_max_nudges()} reminders"
+    else:
+        reason = "no initial context to run"
+    console.print(f"Headless agent stopping: {reason}", markup=False)
+    last = next((m.get("content") for m in reversed(client.messages) if m.get("role") == "assistant" and m.get("content")), "")
+    try:
+        tree_id, agent_id, parent_id = agent_registry.current_identity()
+        agent_registry.get_registry().finish(tree_id, agent_id, parent_id, {
+            "status": "error",
+            "return_value": last or "",
+            "short_recap": client.short_recap or "",
+            "error": reason,
+            "finished_at": int(time.time()),
+        })
+        agent_scheduler.dispatch(tree_id)
     except Exception as e:
-        console.print(f"[yellow]Warning: could not record TMUX_PANE: {e}[/yellow]")
+        console.print(f"Error writing agent result: {e}", markup=False)
+    client.save_chat()
+    sys.exit(1)
+
+
+def _offer_resume(client: ChatClient, console: Console, requested: str = None):
+    """Resume the requested session, or point out sessions that ended without a clean exit."""
+    interrupted = chat_journal.interrupted_sessions(client.chat_dir)
+    if requested:
+        target = str(interrupted[0]) if requested == 'last' and interrupted else requested
+        if requested == 'last' and not interrupted:
+            console.print("[yellow]No interrupted session to resume.[/yellow]")
+            return
+        client.resume_session(target)
+        return
+    if interrupted:
+        names = ", ".join(p.stem for p in interrupted[:3])
+        console.print(f"[yellow]Interrupted session(s) found: {names}. Type /resume to continue the latest.[/yellow]")
+
+
+def _history_command(client: ChatClient, console: Console, rest: str, hits: list):
+    """/history search <query> | open <n|name> | reindex. hits keeps the last search for open <n>."""
+    sub, _, arg = rest.partition(" ")
+    arg = arg.strip()
+    if sub == "reindex":
+        counts = chat_index.reindex(client.chat_dir)
+        console.print(f"[dim]History index: {counts['indexed']} indexed, {counts['removed']} removed, {counts['total']} files.[/dim]")
+        return
+    if sub == "search" and arg:
+        if not chat_index.is_built(client.chat_dir):
+            console.print("[dim]Building history index...[/dim]")
+            chat_index.reindex(client.chat_dir)
+        hits[:] = chat_index.search(client.chat_dir, arg)
+        if not hits:
+            console.print(f"[yellow]No chats match '{arg}'.[/yellow]")
+            return
+        table = Table(box=client.boxStyle, show_lines=False)
+        for col in ("#", "When", "Kind", "Model", "Recap / match"):
+            table.add_column(col, overflow="fold")
+        for i, h in enumerate(hits, 1):
+            when = datetime.datetime.fromtimestamp(h["ts"]).strftime("%Y-%m-%d %H:%M") if h.get("ts") else ""
+            body = Text(h.get("recap") or Path(h["path"]).name, style="bold")
+            body.append("\n" + (h.get("snippet") or "").replace("\n", " "), style="dim")
+            table.add_row(str(i), when, h["kind"], h.get("model_key") or "", body)
+        console.print(table)
+        console.print("[dim]/history open <#> to load a match.[/dim]")
+        return
+    if sub == "open" and arg:
+        if arg.isdigit() and 0 < int(arg) <= len(hits):
+            client.load_chat(hits[int(arg) - 1]["path"])
+        else:
+            client.load_chat(arg)
+        return
+    console.print("[yellow]Usage: /history search <query> | /history open <#|name> | /history reindex[/yellow]")
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Egg chat agent")
+    # --tree/--inline are consumed by chat.sh and forwarded; accepted here so they do not error
+    parser.add_argument('--tree', help=argparse.SUPPRESS)
+    parser.add_argument('--inline', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--headless', action='store_true',
+                        help="run as a child agent without a prompt or rich rendering, logging plain text to stdout")
+    parser.add_argument('--resume', nargs='?', const='last', metavar='SESSION',
+                        help="continue a journaled session (default: the most recent interrupted one)")
+    parser.add_argument('--worker', action='store_true',
+                        help="run child agents queued on the job broker (EG_BROKER) instead of chatting")
+    parser.add_argument('--broker', help="broker address for --worker: HOST:PORT or unix:/path (default: EG_BROKER)")
+    parser.add_argument('--slots', type=int, default=1, help="agents a --worker runs at once (default 1)")
+    args, _ = parser.parse_known_args(argv)
+    return args
 
 
 def main():
+    args = _parse_args()
+    if args.worker:
+        import agent_worker
+        agent_worker.run(args.broker, args.slots)
+        return
     console = Console()
 
     # Ensure per-run new tree unless explicitly provided
     try:
-        client = ChatClient()
+        client = ChatClient(headless=args.headless)
     except ValueError as e:
         console.print(f"[bold red]Error: {e}[/bold red]")
         console.print("Please provide necessary API environment variables.")
         return
 
+    # Pooled agents idle here until a spawn claims them (or the idle timeout expires)
+    if os.environ.get('EG_POOL_SLOT_DIR'):
+        _wait_in_pool(client, console)
+
+    if args.headless:
+        _run_headless(client, client.console)
+        return
+
     # Record current pane id for deterministic pane targeting
     _record_tmux_pane_if_available(console)
 
+    # Pre-fill the tree's warm agent pool from the root agent
+    if not os.environ.get('EG_AGENT_DIR') and os.environ.get('TMUX'):
+        import agent_pool
+        if agent_pool.pool_size() > 0:
+            from tool_manager import _ensure_session, _resolve_tree_id
+            tree_id = _resolve_tree_id()
+            agent_pool.refill_async(tree_id, 'root', _ensure_session(tree_id), str(Path.cwd()))
+
     def get_prompt_message():
         model_name = client.current_model_key
         return f"[You & {model_name}]: " if client.borders_enabled else f"You & {model_name}: "
@@ -172,10 +369,15 @@ def main():
             "[bold]/spawn <file.md?> <text>[/bold] - Spawn child with the given context.\n"
             "[bold]/spawn_auto <file.md?> <text>[/bold] - Spawn child with auto tool-approval.\n"
             "[bold]/wait <child_id|space-separated list>|any|all[/bold] - Wait for specific child agents, any, or all.\n"
+            "[bold]/tree [tree_id][/bold] - List child agents of the current (or given) tree.\n"
+            "[bold]/attach [tree_id] <child_id>[/bold] - Show a headless child's output log in a pane (or print its tail outside tmux).\n"
             "[bold]/toggleEscape[/bold] - Toggle display of tool call arguments between escaped and unescaped.\n"
             "[bold]/exportHtml <filename.html>[/bold] - Export current chat as a visually striking HTML page.\n"
             "[bold]/updateAllModels <provider>[/bold] - Fetch and cache the provider's full model catalog to all-models.json.\n"
             "[bold]/drop[/bold] - Drop the last conversation exchange and redraw.\n"
+            "[bold]/resume [session][/bold] - Continue a journaled session (default: the last interrupted one).\n"
+            "[bold]/load <chat>[/bold] - Load a saved chat or session journal.\n"
+            "[bold]/history search <query>[/bold] - Search all saved chats, sessions and agent transcripts; [bold]/history open <#>[/bold] loads a hit.\n"
             "[bold]/quit[/bold] - Quit the chat application.",
             title="[bold]Welcome[/bold]",
             border_style=client.get_border_style("magenta")
@@ -193,59 +395,16 @@ def main():
         sys.exit(0)
 
     # Auto-inject initial context for child agents
-    try:
-        agent_dir = os.environ.get('EG_AGENT_DIR')
-        init_ctx_file = os.environ.get('EG_INIT_CONTEXT_FILE')
-        # Propagate model to child via environment or parent state
-        if agent_dir:
-            try:
-                # If DEFAULT_MODEL present, use it; else attempt to copy parent's model_key
-                default_model_env = os.environ.get('DEFAULT_MODEL')
-                if not default_model_env:
-                    parent_id = os.environ.get('EG_PARENT_ID')
-                    tree_id = os.environ.get('EG_TREE_ID')
-                    if tree_id and parent_id:
-                        state_path = Path('.egg/agents') / tree_id / parent_id / 'state.json'
-                        if state_path.exists():
-                            try:
-                                with open(state_path, 'r') as f:
-                                    pst = json.load(f)
-                                mk = pst.get('model_key') if isinstance(pst, dict) else None
-                                if isinstance(mk, str) and mk:
-                                    os.environ['DEFAULT_MODEL'] = mk
-                            except Exception:
-                                pass
-            except Exception:
-                pass
-        consumed_marker = os.path.join(agent_dir, '.context_consumed') if agent_dir else None
-        if init_ctx_file and os.path.isfile(init_ctx_file) and (not consumed_marker or not os.path.exists(consumed_marker)):
-            with open(init_ctx_file, 'r', encoding='utf-8') as f:
-                init_text = f.read().strip()
-            if init_text:
-                instruction = "[SYSTEM NOTE] You are a subagent. When you finish this task, you MUST call the /popContext command with your result. If the result is longer, you can create a file to store it. Use the popContext tool. Example: /popContext My result is in ./output.md"
-                # Ensure the model sees the instruction inline in the prompt
-                client.messages.append({"role": "user", "content": f"{init_text}\n\n{instruction}"})
-                # Display subagent info and initial context visibly
-                tree_id = os.environ.get('EG_TREE_ID')
-                parent_id = os.environ.get('EG_PARENT_ID')
-                agent_id = os.environ.get('EG_AGENT_ID')
-                console.print(Panel(
-                    f"Subagent active.\nTree: {tree_id}\nParent: {parent_id}\nAgent: {agent_id}\n\nWhen finished, run: /popContext <return_value>",
-                    title="[bold]Subagent Context[/bold]",
-                    border_style=client.get_border_style("magenta"),
-                    box=client.boxStyle
-                ))
-                console.print(Panel(Text(init_text), title="[bold]Initial Context[/bold]", border_style=client.get_border_style("cyan"), box=client.boxStyle))
-                console.print(Panel(Text(instruction), title="[bold]How to Finish[/bold]", border_style=client.get_border_style("yellow"), box=client.boxStyle))
-                client.send_message("")
-                if consumed_marker:
-                    with open(consumed_marker, 'w') as cf:
-                        cf.write('1')
-    except Exception:
-        pass
+    _inject_initial_context(client, console)
+
+    if not os.environ.get('EG_AGENT_DIR'):
+        _offer_resume(client, console, args.resume)
 
+    history_hits = []
     while True:
         try:
+            # Commands above append to client.messages directly; journal them before waiting for input
+            client.journal_sync()
             client.in_single_turn_auto_execute_calls = False
             user_input = session.prompt().strip()
             try:
@@ -268,69 +427,24 @@ def main():
                 add_to_context = user_input.startswith("$ ")
                 script_to_run = user_input[2:].strip() if add_to_context else user_input[3:].strip()
                 if script_to_run:
-                    output = run_bash_script(script_to_run)
-                    # Sanitize output: strip ANSI escapes and control chars (keep \n, \t, \r)
-                    try:
-                        ansi_re = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
-                        output_clean = ansi_re.sub("", output)
-                        output_clean = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]", "", output_clean)
-                    except Exception:
-                        output_clean = output
-
-                    # Check if output is long (more than 800 lines or more than 100,000 characters)
-                    line_count = len(output_clean.split('\n'))
-                    char_count = len(output_clean)
-                    is_long_output = line_count > 800 or char_count > 100000
-                    user_wants_full_output = True
-                    
-                    # Ask user for confirmation if output is long
-                    if is_long_output:
-                        if line_count > 800:
-                            console.print(f"[yellow]Warning: Output is {line_count} lines long (over 800 lines).[/yellow]")
-                        elif char_count > 100000:
-                            console.print(f"[yellow]Warning: Output is {char_count} characters long (over 100,000 characters).[/yellow]")
+                    from tool_manager import _live_output
+                    import shell_session
+                    # $ shares the agent's persistent shell (when enabled) so a `$ cd` carries over to its bash calls
+                    output = run_bash_script(script_to_run, on_output=_live_output(client),
+                                             session=shell_session.for_client(client) if shell_session.enabled() else None)
+                    # Clean and fit the output to the bash budget; a cut output stays readable as an artifact
+                    model_config = client.models_config.get(client.current_model_key) or {}
+                    output_clean = output_shaper.clean(output)
+                    preview, was_cut = output_shaper.shape(output, "bash", model_config)
+                    if was_cut and add_to_context:
+                        console.print(f"[yellow]Output was cut to fit the bash token budget (full output ~{output_shaper.estimate_tokens(output_clean)} tokens).[/yellow]")
                         while True:
                             response = input("Include full output in context? [y/n] ").strip().lower()
                             if response in ('y', 'n'):
                                 break
                             console.print("Invalid input. Please enter y or n")
-                        
-                        user_wants_full_output = (response == 'y')
-
-                    # Limit payload size to keep provider happy
-                    MAX_PREVIEW = 15000  # characters
-                    preview = output_clean
-                    saved_path = None
-                    
-                    if user_wants_full_output:
-                        # User wants full output, don't truncate
-                        preview = output_clean
-                    elif len(output_clean) > MAX_PREVIEW:
-                        # Save full output to an artifact file
-                        artifacts_dir = Path.cwd() / ".egg" / "artifacts"
-                        artifacts_dir.mkdir(parents=True, exist_ok=True)
-                        ts = int(time.time())
-                        fname = f"bash_output_{ts}.txt"
-                        fpath = artifacts_dir / fname
-                        try:
-                            fpath.write_text(output_clean, encoding="utf-8", newline="\n")
-                            saved_path = str(fpath.relative_to(Path.cwd()))
-                        except Exception:
-                            # Fallback to temp directory if current write fails
-                            try:
-                                tmp_dir = Path.cwd() / ".egg"
-                                tmp_dir.mkdir(parents=True, exist_ok=True)
-                                fpath = tmp_dir / fname
-                                fpath.write_text(output_clean, encoding="utf-8", newline="\n")
-                                saved_path = str(fpath.relative_to(Path.cwd()))
-                            except Exception:
-                                saved_path = None
-                        preview = output_clean[:MAX_PREVIEW] + "\n... [truncated]"
-                    elif is_long_output and line_count > 800:
-                        # User doesn't want long output, truncate to 100 lines
-                        lines = output_clean.split('\n')
-                        preview = '\n'.join(lines[:100]) + f"\n... [truncated, {line_count - 100} more lines]"
-                        saved_path = None
+                        if response == 'y':
+                            preview, was_cut = output_clean, False
 
                     header = f"Local Command Output"
                     
@@ -345,27 +459,27 @@ def main():
                     
                     if client.borders_enabled:
                         # First render raw output in panel
-                        output_renderable = Text(output_clean if saved_path is None else output_clean[:MAX_PREVIEW] + "\n... [truncated in display]")
+                        output_renderable = Text(preview)
                         console.print(Panel(output_renderable, title="[bold green]Local Command Output (Raw)[/bold green]", border_style="green", box=client.boxStyle))
                         
                         # Then render as markdown if it appears to be markdown
                         if client.display_manager._is_markdown_content(content_for_markdown):
-                            markdown_renderable = Markdown(content_for_markdown if saved_path is None else content_for_markdown[:MAX_PREVIEW] + "\n... [truncated in display]")
+                            markdown_renderable = Markdown(preview if was_cut else content_for_markdown)
                             console.print(Panel(markdown_renderable, title="[bold green]Local Command Output (Markdown)[/bold green]", border_style="green", box=client.boxStyle))
                     else:
                         # First render raw output
                         console.print(f"--- {header} ---")
-                        console.print(Text(output_clean if saved_path is None else preview))
+                        console.print(Text(preview))
                         
                         # Then render as markdown if it appears to be markdown
                         if client.display_manager._is_markdown_content(content_for_markdown):
                             console.print("\n[cyan]Markdown Rendering:[/cyan]")
-                            console.print(Markdown(content_for_markdown if saved_path is None else content_for_markdown[:MAX_PREVIEW]))
+                            console.print(Markdown(preview if was_cut else content_for_markdown))
                         else:
-                            console.print(Text(output_clean if saved_path is None else preview))
+                            console.print(Text(preview))
 
-                    if saved_path:
-                        output_section_title = f"Output too long; saved to: {saved_path}"
+                    if was_cut:
+                        output_section_title = "Output (shortened; the note inside names the artifact holding all of it):"
                     else:
                         output_section_title = "Output:"
 
@@ -464,6 +578,29 @@ def main():
                 client.toggle_thinking_display()
                 continue
 
+            elif user_input.startswith("/resume"):
+                name = user_input[len("/resume"):].strip()
+                if not name:
+                    interrupted = chat_journal.interrupted_sessions(client.chat_dir)
+                    if not interrupted:
+                        console.print("[yellow]No interrupted session to resume. Usage: /resume <session>[/yellow]")
+                        continue
+                    name = str(interrupted[0])
+                client.resume_session(name)
+                continue
+
+            elif user_input.startswith("/history"):
+                _history_command(client, console, user_input[len("/history"):].strip(), history_hits)
+                continue
+
+            elif user_input.startswith("/load"):
+                name = user_input[len("/load"):].strip()
+                if not name:
+                    console.print("[yellow]Usage: /load <chat file or session>[/yellow]")
+                    continue
+                client.load_chat(name)
+                continue
+
             elif user_input.startswith("/drop"):
                 # Handle drop command locally
                 try:
@@ -679,6 +816,24 @@ def main():
                     client.send_message(tool_call_json)
                 continue
 
+            elif user_input.startswith("/tree"):
+                # Handle locally; list the children of this (or the given) tree from the registry
+                rest = user_input[len("/tree"):].strip()
+                from tool_manager import tool_list_agents
+                result_json = tool_list_agents({"tree_id": rest} if rest else {})
+                console.print(Panel(Text(result_json), title="[bold green]Agent Tree[/bold green]", border_style="green", box=client.boxStyle))
+                continue
+
+            elif user_input.startswith("/attach"):
+                parts = user_input.split()
+                if len(parts) not in (2, 3):
+                    console.print("[yellow]Usage: /attach [tree_id] <child_id>[/yellow]")
+                    continue
+                from tool_manager import attach_agent
+                out = attach_agent(parts[-1], parts[1] if len(parts) == 3 else None)
+                console.print(Text(out))
+                continue
+
             elif user_input.startswith("/quit"):
                 # Handle quit command locally
                 console.print("[cyan]Quitting chat...[/cyan]")
@@ -709,6 +864,9 @@ def rename_tree(old_id: str, new_id: str, console: Console, manual: bool = False
     # Update the .current_tree file
     (base / '.current_tree').write_text(new_id)
 
+    # Move the tree's registry entries along with the directory
+    agent_registry.get_registry().rename_tree(old_id, new_id, str(old_dir.resolve()), str(new_dir.resolve()))
+
     # Update the environment variable
     os.environ['EG_TREE_ID'] = new_id
 
@@ -1,12 +1,15 @@
 import os
 import sys
 import json
+import glob
 import datetime
 import re
 import requests
 import uuid
+import atexit
 import time
 from pathlib import Path
+from urllib.parse import urlsplit
 from typing import List, Dict, Optional, Any
 
 import tiktoken
@@ -15,10 +18,28 @@ from rich.panel import Panel
 from rich.live import Live
 from rich import box
 
+import agent_registry
+import agent_scheduler
+import chat_index
+import chat_journal
 from config import load_configs
 from display import DisplayManager
+import repo_map
 import tool_manager
 
+SUBAGENT_INSTRUCTION = ("[SYSTEM NOTE] You are a subagent. When you finish this task, you MUST call the /popContext command with your result. "
+                        "If the result is longer, you can create a file to store it. Use the popContext tool. Example: /popContext My result is in ./output.md")
+HEADLESS_NUDGE = ("[SYSTEM NOTE] You have not called popContext yet. Continue the task if it is unfinished; "
+                  "otherwise call the popContext tool now with your result.")
+
+
+def headless_max_nudges() -> int:
+    """Reminders an unattended agent gets before it is stopped for never calling popContext."""
+    try:
+        return max(0, int(os.environ.get('EG_HEADLESS_MAX_NUDGES', '3') or 3))
+    except ValueError:
+        return 3
+
 
 class ChatClient:
     def get_aimd_words_for_completion(self):
@@ -40,15 +61,24 @@ class ChatClient:
         out = [w for w in words[::-1] if (wl := w.lower()) not in seen and not seen.add(wl)][:limit]
         return out[::-1]
 
-    def __init__(self):
+    def __init__(self, headless: bool = False):
+        # Headless agents log plain text to a file: no terminal features, no Live/TmuxBox rendering
+        self.headless = headless
         # Keep borders visible; avoid Live repaint loops in tmux by centralizing streaming in DisplayManager
-        self.console = Console(force_terminal=True, legacy_windows=False)
+        self.console = Console(force_terminal=not headless, legacy_windows=False, highlight=not headless)
         self.display_manager = DisplayManager(self)
         self.headers = {"Content-Type": "application/json"}
+        # Shared keep-alive connection pool for provider requests
+        self.http = requests.Session()
         # Start with borders disabled by default
         self.borders_enabled = True
         self.chat_dir = Path.cwd() / ".egg/localChats"
         self.chat_dir.mkdir(parents=True, exist_ok=True)
+        # Messages are journaled as they are finalized so a crash or killed pane loses nothing
+        self.journal: Optional[chat_journal.ChatJournal] = None
+        if chat_journal.enabled():
+            self.journal = chat_journal.ChatJournal(self.chat_dir)
+            atexit.register(self.close_journal)
         self.current_model_key = None
         self.base_url = None
         self.models_config, self.providers_config = load_configs()
@@ -67,16 +97,13 @@ class ChatClient:
                 self.yesToolFlag = True
         except Exception:
             pass
-        # Also check agent state.json if running as a subagent
+        # Also check the agent registry if running as a subagent
         try:
-            agent_dir = os.environ.get('EG_AGENT_DIR')
-            if agent_dir:
-                st_path = Path(agent_dir) / 'state.json'
-                if st_path.exists():
-                    with open(st_path, 'r') as f:
-                        st = json.load(f)
-                    if isinstance(st, dict) and st.get('auto_tool_approve'):
-                        self.yesToolFlag = True
+            tree_id, agent_id, parent_id = agent_registry.current_identity()
+            if tree_id and os.environ.get('EG_AGENT_DIR'):
+                st = agent_registry.get_registry().get(tree_id, agent_id, parent_id) or {}
+                if st.get('auto_approve'):
+                    self.yesToolFlag = True
         except Exception:
             pass
         self.show_thinking = True
@@ -152,28 +179,30 @@ class ChatClient:
         self._persist_model_to_state()
 
     def _persist_model_to_state(self):
-        """Persist the currently selected display model key into this agent's state.json if available."""
+        """Persist the currently selected display model key into this agent's registry entry if available."""
         try:
-            agent_dir = os.environ.get('EG_AGENT_DIR')
-            if not agent_dir:
+            if not os.environ.get('EG_AGENT_DIR'):
                 return
-            st_path = Path(agent_dir) / 'state.json'
-            state = {}
-            if st_path.exists():
-                try:
-                    with open(st_path, 'r') as f:
-                        state = json.load(f) or {}
-                except Exception:
-                    state = {}
-            state['model_key'] = self.current_model_key
-            with open(st_path, 'w') as f:
-                json.dump(state, f, indent=2)
+            tree_id, agent_id, parent_id = agent_registry.current_identity()
+            if not tree_id:
+                return
+            agent_registry.get_registry().upsert(tree_id, agent_id, parent_id, model_key=self.current_model_key)
         except Exception as e:
             try:
                 self.console.print(f"[yellow]Warning: could not persist model selection: {e}[/yellow]")
             except Exception:
                 pass
 
+    def warm_connection(self):
+        """Open a keep-alive connection to the current provider so the first request skips TCP/TLS setup."""
+        if not self.base_url:
+            return
+        try:
+            parts = urlsplit(self.base_url)
+            self.http.head(f"{parts.scheme}://{parts.netloc}/", timeout=5)
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+
     def _all_models_path(self) -> Path:
         return Path(__file__).resolve().parent / "all-models.json"
 
@@ -308,6 +337,10 @@ class ChatClient:
                 if self.aimd_content:
                     system_prompt_content += "\nTHIS PROJECT'S INSTRUCTIONS AND RULES:\n\n" + self.aimd_content
         except FileNotFoundError: pass
+        try:
+            system_prompt_content += repo_map.prompt_section(Path.cwd())
+        except Exception:
+            pass
         return system_prompt_content
 
     def _initialize_system_prompt(self):
@@ -329,29 +362,18 @@ class ChatClient:
         agent_dir = os.environ.get('EG_AGENT_DIR')
         if agent_dir:
             try:
-                result_path = Path(agent_dir) / 'result.json'
                 res = {
                     "status": "done",
                     "return_value": return_value,
                     "short_recap": self.short_recap or "",
                     "finished_at": int(datetime.datetime.now().timestamp())
                 }
-                with open(result_path, 'w') as f:
-                    json.dump(res, f, indent=2)
-                # update state
-                st_path = Path(agent_dir) / 'state.json'
-                try:
-                    with open(st_path, 'r') as f:
-                        st = json.load(f)
-                except Exception:
-                    st = {}
-                st['status'] = 'done'
-                with open(st_path, 'w') as f:
-                    json.dump(st, f, indent=2)
-                # notify
-                notify_dir = Path(agent_dir) / 'notify'
-                notify_dir.mkdir(exist_ok=True, parents=True)
-                (notify_dir / 'done').write_text('1')
+                # Registry row + result.json/state.json export + notify/done for waiters
+                tree_id, agent_id, parent_id = agent_registry.current_identity()
+                agent_registry.get_registry().upsert(tree_id, agent_id, parent_id, dir=agent_dir)
+                agent_registry.get_registry().finish(tree_id, agent_id, parent_id, res)
+                # This slot is free now; start queued siblings that fit
+                agent_scheduler.dispatch(tree_id)
             except Exception as e:
                 self.console.print(f"[bold red]Error writing agent result: {e}[/bold red]")
         
@@ -532,9 +554,19 @@ class ChatClient:
         
         return parameters
 
+    def journal_sync(self):
+        """Append newly finalized messages (or a cut back, after /drop or a pop) to the session journal."""
+        if self.journal is None:
+            return
+        try:
+            self.journal.sync(self.messages)
+        except Exception as e:
+            self.console.print(f"[yellow]Warning: chat journal write failed: {e}[/yellow]")
+
     def send_message(self, message: str):
         # Add the model key to the user message for persistent storage
         self.messages.append({"role": "user", "content": message, "model_key": self.current_model_key})
+        self.journal_sync()
         while True:
             model_config = self.models_config.get(self.current_model_key, {})
             api_model_name = model_config.get("model_name")
@@ -546,7 +578,8 @@ class ChatClient:
             assistant_text_parts, reasoning_parts, tool_calls_buf, interrupted = [], [], {}, False
             in_tmux = bool(os.environ.get("TMUX"))
             # Begin streaming via DisplayManager
-            self.display_manager.begin_stream(self.current_model_key, mode=("tmux" if in_tmux else "normal"))
+            mode = "headless" if self.headless else ("tmux" if in_tmux else "normal")
+            self.display_manager.begin_stream(self.current_model_key, mode=mode)
             try:
                 # Get merged parameters from provider and model configuration
                 parameters = self._get_model_parameters(model_config)
@@ -556,7 +589,7 @@ class ChatClient:
                 #payload = {"model": api_model_name, "messages": messages_for_api, "stream": True}
                 payload.update(parameters)
                 #600 because thinking models sometimes take time to start answering //if thinking not output
-                response = requests.post(f"{self.base_url}", headers=self.headers, json=payload, timeout=600, stream=True)
+                response = self.http.post(f"{self.base_url}", headers=self.headers, json=payload, timeout=600, stream=True)
                 response.raise_for_status()
                 
                 for line in response.iter_lines():
@@ -637,14 +670,19 @@ class ChatClient:
             
             if assistant_msg.get("content"): self.short_recap = self.extract_short_recap(assistant_msg.get("content"))
             self.messages.append(assistant_msg)
+            self.journal_sync()
 
             # End streaming cleanly (normal mode closes Live; tmux prints a rule only)
             self.display_manager.end_stream(assistant_msg)
             
             if tool_calls := assistant_msg.get("tool_calls"):
                 # In tmux mode we already streamed tool deltas; avoid extra display prints
-                display_calls = should_redisplay and (self.display_manager._stream_mode != "tmux")
-                for tc in tool_calls: tool_manager.handle_tool_call(self, tc, display_call=display_calls)
+                display_calls = should_redisplay and (self.display_manager._stream_mode != "tmux") and not self.headless
+                # Spawns in one assistant turn share a single round of tmux commands
+                with tool_manager.spawn_batch():
+                    for tc in tool_calls:
+                        tool_manager.handle_tool_call(self, tc, display_call=display_calls)
+                        self.journal_sync()
                 continue
             break
 
@@ -660,7 +698,7 @@ class ChatClient:
         base_messages = self._sanitize_messages_for_api(self.messages)
         one_off = base_messages + [{"role": "user", "content": context_message}]
         try:
-            requests.post(
+            self.http.post(
                 f"{self.base_url}",
                 headers=self.headers,
                 json={
@@ -731,9 +769,26 @@ class ChatClient:
         file_name = f"{timestamp}_{file_prefix}_{safe_identifier}.json" if safe_identifier else f"{timestamp}_{file_prefix}.json"
         file_path = self.chat_dir / file_name
         with open(file_path, "w") as f: json.dump(messages_to_save, f, indent=2)
+        try:
+            chat_index.index_messages(self.chat_dir, file_path, messages_to_save)
+        except Exception:
+            pass
         return str(file_path)
 
+    def close_journal(self):
+        """Close the session journal (clean exit) and add the finished session to the history index."""
+        journal = self.journal
+        if journal is None:
+            return
+        journal.close()
+        try:
+            if journal.path.exists():
+                chat_index.index_messages(self.chat_dir, journal.path, journal.messages())
+        except Exception:
+            pass
+
     def load_chat(self, chat_name: str):
+        """Load a saved chat (.json in localChats) or a session journal by name or unique substring."""
         self.console.print(f"Loading chat: {chat_name}")
         chat_file = None
         
@@ -741,8 +796,9 @@ class ChatClient:
         if potential_file.is_file():
             chat_file = potential_file
         else:
-            all_chats = [f for f in self.chat_dir.iterdir() if f.suffix == ".json"]
-            partial_matches = [f for f in all_chats if chat_name in f.name]
+            partial_matches = [f for f in self.chat_dir.glob(f"*{glob.escape(chat_name)}*.json") if f.is_file()]
+            if not partial_matches:
+                partial_matches = chat_journal.find_session(self.chat_dir, chat_name)
             if len(partial_matches) == 1:
                 chat_file = partial_matches[0]
             elif len(partial_matches) > 1:
@@ -753,17 +809,62 @@ class ChatClient:
         if not chat_file:
             self.console.print(f"[bold red]Error: Chat file for '{chat_name}' not found.[/bold red]")
             return
-        if sanitized_msg.get("role") == "assistant" and "tool_calls" in sanitized_msg:
-            if not sanitized_msg["tool_calls"]:
-                sanitized_msg["tool_calls"] = []
+        if chat_file.suffix == ".jsonl":
+            self.resume_session(chat_file)
+            return
         try:
             with open(chat_file, "r") as f: loaded_messages = json.load(f)
-            self._clear_display()
-            self.messages.clear()
-            for i, msg in enumerate(loaded_messages):
-                self.messages.append(msg)
-                if msg.get("role") == "system" and i == 0: self.display_manager.render_system_prompt(msg["content"])
-                else: self.display_manager.render_message(msg)
-            self.console.print("--- End of loaded conversation ---", style="dim")
+            self.messages = loaded_messages
+            self._render_loaded_messages()
         except (FileNotFoundError, json.JSONDecodeError) as e:
             self.console.print(f"[bold red]Error loading chat: {e}[/bold red]")
+
+    def resume_session(self, session) -> bool:
+        """Continue a journaled session: load its messages and keep appending to the same journal."""
+        path = Path(session)
+        if not path.is_file():
+            matches = chat_journal.find_session(self.chat_dir, str(session))
+            if len(matches) != 1:
+                self.console.print(f"[bold red]Error: {'no' if not matches else 'more than one'} session matches '{session}'.[/bold red]")
+                for m in matches: self.console.print(f"- {m.stem}")
+                return False
+            path = matches[0]
+        try:
+            messages = chat_journal.read_session(path)
+        except OSError as e:
+            self.console.print(f"[bold red]Error reading session: {e}[/bold red]")
+            return False
+        if not messages:
+            self.console.print(f"[yellow]Session {path.stem} has no messages.[/yellow]")
+            return False
+        if self.journal is not None:
+            self.close_journal()
+            self.journal = chat_journal.ChatJournal(self.chat_dir, session_id=path.stem)
+            self.journal.adopt(messages)
+        self.messages = messages
+        for m in reversed(messages):
+            if m.get("role") == "assistant" and m.get("content") and (recap := self.extract_short_recap(m["content"])):
+                self.short_recap = recap
+                break
+        self._render_loaded_messages()
+        self.console.print(f"[dim]Resumed session {path.stem} ({len(messages)} messages)[/dim]")
+        return True
+
+    def _render_loaded_messages(self):
+        """Redraw a loaded conversation; only the tail is rendered so huge sessions open instantly."""
+        try:
+            last_n = int(os.environ.get("EG_LOAD_RENDER_LAST", "40"))
+        except ValueError:
+            last_n = 40
+        self._clear_display()
+        start = 1
+        if self.messages and self.messages[0].get("role") == "system":
+            self.display_manager.render_system_prompt(self.messages[0]["content"])
+        else:
+            start = 0
+        skipped = max(0, len(self.messages) - start - last_n)
+        if skipped:
+            self.console.print(f"[dim]... {skipped} earlier messages not shown[/dim]")
+        for msg in self.messages[start + skipped:]:
+            self.display_manager.render_message(msg)
+        self.console.print("--- End of loaded conversation ---", style="dim")
@@ -0,0 +1,231 @@
+"""Full-text index over saved chats, session journals and agent transcripts.
+
+.egg/localChats/index.db holds one row per file (path, kind, size/mtime, recap,
+model, timestamp) and an FTS5 table over its text, so /history search is a
+single ranked (bm25) query no matter how many chat files exist. Files are
+indexed when they are written: saved chats on save, session journals when the
+session closes, agent transcripts when the agent finishes. The first search
+runs a full reindex to pick up chats that predate the index; /history reindex
+catches up on anything written elsewhere (older chats, other tools) by
+re-reading only files whose size or mtime changed.
+"""
+import datetime
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import chat_journal
+
+INDEX_FILE = "index.db"
+# Text beyond this per file is not indexed (keeps the index bounded for huge transcripts)
+MAX_INDEXED_CHARS = 2_000_000
+# Files indexed per transaction during a reindex
+REINDEX_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    recap TEXT,
+    model_key TEXT,
+    ts REAL,
+    n_messages INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(body, recap, tokenize = 'unicode61');
+"""
+
+_lock = threading.Lock()
+_TS_RE = re.compile(r"^(\d{8})_(\d{6})")
+_RECAP_RE = re.compile(r"<short_recap>(.*?)</short_recap>", re.S)
+
+
+def _connect(chat_dir: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(Path(chat_dir) / INDEX_FILE), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _message_text(msg: Dict[str, Any]) -> str:
+    parts = []
+    content = msg.get("content")
+    if isinstance(content, str):
+        parts.append(content)
+    elif isinstance(content, list):
+        parts.extend(p.get("text", "") for p in content if isinstance(p, dict))
+    for tc in msg.get("tool_calls") or []:
+        fn = (tc or {}).get("function") or {}
+        parts.append(f"{fn.get('name', '')} {fn.get('arguments', '')}")
+    return "\n".join(p for p in parts if p)
+
+
+def _kind_of(path: Path) -> str:
+    if path.suffix == ".jsonl":
+        return "session"
+    if path.name == "messages.json":
+        return "agent"
+    return "chat"
+
+
+def _timestamp(path: Path, mtime: float) -> float:
+    """Saved chats are named <YYYYmmdd_HHMMSS>_...; anything else uses its mtime."""
+    m = _TS_RE.match(path.name)
+    if m:
+        try:
+            return datetime.datetime.strptime(m.group(1) + m.group(2), "%Y%m%d%H%M%S").timestamp()
+        except ValueError:
+            pass
+    return mtime
+
+
+def _index(conn: sqlite3.Connection, path: Path, st, messages: List[Dict[str, Any]]):
+    texts, size = [], 0
+    recap, model_key = "", ""
+    for msg in messages:
+        if not isinstance(msg, dict) or msg.get("role") == "system":
+            continue
+        text = _message_text(msg)
+        if msg.get("role") == "assistant" and text:
+            found = _RECAP_RE.findall(text)
+            if found:
+                recap = found[-1].strip()
+        if msg.get("model_key"):
+            model_key = msg["model_key"]
+        if size < MAX_INDEXED_CHARS and text:
+            texts.append(text[:MAX_INDEXED_CHARS - size])
+            size += len(texts[-1])
+    kind = _kind_of(path)
+    if not recap and kind == "chat":
+        # Saved chats carry the recap (or popped return value) in their file name
+        recap = re.sub(r"^\d{8}_\d{6}_+", "", path.stem).replace("_", " ").strip()
+    fields = (kind, st.st_size, st.st_mtime_ns, recap, model_key, _timestamp(path, st.st_mtime), len(messages))
+    row = conn.execute("SELECT id FROM docs WHERE path = ?", (str(path),)).fetchone()
+    if row:
+        doc_id = row["id"]
+        conn.execute("DELETE FROM docs_fts WHERE rowid = ?", (doc_id,))
+        conn.execute("UPDATE docs SET kind = ?, size = ?, mtime_ns = ?, recap = ?, model_key = ?, ts = ?, n_messages = ?"
+                     " WHERE id = ?", fields + (doc_id,))
+    else:
+        doc_id = conn.execute("INSERT INTO docs(path, kind, size, mtime_ns, recap, model_key, ts, n_messages)"
+                              " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (str(path),) + fields).lastrowid
+    conn.execute("INSERT INTO docs_fts(rowid, body, recap) VALUES (?, ?, ?)", (doc_id, "\n".join(texts), recap))
+
+
+def index_messages(chat_dir: Path, path: Path, messages: List[Dict[str, Any]]):
+    """(Re)index one file from messages already in memory (called right after the file is written)."""
+    path = Path(path).resolve()
+    try:
+        st = path.stat()
+    except OSError:
+        return
+    with _lock:
+        conn = _connect(chat_dir)
+        try:
+            with conn:
+                _index(conn, path, st, messages)
+        finally:
+            conn.close()
+
+
+def _read_messages(path: Path) -> Optional[List[Dict[str, Any]]]:
+    try:
+        if path.suffix == ".jsonl":
+            return chat_journal.read_session(path)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, list) else None
+    except (OSError, ValueError):
+        return None
+
+
+def _candidate_files(chat_dir: Path) -> Iterable[Path]:
+    chat_dir = Path(chat_dir)
+    yield from chat_dir.glob("*.json")
+    yield from chat_journal.sessions_dir(chat_dir).glob("*.jsonl")
+    agents = chat_dir.parent / "agents"
+    if agents.is_dir():
+        yield from agents.glob("*/*/children/*/messages.json")
+
+
+def reindex(chat_dir: Path) -> Dict[str, int]:
+    """Index new or changed files and forget deleted ones. Returns counts."""
+    with _lock:
+        conn = _connect(chat_dir)
+        try:
+            known = {r["path"]: (r["id"], r["size"], r["mtime_ns"])
+                     for r in conn.execute("SELECT id, path, size, mtime_ns FROM docs")}
+            seen, indexed = set(), 0
+            for p in _candidate_files(chat_dir):
+                p = p.resolve()
+                seen.add(str(p))
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                k = known.get(str(p))
+                if k and k[1] == st.st_size and k[2] == st.st_mtime_ns:
+                    continue
+                messages = _read_messages(p)
+                if messages is None:
+                    continue
+                _index(conn, p, st, messages)
+                indexed += 1
+                if indexed % REINDEX_BATCH == 0:
+                    conn.commit()
+            gone = [(v[0],) for path, v in known.items() if path not in seen]
+            conn.executemany("DELETE FROM docs_fts WHERE rowid = ?", gone)
+            conn.executemany("DELETE FROM docs WHERE id = ?", gone)
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('reindexed_at', ?)", (str(time.time()),))
+            conn.commit()
+        finally:
+            conn.close()
+    return {"indexed": indexed, "removed": len(gone), "total": len(seen)}
+
+
+def _fts_query(query: str) -> str:
+    """Quote each word so user text never hits FTS5 syntax; words are ANDed, a trailing * keeps prefix search."""
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search(chat_dir: Path, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Ranked hits: path, kind, recap, model_key, ts and a snippet around the match."""
+    fts = _fts_query(query)
+    if not fts:
+        return []
+    conn = _connect(chat_dir)
+    try:
+        rows = conn.execute(
+            "SELECT d.path, d.kind, d.recap, d.model_key, d.ts, d.n_messages,"
+            " snippet(docs_fts, 0, '[', ']', ' … ', 12) AS snippet"
+            " FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid"
+            " WHERE docs_fts MATCH ? ORDER BY bm25(docs_fts, 1.0, 4.0) LIMIT ?",
+            (fts, limit)).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+def is_built(chat_dir: Path) -> bool:
+    """False until a first full reindex has covered the files that predate the index."""
+    conn = _connect(chat_dir)
+    try:
+        return conn.execute("SELECT 1 FROM meta WHERE key = 'reindexed_at'").fetchone() is not None
+    finally:
+        conn.close()
@@ -0,0 +1,270 @@
+"""Append-only JSONL journal of a chat session.
+
+Every ChatClient journals its messages to .egg/localChats/sessions/<session>.jsonl
+as they are finalized, instead of relying on the JSON dump written on exit:
+
+  {"op": "meta", ...}             first line: cwd, pid, agent identity, start time
+  {"op": "append", "m": {...}}    one finalized message
+  {"op": "truncate", "n": k}      the message list was cut back to k messages (/drop, pop, load)
+  {"op": "close", "t": ...}       clean exit; a journal without it was interrupted
+
+Lines are flushed on every write and fsynced in batches (at most every
+EG_JOURNAL_FSYNC_SEC, default 1s). Every EG_JOURNAL_SNAPSHOT_EVERY records
+(default 500) a compact <session>.snap.json holding the full list and the
+journal offset it covers is written atomically, so reading a session is one
+json.loads of the snapshot plus a replay of the short tail after it.
+Set EG_CHAT_JOURNAL=0 to disable.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import agent_registry
+import executors
+
+SESSIONS_DIR = "sessions"
+DEFAULT_FSYNC_SEC = 1.0
+DEFAULT_SNAPSHOT_EVERY = 500
+
+
+def enabled() -> bool:
+    return os.environ.get('EG_CHAT_JOURNAL', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def _dumps(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def sessions_dir(chat_dir: Path) -> Path:
+    return Path(chat_dir) / SESSIONS_DIR
+
+
+class ChatJournal:
+    def __init__(self, chat_dir: Path, session_id: Optional[str] = None):
+        self.dir = sessions_dir(chat_dir)
+        self.session_id = session_id or f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        self.path = self.dir / f"{self.session_id}.jsonl"
+        self.snap_path = self.dir / f"{self.session_id}.snap.json"
+        # The message objects journaled so far, in order; held so their ids cannot be reused
+        self._logged: List[Dict[str, Any]] = []
+        self._f = None
+        self._lock = threading.Lock()
+        self._fsync_timer: Optional[threading.Timer] = None
+        self._since_snapshot = 0
+        self.fsync_sec = executors._env_number('EG_JOURNAL_FSYNC_SEC', DEFAULT_FSYNC_SEC, float)
+        self.snapshot_every = max(1, executors._env_number('EG_JOURNAL_SNAPSHOT_EVERY', DEFAULT_SNAPSHOT_EVERY, int))
+
+    def _open(self):
+        if self._f is not None:
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        is_new = not self.path.exists()
+        if not is_new:
+            _trim_partial_line(self.path)
+        self._f = open(self.path, 'ab')
+        if is_new:
+            # Identity is read now, not at construction: pooled agents take theirs on when claimed
+            tree_id, agent_id, _ = agent_registry.current_identity()
+            self._f.write(_dumps(dict(op="meta", session=self.session_id, pid=os.getpid(), tree_id=tree_id,
+                                      agent_id=agent_id, cwd=str(Path.cwd()), started_at=time.time())))
+
+    def adopt(self, messages: List[Dict[str, Any]]):
+        """Treat messages as already journaled (after resuming this session)."""
+        with self._lock:
+            self._logged = list(messages)
+
+    def messages(self) -> List[Dict[str, Any]]:
+        """The messages journaled so far."""
+        with self._lock:
+            return list(self._logged)
+
+    def sync(self, messages: List[Dict[str, Any]]):
+        """Journal whatever changed in messages since the last sync (appends, or a cut followed by appends)."""
+        with self._lock:
+            n = min(len(messages), len(self._logged))
+            k = 0
+            while k < n and messages[k] is self._logged[k]:
+                k += 1
+            if k == len(messages) == len(self._logged):
+                return
+            if not self._f and not any(m.get("role") != "system" for m in messages):
+                # Nothing worth a session file yet (e.g. a pooled agent that was never claimed)
+                return
+            records = []
+            if k < len(self._logged):
+                records.append({"op": "truncate", "n": k})
+            records.extend({"op": "append", "m": m} for m in messages[k:])
+            self._open()
+            self._f.write(b"".join(_dumps(r) for r in records))
+            self._f.flush()
+            self._logged = list(messages)
+            self._since_snapshot += len(records)
+            self._schedule_fsync()
+            if self._since_snapshot >= self.snapshot_every:
+                self._snapshot()
+
+    def _schedule_fsync(self):
+        if self._fsync_timer is None:
+            self._fsync_timer = threading.Timer(self.fsync_sec, self._fsync)
+            self._fsync_timer.daemon = True
+            self._fsync_timer.start()
+
+    def _fsync(self):
+        with self._lock:
+            self._fsync_timer = None
+            if self._f is not None:
+                try:
+                    os.fsync(self._f.fileno())
+                except (OSError, ValueError):
+                    pass
+
+    def _snapshot(self):
+        offset = self._f.tell()
+        tmp = self.snap_path.with_name(f".{self.snap_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({"offset": offset, "count": len(self._logged), "messages": self._logged}, f,
+                          ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.snap_path)
+            self._since_snapshot = 0
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def close(self):
+        with self._lock:
+            if self._fsync_timer is not None:
+                self._fsync_timer.cancel()
+                self._fsync_timer = None
+            if self._f is None:
+                return
+            try:
+                self._f.write(_dumps({"op": "close", "t": time.time()}))
+                self._f.flush()
+                os.fsync(self._f.fileno())
+                self._f.close()
+            except (OSError, ValueError):
+                pass
+            self._f = None
+
+
+def _trim_partial_line(path: Path):
+    """Cut a line left half-written by a crash, so records appended on resume start on a line of their own."""
+    with open(path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            nl = f.read(step).rfind(b"\n")
+            if nl != -1:
+                pos = pos - step + nl + 1
+                break
+            pos -= step
+        f.seek(pos)
+        tail = f.read()
+        try:
+            json.loads(tail)
+            # The record is whole and only its newline is missing
+            f.write(b"\n")
+        except ValueError:
+            f.truncate(pos)
+
+
+def read_session(path: Path) -> List[Dict[str, Any]]:
+    """Messages of a journal: the snapshot (if valid) plus a replay of the records after it."""
+    path = Path(path)
+    snap_path = path.with_name(path.name[:-len(".jsonl")] + ".snap.json")
+    messages: List[Dict[str, Any]] = []
+    offset = 0
+    try:
+        with open(snap_path, 'r', encoding='utf-8') as f:
+            snap = json.load(f)
+        if snap.get("offset", 0) <= path.stat().st_size:
+            messages, offset = list(snap.get("messages") or []), int(snap.get("offset") or 0)
+    except (OSError, ValueError, AttributeError):
+        pass
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            try:
+                rec = json.loads(raw)
+            except ValueError:
+                # A line cut short by a crash; skip it, later records may still follow it
+                continue
+            op = rec.get("op")
+            if op == "append":
+                messages.append(rec.get("m") or {})
+            elif op == "truncate":
+                del messages[int(rec.get("n") or 0):]
+    return messages
+
+
+def read_meta(path: Path) -> Dict[str, Any]:
+    try:
+        with open(path, 'rb') as f:
+            rec = json.loads(f.readline())
+        return rec if rec.get("op") == "meta" else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def is_closed(path: Path) -> bool:
+    """True if the journal's last record is a clean close."""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 512))
+            tail = f.read().rstrip(b"\n").rsplit(b"\n", 1)[-1]
+        return json.loads(tail).get("op") == "close"
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except PermissionError:
+        return True
+    except (OSError, TypeError, ValueError):
+        return False
+
+
+def list_sessions(chat_dir: Path) -> List[Path]:
+    """Journal files, newest first."""
+    d = sessions_dir(chat_dir)
+    if not d.is_dir():
+        return []
+    return sorted(d.glob("*.jsonl"), key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+def interrupted_sessions(chat_dir: Path, agent_id: str = "root", recent: int = 20) -> List[Path]:
+    """Recent sessions of this kind of agent that ended without a clean close and whose process is gone."""
+    out = []
+    for p in list_sessions(chat_dir)[:recent]:
+        if is_closed(p):
+            continue
+        meta = read_meta(p)
+        if meta.get("agent_id", "root") != agent_id or meta.get("pid") == os.getpid() or _pid_alive(meta.get("pid")):
+            continue
+        out.append(p)
+    return out
+
+
+def find_session(chat_dir: Path, name: str) -> List[Path]:
+    """Journals whose session id equals or contains name."""
+    d = sessions_dir(chat_dir)
+    exact = d / f"{name}.jsonl"
+    if exact.is_file():
+        return [exact]
+    return [p for p in list_sessions(chat_dir) if name in p.stem]
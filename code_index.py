@@ -0,0 +1,276 @@
+"""Trigram index of the working tree for the search_code tool.
+
+.egg/index/code.db is a SQLite database with one row per text file (path,
+size, mtime) and an FTS5 table using the trigram tokenizer over its content.
+A search turns the query into the literal strings every match must contain
+(the query itself, or the literal runs a regex requires), asks the index for
+the few files containing all of them, and runs the real regex only over
+those. Regexes without a usable literal (e.g. `\\w+_id`) scan the stored
+content, which still avoids walking and reading the tree.
+
+The file list comes from `git ls-files` (tracked plus untracked, minus
+.gitignore'd) when the directory is a git work tree, else from a walk that
+skips .git, .egg, node_modules and friends and the root .gitignore's
+patterns. Before a search, files whose size or mtime changed are re-read and
+deleted ones dropped, at most once every EG_SEARCH_REFRESH_SEC seconds
+(default 5) so repeated searches answer straight from the index.
+"""
+import fnmatch
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import re._parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+
+INDEX_FILE = "code.db"
+# Larger files are not indexed (generated bundles, data dumps)
+MAX_FILE_BYTES = 1024 * 1024
+DEFAULT_REFRESH_SEC = 5
+DEFAULT_MAX_RESULTS = 100
+MAX_LINE_CHARS = 300
+REFRESH_BATCH = 1000
+SKIP_DIRS = {".git", ".hg", ".svn", ".egg", "node_modules", "__pycache__", ".venv", "venv", ".mypy_cache",
+             ".pytest_cache", ".tox", "dist", "build", "target"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(body, tokenize = 'trigram');
+"""
+
+_lock = threading.Lock()
+_last_refresh: Dict[str, float] = {}
+
+
+def index_dir(root: Path) -> Path:
+    return Path(root) / ".egg" / "index"
+
+
+def _connect(root: Path) -> sqlite3.Connection:
+    d = index_dir(root)
+    d.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(d / INDEX_FILE), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _gitignore_patterns(root: Path) -> List[str]:
+    try:
+        lines = (root / ".gitignore").read_text(encoding="utf-8", errors="replace").splitlines()
+    except OSError:
+        return []
+    return [l.strip().rstrip("/") for l in lines if l.strip() and not l.startswith(("#", "!"))]
+
+
+def _ignored(rel: str, name: str, patterns: List[str]) -> bool:
+    for pat in patterns:
+        if pat.startswith("/"):
+            if fnmatch.fnmatch(rel, pat[1:]):
+                return True
+        elif fnmatch.fnmatch(name, pat) or fnmatch.fnmatch(rel, pat):
+            return True
+    return False
+
+
+def _walk(root: Path) -> Iterable[str]:
+    patterns = _gitignore_patterns(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        rel_dir = "" if rel_dir == "." else rel_dir + "/"
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not _ignored(rel_dir + d, d, patterns)]
+        for name in filenames:
+            if not _ignored(rel_dir + name, name, patterns):
+                yield rel_dir + name
+
+
+def list_files(root: Path) -> List[str]:
+    """Paths (relative to root) of the files to index."""
+    try:
+        proc = subprocess.run(["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+                              cwd=str(root), capture_output=True, timeout=60)
+        if proc.returncode == 0:
+            return [p for p in proc.stdout.decode("utf-8", errors="replace").split("\0")
+                    if p and not p.startswith(".egg/")]
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return list(_walk(root))
+
+
+def refresh(root: Path) -> Dict[str, int]:
+    """Index new or changed files and forget deleted ones. Returns counts."""
+    root = Path(root)
+    with _lock:
+        conn = _connect(root)
+        try:
+            known = {r["path"]: (r["id"], r["size"], r["mtime_ns"])
+                     for r in conn.execute("SELECT id, path, size, mtime_ns FROM files")}
+            seen, indexed = set(), 0
+            for rel in list_files(root):
+                try:
+                    st = os.stat(root / rel)
+                except OSError:
+                    continue
+                k = known.get(rel)
+                if k and k[1] == st.st_size and k[2] == st.st_mtime_ns:
+                    seen.add(rel)
+                    continue
+                if st.st_size > MAX_FILE_BYTES or not os.path.isfile(root / rel):
+                    continue
+                try:
+                    data = (root / rel).read_bytes()
+                except OSError:
+                    continue
+                if b"\0" in data[:8192]:
+                    continue
+                seen.add(rel)
+                body = data.decode("utf-8", errors="replace")
+                if k:
+                    conn.execute("DELETE FROM files_fts WHERE rowid = ?", (k[0],))
+                    conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?", (st.st_size, st.st_mtime_ns, k[0]))
+                    file_id = k[0]
+                else:
+                    file_id = conn.execute("INSERT INTO files(path, size, mtime_ns) VALUES (?, ?, ?)",
+                                           (rel, st.st_size, st.st_mtime_ns)).lastrowid
+                conn.execute("INSERT INTO files_fts(rowid, body) VALUES (?, ?)", (file_id, body))
+                indexed += 1
+                if indexed % REFRESH_BATCH == 0:
+                    conn.commit()
+            gone = [(v[0],) for path, v in known.items() if path not in seen]
+            conn.executemany("DELETE FROM files_fts WHERE rowid = ?", gone)
+            conn.executemany("DELETE FROM files WHERE id = ?", gone)
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('refreshed_at', ?)", (str(time.time()),))
+            conn.commit()
+        finally:
+            conn.close()
+        _last_refresh[str(root.resolve())] = time.monotonic()
+    return {"indexed": indexed, "removed": len(gone), "total": len(seen)}
+
+
+def _refresh_if_due(root: Path, force: bool = False):
+    try:
+        interval = float(os.environ.get("EG_SEARCH_REFRESH_SEC", DEFAULT_REFRESH_SEC))
+    except ValueError:
+        interval = DEFAULT_REFRESH_SEC
+    last = _last_refresh.get(str(Path(root).resolve()))
+    if force or last is None or time.monotonic() - last >= interval:
+        refresh(root)
+
+
+def _literal_runs(items, out: List[str]):
+    """Literal strings every match of the parsed regex items must contain (conservative)."""
+    run = ""
+    for op, av in items:
+        if op is _sre_parse.LITERAL:
+            run += chr(av)
+            continue
+        if run:
+            out.append(run)
+            run = ""
+        if op is _sre_parse.SUBPATTERN:
+            _literal_runs(av[-1], out)
+        elif op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT) and av[0] >= 1:
+            _literal_runs(av[2], out)
+    if run:
+        out.append(run)
+
+
+def required_literals(query: str, is_regex: bool) -> List[str]:
+    if not is_regex:
+        return [query] if len(query) >= 3 else []
+    try:
+        parsed = _sre_parse.parse(query)
+    except Exception:
+        return []
+    out: List[str] = []
+    _literal_runs(list(parsed), out)
+    return [r for r in out if len(r) >= 3]
+
+
+def _fts_query(literals: List[str]) -> str:
+    return " AND ".join('"' + l.replace('"', '""') + '"' for l in literals)
+
+
+def _matches_glob(path: str, glob: Optional[str]) -> bool:
+    if not glob:
+        return True
+    return fnmatch.fnmatch(path, glob) or fnmatch.fnmatch(os.path.basename(path), glob)
+
+
+def search(root: Path, query: str, is_regex: bool = False, ignore_case: bool = False, glob: Optional[str] = None,
+           context: int = 0, max_results: int = DEFAULT_MAX_RESULTS, force_refresh: bool = False) -> str:
+    """grep -n style results for query across the indexed tree."""
+    if not query:
+        return "Error: query must not be empty."
+    flags = re.IGNORECASE if ignore_case else 0
+    try:
+        rx = re.compile(query if is_regex else re.escape(query), flags)
+    except re.error as e:
+        return f"Error: invalid regex: {e}"
+    context = max(0, int(context or 0))
+    max_results = max(1, int(max_results or DEFAULT_MAX_RESULTS))
+    _refresh_if_due(root, force_refresh)
+    literals = required_literals(query, is_regex)
+    conn = _connect(root)
+    try:
+        if literals:
+            rows = conn.execute("SELECT f.path, files_fts.body FROM files_fts JOIN files f ON f.id = files_fts.rowid"
+                                " WHERE files_fts MATCH ? ORDER BY f.path", (_fts_query(literals),))
+        else:
+            rows = conn.execute("SELECT f.path, files_fts.body FROM files_fts JOIN files f ON f.id = files_fts.rowid"
+                                " ORDER BY f.path")
+        out, n_matches, n_files, capped = [], 0, 0, False
+        for row in rows:
+            path = row["path"]
+            if not _matches_glob(path, glob):
+                continue
+            body = row["body"]
+            if not rx.search(body):
+                continue
+            lines = body.split("\n")
+            hits = [i for i, line in enumerate(lines) if rx.search(line)]
+            if not hits:
+                # Multi-line match: report the line it starts on
+                hits = sorted({body.count("\n", 0, m.start()) for m in rx.finditer(body)})
+            n_files += 1
+            hit_set, last = set(hits), -1
+            for i in hits:
+                if n_matches >= max_results:
+                    capped = True
+                    break
+                lo, hi = max(0, i - context), min(len(lines), i + context + 1)
+                if context and out and lo > last + 1:
+                    out.append("--")
+                for j in range(max(lo, last + 1), hi):
+                    text = lines[j].rstrip("\r")
+                    if len(text) > MAX_LINE_CHARS:
+                        text = text[:MAX_LINE_CHARS] + " ..."
+                    out.append(f"{path}:{j + 1}:{text}" if j in hit_set else f"{path}-{j + 1}-{text}")
+                last = hi - 1
+                n_matches += 1
+            if capped:
+                break
+    except sqlite3.OperationalError as e:
+        return f"Error: search index query failed: {e}"
+    finally:
+        conn.close()
+    if not out:
+        return f"No matches for {query!r}" + (f" in files matching {glob}" if glob else "") + "."
+    summary = f"{n_matches} match(es) in {n_files} file(s)"
+    if capped:
+        summary += f"; stopped at max_results={max_results}, narrow the query or glob to see the rest"
+    return "\n".join(out) + f"\n[{summary}]"
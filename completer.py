@@ -16,7 +16,7 @@ class PtkCompleter(Completer):
     def __init__(self, client: "ChatClient"):
         self.client = client
         self.all_commands = [
-            "/model", "/popContext", "/toggleYesToolFlag", "/toggleThinkingDisplay", "/o", "/spawn", "/spawn_auto", "/wait", "/tree", "/attach", "/updateAllModels", "/search", "/toggleEscape", "/exportHtml", "/drop"
+            "/model", "/popContext", "/toggleYesToolFlag", "/toggleThinkingDisplay", "/o", "/spawn", "/spawn_auto", "/wait", "/tree", "/attach", "/updateAllModels", "/search", "/toggleEscape", "/exportHtml", "/drop", "/resume", "/load", "/history"
         ]
 
     def _get_filesystem_suggestions(self, prefix: str) -> List[str]:
@@ -299,6 +299,25 @@ class PtkCompleter(Completer):
         elif text.startswith("/drop"):
             return
 
+        elif text.startswith("/history ") and " " not in text[len("/history "):]:
+            prefix = text[len("/history "):]
+            for sub in ("search", "open", "reindex"):
+                if sub.startswith(prefix):
+                    yield Completion(sub, start_position=-len(prefix))
+            return
+
+        elif text.startswith("/resume ") or text.startswith("/load "):
+            prefix = text.split(" ", 1)[1]
+            try:
+                sessions = Path('.egg/localChats/sessions')
+                if sessions.is_dir():
+                    for p in sorted(sessions.glob('*.jsonl'), reverse=True):
+                        if p.stem.startswith(prefix):
+                            yield Completion(p.stem, start_position=-len(prefix))
+            except Exception:
+                pass
+            return
+
         elif text.startswith("/tree use "):
             prefix = text[len('/tree use '):]
             try:
@@ -80,6 +80,10 @@ def load_configs():
             api_base = prov_obj.get("api_base", "")
             api_key_env = prov_obj.get("api_key_env", "")
             providers_config[prov_name] = {"api_base": api_base, "api_key_env": api_key_env}
+            # Optional request parameters and scheduler limits (max_concurrent, tokens_per_minute)
+            for key in ("parameters", "max_concurrent", "tokens_per_minute"):
+                if key in prov_obj:
+                    providers_config[prov_name][key] = prov_obj[key]
             models_map = prov_obj.get("models", {})
             if isinstance(models_map, dict):
                 for display_name, m in models_map.items():
@@ -199,7 +199,9 @@ class DisplayManager:
     def __init__(self, client: "ChatClient"):
         self.client = client
         self.console = client.console
-        self._stream_mode: Optional[str] = None  # "normal" | "tmux" | None
+        self._stream_mode: Optional[str] = None  # "normal" | "tmux" | "headless" | None
+        # Headless agents print plain text only (see _print_plain)
+        self.plain = bool(getattr(client, "headless", False))
         self._live = None
         # tmux streaming queue state
         self._tmux_box_width: Optional[int] = None
@@ -211,7 +213,14 @@ class DisplayManager:
     def get_border_style(self, style: str) -> str:
         return style if self.client.borders_enabled else "none"
 
+    def _print_plain(self, label: str, content: str):
+        self.console.file.write(f"\n[{label}]\n{content}\n")
+        self.console.file.flush()
+
     def render_system_prompt(self, content: str):
+        if self.plain:
+            self._print_plain("system", f"({len(content or '')} chars)")
+            return
         self.console.print(
             Panel(
                 content,
@@ -338,6 +347,11 @@ class DisplayManager:
     def _render_pretty_tool_calls_only(self, tool_calls: List[Dict]):
         if not tool_calls:
             return
+        if self.plain:
+            for tc in tool_calls:
+                func = tc.get("function", {})
+                self._print_plain(f"tool call: {func.get('name', '...')}", func.get("arguments", ""))
+            return
         sub_panels: List[Any] = []
         for tc in tool_calls:
             func = tc.get("function", {})
@@ -349,6 +363,14 @@ class DisplayManager:
             self.console.print(Panel(Group(*sub_panels), border_style=border_style, box=self.client.boxStyle))
 
     def render_message(self, msg: Dict, is_loading: bool = False) -> None:
+        if self.plain:
+            role = msg.get("role", "")
+            label = f"tool output: {msg.get('name', 'N/A')}" if role == "tool" else role
+            self._print_plain(label, msg.get("content", "") or "")
+            for tc in msg.get("tool_calls") or []:
+                func = tc.get("function", {})
+                self._print_plain(f"tool call: {func.get('name', '...')}", func.get("arguments", ""))
+            return
         try:
             role = msg.get("role")
             if role == "user":
@@ -537,6 +559,8 @@ class DisplayManager:
             self._live = Live(console=self.console, auto_refresh=False, vertical_overflow="visible")
             self._live.__enter__()
             self._live.update(self.create_live_display(None, {}), refresh=True)
+        elif mode == "headless":
+            self.console.file.write(f"\n[assistant: {model_name}]\n")
         elif mode == "tmux":
             def width_provider():
                 import shutil
@@ -569,7 +593,12 @@ class DisplayManager:
             new.emit_all()
 
     def stream_chunk(self, content: Optional[str] = None, reasoning: Optional[str] = None, tool_calls_delta: Optional[Dict] = None, model_name: Optional[str] = None, buffers: Optional[Dict] = None):
-        if self._stream_mode == "normal":
+        if self._stream_mode == "headless":
+            # Content goes straight to the log; reasoning and tool-call deltas are summarized at end_stream
+            if content:
+                self.console.file.write(content)
+                self.console.file.flush()
+        elif self._stream_mode == "normal":
             if not self._live:
                 return
             assistant_buf = {
@@ -651,7 +680,13 @@ class DisplayManager:
     def end_stream(self, final_assistant_msg: Dict):
         mode = self._stream_mode
         self._stream_mode = None
-        if mode == "normal":
+        if mode == "headless":
+            self.console.file.write("\n")
+            if self.client.show_thinking and final_assistant_msg.get("reasoning_content"):
+                self._print_plain("reasoning", final_assistant_msg["reasoning_content"])
+            self._render_pretty_tool_calls_only(final_assistant_msg.get("tool_calls") or [])
+            self.console.file.flush()
+        elif mode == "normal":
             if self._live:
                 try:
                     self._live.__exit__(None, None, None)
@@ -1,35 +1,193 @@
 import subprocess
 import sys
 import os
+import re
+import codecs
+import collections
+import difflib
+import selectors
+import shlex
+import shutil
+import signal
+import time
 from io import StringIO
 from pathlib import Path
+from typing import Callable, Optional
 import json
 
-def run_bash_script(script: str) -> str:
-    """Executes a bash script and captures its stdout and stderr."""
+DEFAULT_BASH_TIMEOUT_SEC = 60
+DEFAULT_STREAM_BUFFER_BYTES = 1024 * 1024
+# Bytes kept from the start of each stream; the rest of the buffer holds its tail
+STREAM_HEAD_BYTES = 64 * 1024
+# After the shell exits, how long background processes holding its pipes may keep them open
+PIPE_GRACE_SEC = 0.5
+KILL_GRACE_SEC = 2
+
+
+def _env_number(name: str, default, cast):
     try:
-        result = subprocess.run(
-            script,
-            shell=True,
-            executable="/bin/bash",
-            capture_output=True,
-            text=True,
-            timeout=60,
-        )
-        output = ""
-        if result.stdout:
-            output += f"--- STDOUT ---\n{result.stdout.strip()}\n"
-        if result.stderr:
-            output += f"--- STDERR ---\n{result.stderr.strip()}\n"
-
-        return output.strip() or "--- The command executed successfully and produced no output ---"
-    except subprocess.TimeoutExpired:
-        return "--- STDERR ---\nError: Command timed out after 60 seconds."
+        return cast(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class _StreamBuffer:
+    """Head and a bounded tail of one output stream; past capacity the whole stream is spilled to an artifact."""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, STREAM_HEAD_BYTES * 2)
+        self.head = bytearray()
+        self.tail = collections.deque()
+        self.tail_size = 0
+        self.total = 0
+        self.spill = None
+        self.artifact_id = None
+
+    def add(self, data: bytes):
+        self.total += len(data)
+        if self.spill is None and self.total > self.capacity:
+            try:
+                import artifacts
+                self.spill = artifacts.ArtifactWriter()
+                self.spill.write(bytes(self.head) + b"".join(self.tail))
+            except OSError:
+                self.spill = False
+        if self.spill:
+            self.spill.write(data)
+        room = STREAM_HEAD_BYTES - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail.append(data)
+            self.tail_size += len(data)
+            limit = self.capacity - STREAM_HEAD_BYTES
+            while self.tail_size > limit:
+                excess = self.tail_size - limit
+                if len(self.tail[0]) <= excess:
+                    self.tail_size -= len(self.tail.popleft())
+                else:
+                    self.tail[0] = self.tail[0][excess:]
+                    self.tail_size -= excess
+
+    def close(self):
+        if self.spill:
+            try:
+                self.artifact_id = self.spill.close()
+            except OSError:
+                pass
+
+    def text(self) -> str:
+        head = bytes(self.head).decode("utf-8", errors="replace")
+        tail = b"".join(self.tail).decode("utf-8", errors="replace")
+        omitted = self.total - len(self.head) - self.tail_size
+        if not omitted:
+            return head + tail
+        where = f"full stream: artifact {self.artifact_id}, readable with read_artifact" if self.artifact_id else "not kept"
+        return f"{head}\n... [{omitted} bytes omitted; {where}] ...\n{tail}"
+
+
+def _kill_group(proc: subprocess.Popen):
+    """Terminate the command's whole process group, escalating to SIGKILL."""
+    for sig, wait in ((signal.SIGTERM, KILL_GRACE_SEC), (signal.SIGKILL, None)):
+        try:
+            os.killpg(proc.pid, sig)
+        except OSError:
+            return
+        try:
+            proc.wait(timeout=wait)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def run_bash_script(script: str, timeout_sec: Optional[float] = None, on_output: Optional[Callable[[str], None]] = None,
+                    session=None) -> str:
+    """Executes a bash script, streaming its stdout and stderr.
+
+    With session (a shell_session.ShellSession) the script runs in that persistent shell instead of a new bash.
+
+    Output is read as it is produced and passed to on_output (for live display). Each stream keeps its
+    head and a bounded tail in memory (EG_BASH_BUFFER_BYTES, default 1MB); longer streams are spilled in
+    full to an artifact. On timeout (timeout_sec, default EG_BASH_TIMEOUT_SEC or 60) or Ctrl+C the
+    command's whole process group is killed and the output so far is returned.
+    """
+    if session is not None:
+        return session.run(script, timeout_sec, on_output)
+    timeout = float(timeout_sec) if timeout_sec else _env_number('EG_BASH_TIMEOUT_SEC', DEFAULT_BASH_TIMEOUT_SEC, float)
+    capacity = _env_number('EG_BASH_BUFFER_BYTES', DEFAULT_STREAM_BUFFER_BYTES, int)
+    try:
+        proc = subprocess.Popen(script, shell=True, executable="/bin/bash", stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
     except Exception as e:
         return f"--- STDERR ---\nError executing command: {e}"
 
-def run_python_script(script: str) -> str:
-    """Executes a Python script string and captures its output."""
+    buffers = {proc.stdout.fileno(): _StreamBuffer(capacity), proc.stderr.fileno(): _StreamBuffer(capacity)}
+    decoders = {fd: codecs.getincrementaldecoder("utf-8")(errors="replace") for fd in buffers}
+    sel = selectors.DefaultSelector()
+    for fd in buffers:
+        sel.register(fd, selectors.EVENT_READ)
+    deadline = time.monotonic() + timeout
+    exited_at = None
+    notes = []
+    try:
+        while sel.get_map():
+            now = time.monotonic()
+            if now >= deadline:
+                _kill_group(proc)
+                notes.append(f"Error: Command timed out after {timeout:g} seconds (process group killed).")
+                break
+            if exited_at is None and proc.poll() is not None:
+                exited_at = now
+            if exited_at is not None and now - exited_at > PIPE_GRACE_SEC:
+                # The shell is done; only background processes still hold the pipes
+                break
+            for key, _ in sel.select(timeout=min(0.2, deadline - now)):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    sel.unregister(key.fd)
+                    continue
+                buffers[key.fd].add(data)
+                if on_output:
+                    try:
+                        on_output(decoders[key.fd].decode(data))
+                    except Exception:
+                        pass
+    except KeyboardInterrupt:
+        _kill_group(proc)
+        notes.append("--- Interrupted by user (process group killed) ---")
+    finally:
+        sel.close()
+        proc.stdout.close()
+        proc.stderr.close()
+        try:
+            proc.wait(timeout=KILL_GRACE_SEC)
+        except subprocess.TimeoutExpired:
+            pass
+
+    stdout_buf, stderr_buf = buffers.values()
+    stdout_buf.close()
+    stderr_buf.close()
+    stdout, stderr = stdout_buf.text().strip(), stderr_buf.text().strip()
+    if notes:
+        stderr = "\n".join([stderr] + notes if stderr else notes)
+    output = ""
+    if stdout:
+        output += f"--- STDOUT ---\n{stdout}\n"
+    if stderr:
+        output += f"--- STDERR ---\n{stderr}\n"
+
+    return output.strip() or "--- The command executed successfully and produced no output ---"
+
+def run_python_script(script: str, timeout_sec: Optional[float] = None, on_output: Optional[Callable[[str], None]] = None,
+                      kernel=None) -> str:
+    """Executes a Python script string and captures its output.
+
+    With kernel (a python_kernel.PythonKernel) the script runs in that persistent worker process;
+    otherwise it is exec'd inside this process, without a timeout.
+    """
+    if kernel is not None:
+        return kernel.run(script, timeout_sec, on_output)
     old_stdout, old_stderr = sys.stdout, sys.stderr
     redirected_stdout = sys.stdout = StringIO()
     redirected_stderr = sys.stderr = StringIO()
@@ -52,6 +210,97 @@ def run_python_script(script: str) -> str:
         sys.stdout, sys.stderr = old_stdout, old_stderr
         return f"--- STDERR ---\nError executing Python script: {e}"
 
+NEAR_MATCHES = 3
+MAX_DIFF_LINES = 40
+
+
+def _norm(line: str) -> str:
+    return " ".join(line.split())
+
+
+def _longest_prefix(content: str, old_str: str):
+    """(length, offset) of the longest prefix of old_str occurring in content.
+
+    A prefix that occurs implies all shorter ones do, so this is a binary search over lengths using
+    str.find (C speed): O(len(content) * log(len(old_str))) instead of comparing at every candidate offset.
+    """
+    lo, hi, at = 0, len(old_str), 0
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        pos = content.find(old_str[:mid])
+        if pos == -1:
+            hi = mid - 1
+        else:
+            lo, at = mid, pos
+    return lo, at
+
+
+def _near_matches(content: str, old_str: str, limit: int = NEAR_MATCHES):
+    """Blocks of the file most similar to old_str: [(score, first_line, file_lines)], best first.
+
+    Each old_str line votes (through an index of whitespace-normalized file lines) for the block start
+    it would imply; only the most-voted starts are scored with difflib.
+    """
+    old_lines = old_str.split("\n")
+    file_lines = content.split("\n")
+    index = {}
+    for i, line in enumerate(file_lines):
+        key = _norm(line)
+        if key:
+            index.setdefault(key, []).append(i)
+    votes = collections.Counter()
+    for j, line in enumerate(old_lines):
+        hits = index.get(_norm(line), ())
+        # Lines that occur everywhere (braces, "return", blank-ish) say little about where the block is
+        if 0 < len(hits) <= 50:
+            for i in hits:
+                votes[max(0, i - j)] += 1
+    if not votes:
+        length, at = _longest_prefix(content, old_str)
+        if not length:
+            return []
+        votes[content.count("\n", 0, at)] = 1
+    old_norm = [_norm(l) for l in old_lines]
+    scored = []
+    for start, _ in votes.most_common(limit * 4):
+        window = file_lines[start:start + len(old_lines)]
+        win_norm = [_norm(l) for l in window]
+        if len(old_lines) <= 3:
+            # Few lines: compare characters, or a one-character typo would score 0
+            ratio = difflib.SequenceMatcher(None, "\n".join(old_norm), "\n".join(win_norm), autojunk=False).ratio()
+        else:
+            ratio = difflib.SequenceMatcher(None, old_norm, win_norm, autojunk=False).ratio()
+        scored.append((ratio, start, window))
+    scored.sort(key=lambda t: -t[0])
+    return scored[:limit]
+
+
+def _edit_miss_report(content: str, old_str: str, label: str = "old_str") -> str:
+    """Why old_str (called label in the text) was not found: longest matching prefix and the closest blocks with diffs."""
+    length, at = _longest_prefix(content, old_str)
+    parts = []
+    if length:
+        line_no = content.count("\n", 0, at) + 1
+        parts.append(f"The longest prefix of {label} found is {length} of {len(old_str)} characters, at line {line_no}; "
+                     f"{label} continues {old_str[length:length + 40]!r} but the file has {content[at + length:at + length + 40]!r}.")
+    else:
+        parts.append(f"Not even the first character of {label} occurs in the file ({len(content)} characters).")
+    matches = _near_matches(content, old_str)
+    if not matches:
+        return parts[0]
+    parts.append(f"Closest blocks in the file (fix {label} to match one of them exactly):")
+    old_lines = old_str.split("\n")
+    for rank, (ratio, start, window) in enumerate(matches, 1):
+        ws_only = [_norm(l) for l in old_lines] == [_norm(l) for l in window]
+        note = ", differs only in whitespace/indentation" if ws_only else ""
+        parts.append(f"{rank}. lines {start + 1}-{start + len(window)} (similarity {ratio:.2f}{note})")
+        diff = list(difflib.unified_diff(old_lines, window, label, f"file lines {start + 1}-{start + len(window)}", lineterm="", n=1))
+        if len(diff) > MAX_DIFF_LINES:
+            diff = diff[:MAX_DIFF_LINES] + [f"... ({len(diff) - MAX_DIFF_LINES} more diff lines)"]
+        parts.extend(diff)
+    return "\n".join(parts)
+
+
 def str_replace_editor(file_path: str, old_str: str, new_str: str) -> str:
     """Replace exact string match in file with optional line context"""
     try:
@@ -79,63 +328,11 @@ def str_replace_editor(file_path: str, old_str: str, new_str: str) -> str:
         if old_str == "":
             new_content = new_str + content
         elif old_str in content:
+            count = content.count(old_str)
             new_content = content.replace(old_str, new_str)
-            # Count occurrences
-            count = 0
-            start = 0
-            while start < len(new_content):
-                pos = new_content.find(new_str, start)
-                if pos == -1:
-                    break
-                count = 1
-                start = pos + len(new_str)
             replacements.append(f"{count} location(s)")
         else:
-            # Find longest substring starting with old_str
-            longest_match = ""
-            start_index = 0
-
-            while start_index < len(content):
-                # Find next occurrence of old_str's first character
-                start_index = content.find(old_str[0], start_index)
-                if start_index == -1:
-                    break
-
-                # Check how many consecutive characters match
-                match_length = 0
-                for i in range(len(old_str)):
-                    if start_index + i >= len(content):
-                        break
-                    if content[start_index + i] != old_str[i]:
-                        break
-                    match_length += 1
-
-                # Update longest match found
-                if match_length > len(longest_match):
-                    longest_match = content[start_index:start_index + match_length]
-
-                # Move to next position
-                start_index += 1
-
-            # Prepare error message with longest match
-            if longest_match:
-                # Find context around the longest match
-                match_index = content.find(longest_match)
-                context_start = max(0, match_index - 20)
-                context_end = min(len(content), match_index + len(longest_match) + 20)
-                context = content[context_start:context_end]
-
-                return (
-                    f"String not found in file. Found longest match starting with old string: {len(longest_match)} characters.\n"
-                    f"Longest match: {repr(longest_match)}\n"
-                    f"Context in file:\n{repr(context)}"
-                )
-            else:
-                return (
-                    f"String not found in file. Old string length: {len(old_str)}, "
-                    f"File length: {len(content)}, First 100 chars of old string: {repr(old_str[:100])}, "
-                    f"First 200 chars of file: {repr(content[:200])}"
-                )
+            return "String not found in file. " + _edit_miss_report(content, old_str)
 
         # Write changes
         with open(abs_path, 'w', newline='') as f:
@@ -183,7 +380,7 @@ def replace_between(file_path: str, start_text: str, end_text: str, new_text: st
 
         start_idx = content.find(start_text)
         if start_idx == -1:
-            return "Error: start_text not found in file. No changes made."
+            return "Error: start_text not found in file. No changes made. " + _edit_miss_report(content, start_text)
         search_from = start_idx + len(start_text)
         end_idx = content.find(end_text, search_from)
         if end_idx == -1:
@@ -203,140 +400,440 @@ def replace_between(file_path: str, start_text: str, end_text: str, new_text: st
     except Exception as e:
         return f"Error: {str(e)}"
 
+def _write_atomic(path: Path, content: str):
+    """Write via a temp file in the same directory and rename, so readers never see a half-written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, 'w', newline='') as f:
+            f.write(content)
+        if path.exists():
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def multi_edit(edits: list) -> str:
+    """Apply many exact-string edits, across any number of files, all or nothing.
+
+    Each edit is {file_path, old_str, new_str} with str_replace_editor semantics (every occurrence of
+    old_str is replaced; an empty old_str prepends new_str, creating the file if needed). Edits to the
+    same file apply in order, each to the result of the previous one. Every edit is checked in memory
+    first; if any fails nothing is written, otherwise each file is written once (temp file + rename).
+    """
+    if isinstance(edits, str):
+        try:
+            edits = json.loads(edits)
+        except ValueError:
+            pass
+    if not isinstance(edits, list) or not edits:
+        return "Error: edits must be a non-empty list of {file_path, old_str, new_str}."
+    system_dirs = ["/etc", "/usr", "/var", "/sys", "/boot", "/dev"]
+    cwd = Path(os.getcwd())
+    files = {}  # resolved path -> [original content or None, current content]
+    results, failed = [], 0
+    for n, edit in enumerate(edits, 1):
+        if not isinstance(edit, dict) or not edit.get("file_path") or not isinstance(edit.get("old_str"), str) \
+                or not isinstance(edit.get("new_str"), str):
+            results.append(f"{n}. Error: each edit needs file_path, old_str and new_str strings.")
+            failed += 1
+            continue
+        file_path, old_str, new_str = edit["file_path"], edit["old_str"], edit["new_str"]
+        try:
+            abs_path = (cwd / file_path).resolve()
+            if any(str(abs_path).startswith(d) for d in system_dirs):
+                results.append(f"{n}. {file_path}: Error: Cannot edit system files in protected directories!")
+                failed += 1
+                continue
+            if abs_path not in files:
+                original = None
+                if abs_path.exists():
+                    with open(abs_path, 'r', newline='') as f:
+                        original = f.read()
+                files[abs_path] = [original, original]
+            state = files[abs_path]
+            content = state[1] or ""
+            if old_str == "":
+                state[1] = new_str + content
+                results.append(f"{n}. {file_path}: prepended" if state[0] is not None else f"{n}. {file_path}: created")
+            elif state[1] is not None and old_str in content:
+                count = content.count(old_str)
+                state[1] = content.replace(old_str, new_str)
+                results.append(f"{n}. {file_path}: replaced {count} location(s)")
+            elif state[1] is None:
+                results.append(f"{n}. {file_path}: Error: file does not exist (use an empty old_str to create it).")
+                failed += 1
+            else:
+                # Earlier edits in this batch may be why it no longer matches; the report is against the edited text
+                results.append(f"{n}. {file_path}: String not found in file. " + _edit_miss_report(content, old_str))
+                failed += 1
+        except Exception as e:
+            results.append(f"{n}. {file_path}: Error: {e}")
+            failed += 1
+    if failed:
+        return (f"{failed} of {len(edits)} edit(s) failed; no files were changed. Fix the failing edits and resend the whole batch.\n"
+                + "\n".join(results))
+    changed = [(path, state[1]) for path, state in files.items() if state[1] != state[0]]
+    written = []
+    try:
+        for path, content in changed:
+            _write_atomic(path, content)
+            written.append(path)
+    except Exception as e:
+        # Files already renamed into place stay changed; say exactly which
+        done = ", ".join(str(p) for p in written) or "none"
+        return f"Error writing {path}: {e}. Files already written: {done}.\n" + "\n".join(results)
+    return f"Success! Applied {len(edits)} edit(s) to {len(changed)} file(s).\n" + "\n".join(results)
+
+
+DEFAULT_PATCH_FUZZ = 2
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def _patch_path(raw: str) -> Optional[str]:
+    raw = raw.split("\t", 1)[0].strip()
+    if raw.startswith('"') and raw.endswith('"'):
+        raw = raw[1:-1]
+    return None if raw == "/dev/null" else raw
+
+
+def _git_diff_paths(rest: str):
+    """(old, new) from the rest of a "diff --git a/x b/x" line, or (None, None) if it cannot be split."""
+    if rest.startswith('"'):
+        try:
+            parts = shlex.split(rest)
+        except ValueError:
+            parts = []
+        return (parts[0], parts[1]) if len(parts) == 2 else (None, None)
+    # Unquoted paths may contain " b/"; when old and new are equal the split that gives two equal halves is the one
+    candidates = [m.start() for m in re.finditer(" b/", rest)]
+    for i in candidates:
+        if rest[2:i] == rest[i + 3:]:
+            return rest[:i], rest[i + 1:]
+    if candidates:
+        return rest[:candidates[0]], rest[candidates[0] + 1:]
+    return None, None
+
+
+def _parse_patch(patch: str) -> list:
+    """Files of a unified diff: [{old, new, rename, hunks: [{header, old_start, lines: [(tag, text)]}]}]."""
+    files, cur, hunk = [], None, None
+    old_left = new_left = 0
+    lines = patch.splitlines(keepends=True)
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        bare = line.rstrip("\r\n")
+        if hunk is not None and (old_left > 0 or new_left > 0) and not bare.startswith(("diff --git ", "@@ ")):
+            # Inside a hunk its header's line counts decide what is body, so "--- x" / "+++ y" removed or
+            # added lines are never mistaken for file headers
+            tag = line[:1] if line[:1] in (" ", "-", "+") else None
+            if tag is None and line.startswith("\\"):
+                if hunk["lines"]:
+                    t, text = hunk["lines"][-1]
+                    hunk["lines"][-1] = (t, text.rstrip("\n"))
+                i += 1
+                continue
+            if tag is None and bare.strip() == "":
+                # Editors and models often strip the single space of an empty context line
+                tag, line = " ", " \n"
+            if tag is None:
+                # Fewer body lines than the header promised: end the hunk and read this line afresh
+                hunk, old_left, new_left = None, 0, 0
+                continue
+            hunk["lines"].append((tag, line[1:] if line.endswith("\n") else line[1:] + "\n"))
+            old_left -= tag != "+"
+            new_left -= tag != "-"
+            i += 1
+            continue
+        if bare.startswith("diff --git "):
+            # Its paths stand in when ---/+++ lines are absent (an empty file created or deleted, a mode change)
+            old, new = _git_diff_paths(bare[len("diff --git "):])
+            cur = {"old": old, "new": new, "rename": False, "hunks": [], "git": True}
+            files.append(cur)
+            hunk = None
+        elif bare.startswith("rename from ") and cur is not None:
+            cur["old"], cur["rename"] = bare[len("rename from "):], True
+        elif bare.startswith("rename to ") and cur is not None:
+            cur["new"], cur["rename"] = bare[len("rename to "):], True
+        elif bare.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            if cur is None or cur["hunks"] or cur.get("headers"):
+                cur = {"old": None, "new": None, "rename": False, "hunks": [], "git": False}
+                files.append(cur)
+            old, new = _patch_path(bare[4:]), _patch_path(lines[i + 1].rstrip("\r\n")[4:])
+            if not cur["rename"]:
+                cur["old"], cur["new"] = old, new
+            cur["created"], cur["deleted"], cur["headers"] = old is None, new is None, True
+            hunk = None
+            i += 1
+        elif bare.startswith("new file mode") and cur is not None:
+            cur["created"] = True
+        elif bare.startswith("deleted file mode") and cur is not None:
+            cur["deleted"] = True
+        elif _HUNK_RE.match(bare) and cur is not None:
+            m = _HUNK_RE.match(bare)
+            hunk = {"header": bare, "old_start": int(m.group(1)), "lines": []}
+            old_left = int(m.group(2)) if m.group(2) is not None else 1
+            new_left = int(m.group(4)) if m.group(4) is not None else 1
+            cur["hunks"].append(hunk)
+        elif hunk is not None and line.startswith("\\") and hunk["lines"]:
+            # "\ No newline at end of file" right after a hunk's last line
+            tag, text = hunk["lines"][-1]
+            hunk["lines"][-1] = (tag, text.rstrip("\n"))
+        else:
+            hunk = None
+        i += 1
+    for f in files:
+        if not f.get("headers") and f.get("created"):
+            f["old"] = None
+        if not f.get("headers") and f.get("deleted"):
+            f["new"] = None
+        # Strip git's a/ and b/ prefixes
+        paths = [p for p in (f["old"], f["new"]) if p]
+        if (f["git"] or (f["old"] or "a/").startswith("a/") and (f["new"] or "b/").startswith("b/")) \
+                and all(p.startswith(("a/", "b/")) for p in paths) and not f["rename"]:
+            f["old"] = f["old"][2:] if f["old"] else None
+            f["new"] = f["new"][2:] if f["new"] else None
+    return [f for f in files if f["old"] or f["new"]]
+
+
+def _find_block(keys: list, block: list, expected: int, max_offset: Optional[int]) -> Optional[int]:
+    """Start of block in keys closest to expected (within max_offset lines), or None."""
+    n = len(block)
+    if n == 0:
+        return min(max(expected, 0), len(keys))
+    starts = [i for i, k in enumerate(keys[:len(keys) - n + 1]) if k == block[0]
+              and (max_offset is None or abs(i - expected) <= max_offset)]
+    for i in sorted(starts, key=lambda i: abs(i - expected)):
+        if keys[i:i + n] == block:
+            return i
+    return None
+
+
+def _apply_hunks(content: str, hunks: list, fuzz: int, max_offset: Optional[int]):
+    """(new content, notes, rejects): every hunk located by offset search, trailing-whitespace and
+    whitespace-insensitive comparison and up to fuzz dropped context lines at each end."""
+    lines = content.splitlines(keepends=True)
+    eol = "\r\n" if lines and lines[0].endswith("\r\n") else "\n"
+    notes, rejects = [], []
+    shift = 0
+    for n, h in enumerate(hunks, 1):
+        body = h["lines"]
+        lead = next((k for k, (tag, _) in enumerate(body) if tag != " "), len(body))
+        trail = next((k for k, (tag, _) in enumerate(reversed(body)) if tag != " "), len(body))
+        expected = max(h["old_start"] - 1, 0) + shift
+        found = None
+        for level in range(fuzz + 1):
+            top, bottom = min(level, lead), min(level, trail)
+            if level and not (top or bottom) or top + bottom >= len(body):
+                continue
+            part = body[top:len(body) - bottom]
+            old = [text for tag, text in part if tag != "+"]
+            for how, key in (("", lambda l: l.rstrip("\r\n")), ("ignoring trailing whitespace", str.rstrip), ("ignoring whitespace", _norm)):
+                pos = _find_block([key(l) for l in lines], [key(l) for l in old], expected + top, max_offset)
+                if pos is not None:
+                    found = (pos, part, old, level, how)
+                    break
+            if found:
+                break
+        if found is None:
+            old_text = "".join(text for tag, text in body if tag != "+").rstrip("\n")
+            rejects.append((n, h["header"], _edit_miss_report("".join(lines), old_text, "the hunk") if old_text.strip() else ""))
+            continue
+        pos, part, old, level, how = found
+        # Context keeps the file's own lines (its whitespace, its line endings); additions take the file's EOL
+        new, k = [], pos
+        for tag, text in part:
+            if tag == " ":
+                new.append(lines[k])
+                k += 1
+            elif tag == "-":
+                k += 1
+            else:
+                new.append(text[:-1] + eol if text.endswith("\n") else text)
+        if new and not new[-1].endswith("\n") and k < len(lines):
+            new[-1] += eol
+        lines[pos:pos + len(old)] = new
+        offset = pos - (expected + top)
+        shift += len(new) - len(old)
+        detail = [d for d in (f"offset {offset:+d} lines" if offset else "",
+                              f"fuzz {level}" if level else "", how) if d]
+        if detail:
+            notes.append(f"hunk {n} applied with {', '.join(detail)}")
+    return "".join(lines), notes, rejects
+
+
+def apply_patch(patch: str, fuzz: Optional[int] = None, max_offset: Optional[int] = None) -> str:
+    """Apply a unified diff (git or plain diff -u) to files under the current directory, all or nothing.
+
+    Hunks are located at their stated line first, then at the nearest offset (at most max_offset lines
+    away when given); context may differ in whitespace, and up to fuzz context lines (default 2) may be
+    dropped at each end of a hunk. Supports file creation (--- /dev/null), deletion (+++ /dev/null) and
+    git renames. If any hunk is rejected nothing is written and each rejected hunk is reported with the
+    closest text in the file.
+    """
+    try:
+        if not isinstance(patch, str) or not patch.strip():
+            return "Error: patch must be a non-empty unified diff."
+        fuzz = DEFAULT_PATCH_FUZZ if fuzz is None else max(0, int(fuzz))
+        max_offset = None if max_offset is None else max(0, int(max_offset))
+        files = _parse_patch(patch)
+        if not files:
+            return "Error: no file headers (--- / +++ lines) found; give a unified diff."
+        system_dirs = ["/etc", "/usr", "/var", "/sys", "/boot", "/dev"]
+        cwd = Path(os.getcwd())
+        writes, deletes, report, errors = {}, [], [], []
+        for f in files:
+            name = f["new"] or f["old"]
+            src = (cwd / (f["old"] or f["new"])).resolve()
+            dst = (cwd / f["new"]).resolve() if f["new"] else None
+            if any(str(p).startswith(d) for p in (src, dst) if p for d in system_dirs):
+                errors.append(f"{name}: Error: Cannot edit system files in protected directories!")
+                continue
+            created = f.get("created") or f["old"] is None
+            if created:
+                if src.exists() and src.stat().st_size:
+                    errors.append(f"{name}: Error: the patch creates this file but it already exists.")
+                    continue
+                content = ""
+            else:
+                if src in writes:
+                    content = writes[src]
+                elif src.is_file():
+                    with open(src, 'r', newline='') as fh:
+                        content = fh.read()
+                else:
+                    errors.append(f"{name}: Error: file not found.")
+                    continue
+            new_content, notes, rejects = _apply_hunks(content, f["hunks"], fuzz, max_offset)
+            for n, header, near in rejects:
+                errors.append(f"{name}: hunk {n} of {len(f['hunks'])} ({header}) rejected: its context and removed lines"
+                              f" were not found{' with fuzz ' + str(fuzz) if fuzz else ''}." + (f"\n{near}" if near else ""))
+            if rejects:
+                continue
+            if f.get("deleted") or f["new"] is None:
+                if new_content.strip():
+                    errors.append(f"{name}: Error: the patch deletes this file but its hunks do not cover all of it.")
+                    continue
+                deletes.append(src)
+                report.append(f"{name}: deleted")
+                continue
+            writes[dst] = new_content
+            if f["rename"] and src != dst:
+                deletes.append(src)
+                what = f"renamed from {f['old']}"
+            else:
+                what = "created" if created else "patched"
+            hunks = f"{len(f['hunks'])} hunk(s)" + (f"; {'; '.join(notes)}" if notes else "")
+            report.append(f"{name}: {what}, {hunks}")
+        if errors:
+            return f"Patch not applied; no files were changed. {len(errors)} problem(s):\n" + "\n".join(errors)
+        for path, content in writes.items():
+            if path.exists() and path.is_file():
+                with open(path, 'r', newline='') as fh:
+                    if fh.read() == content:
+                        continue
+            _write_atomic(path, content)
+        for path in deletes:
+            if path not in writes and path.exists():
+                path.unlink()
+        return "Success! Patch applied.\n" + "\n".join(report)
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
 def run_javascript(args: dict) -> str:
     """
     Execute a JS snippet in a Chrome/Chromium instance that is already running
-    with `--remote-debugging-port=9222`.
+    with `--remote-debugging-port=9222` (EG_CDP_ADDRESS to change it), over a
+    persistent DevTools connection (see cdp_client).
     * If `url` is supplied, the function tries to locate a tab whose current URL
-      exactly matches that string (including scheme, host, path and query).
-      You can also request “query‑parameter exact” matching by setting
-      `url_match_mode` to "exact_query".
-    * If no such tab exists (and `url` is non‑empty), a new tab is opened and
-      navigated to the supplied URL before running the script.
+      matches it: by default scheme, host and path must be equal and the query
+      parameters given in `url` must have the same values ("exact_query");
+      `url_match_mode` "exact" requires the whole URL to be identical.
+    * If no such tab exists (and `url` is non‑empty), a new tab is opened at the
+      supplied URL and the script runs once it has loaded.
+    * The script is a function body: `return` the value you need (it may await).
     * Returns a JSON string: {"result": <script‑return‑value>} or an error message.
     """
-    import json
-    from urllib.parse import urlparse, parse_qsl
+    import cdp_client
     script = args.get("script", "")
-    url_filter = args.get("url", "").strip()
-    # Optional mode: "exact" (default) or "exact"
-    url_match_mode = args.get("url_match_mode", "exact_query")  # new optional key
+    url_filter = (args.get("url") or "").strip()
+    url_match_mode = args.get("url_match_mode") or "exact_query"
     if not script:
         return json.dumps({"error": "No JavaScript `script` supplied to run_javascript."})
-    # -------------------------------------------------------------
-    # 1)  Load Selenium (fallback to Playwright if you prefer)
-    # -------------------------------------------------------------
     try:
-        from selenium import webdriver
-        from selenium.webdriver.chrome.service import Service
-        from selenium.webdriver.chrome.options import Options
-        from webdriver_manager.chrome import ChromeDriverManager
+        result = cdp_client.browser().run(script, url_filter, url_match_mode)
+        return json.dumps({"result": result}, ensure_ascii=False, indent=2)
+    except (OSError, ValueError) as e:
+        # Connection refused, /json unreachable or not JSON
+        return json.dumps({"error": (f"Could not talk to Chrome at {cdp_client.address()} – {e}. "
+                                     "Make sure Chrome is launched with `--remote-debugging-port=9222`.")})
     except Exception as e:
-        return json.dumps({"error": f"Selenium (or webdriver‑manager) not installed – {e}"})
-    # -------------------------------------------------------------
-    # 2)  Attach to the existing Chrome instance started with
-    #    `--remote-debugging-port=9222`
-    # -------------------------------------------------------------
+        return json.dumps({"error": f"Error during script execution: {e}"})
+
+def tool_search(args: dict) -> str:
     try:
-        chrome_options = Options()
-        chrome_options.add_experimental_option("debuggerAddress", "127.0.0.1:9222")
-        driver = webdriver.Chrome(
-            service=Service(ChromeDriverManager().install()),
-            options=chrome_options,
-        )
+        import web_search
+        queries = args.get('queries') or []
+        if isinstance(queries, str):
+            queries = [queries]
+        if args.get('query'):
+            queries = [args['query']] + list(queries)
+        queries = [q.strip() for q in queries if isinstance(q, str) and q.strip()]
+        if not queries:
+            return "Error: give query or queries."
+        max_results = int(args.get('max_results') or web_search.DEFAULT_MAX_RESULTS)
+        return web_search.format_results(web_search.search_many(queries, max_results))
     except Exception as e:
-        return json.dumps(
-            {
-                "error": (
-                    f"Could not attach to Chrome on port 9222 – {e}. "
-                    "Make sure Chrome is launched with `--remote-debugging-port=9222`."
-                )
-            }
-        )
-    # -------------------------------------------------------------
-    # 3)  Choose an existing tab that matches the URL filter, or open a new one.
-    # -------------------------------------------------------------
+        return json.dumps({"error": f"Error during search call execution: {e}"})
+
+def tool_read_artifact(args: dict) -> str:
     try:
-        original_handles = driver.window_handles
-        target_handle = None
-        print(f"url_filter: {url_filter}")
-        if url_filter:
-            print("312")
-            # Parse the filter once – helps with exact or query‑exact matches.
-            filter_parsed = urlparse(url_filter)
-            for h in original_handles:
-                print(f"handle: {h}")
-                driver.switch_to.window(h)
-                current_url = driver.current_url or ""
-                print(f"current_url: {current_url}")
-                # --- BEGIN FIXED SECTION -----------------------------------
-                # Exact full‑URL match:
-                if url_match_mode == "exact":
-                    if current_url == url_filter:
-                        target_handle = h
-                        print("EXACT MATHCHED")
-                        break
-                # Exact query‑parameter match (ignores ordering of params):
-                elif url_match_mode == "exact_query":
-                    print("In exact_query part")
-                    cand_parsed = urlparse(current_url)
-                    # First compare scheme, netloc and path – they must be identical.
-                    if (
-                        filter_parsed.scheme == cand_parsed.scheme
-                        and filter_parsed.netloc == cand_parsed.netloc
-                        and filter_parsed.path == cand_parsed.path
-                    ):
-                        # Convert query strings to dict‑like objects (multidict safe)
-                        # if filter_qs is subset of cand_qs, it's ok
-                        filter_qs = dict(parse_qsl(filter_parsed.query, keep_blank_values=True))
-                        cand_qs = dict(parse_qsl(cand_parsed.query, keep_blank_values=True))
-                        cand_qs = dict((k, cand_qs[k]) for k in filter_qs)
-                        if filter_qs == cand_qs:
-                            target_handle = h
-                            print("EXACT_QUERY MATCHED")
-                            break
-                # ---------------------------------------------------------
-            # If we didn't find a match, open a new tab with the desired URL
-            if not target_handle:
-                print("handle not found")
-                driver.get(url_filter)
-                new_handles = driver.window_handles
-                # The new handle is the one that wasn't present before
-                target_handle = next(
-                    (h for h in new_handles if h not in original_handles), None
-                )
-                if target_handle is None:
-                    # Fallback: just use the newest handle
-                    target_handle = new_handles[-1]
-        # If no URL filter or still no target, fall back to the first tab
-        if not target_handle:
-            if not original_handles:
-                return json.dumps({"error": "No Chrome tabs found."})
-            target_handle = original_handles[0]
-        driver.switch_to.window(target_handle)
+        import artifacts
+        return artifacts.read(args.get('artifact_id', ''), args.get('start_line') or 1,
+                              args.get('num_lines') or artifacts.DEFAULT_PAGE_LINES, args.get('pattern') or None)
     except Exception as e:
-        driver.quit()
-        return json.dumps({"error": f"While selecting/creating tab: {e}"})
-    # -------------------------------------------------------------
-    # 4️⃣  Execute the supplied JavaScript and serialise the return value.
-    # -------------------------------------------------------------
+        return f"Error reading artifact: {e}"
+
+
+def tool_read_file(args: dict, max_chars: int = 16000) -> str:
     try:
-        # Selenium's `execute_script` auto‑wraps the snippet in a function.
-        # Use `return` in your JS if you need a value.
-        result = driver.execute_script(script)
-        out = json.dumps({"result": result}, ensure_ascii=False, indent=2)
+        import file_reader
+        return file_reader.read(args.get('file_path', ''), args.get('start_line'), args.get('end_line'),
+                                args.get('head'), args.get('tail'), args.get('byte_start'), args.get('byte_end'), max_chars)
     except Exception as e:
-        out = json.dumps({"error": f"Error during script execution: {e}"})
-    finally:
-        # Detach from Chrome – do NOT close the browser window.
-        driver.quit()
-    return out
+        return f"Error reading file: {e}"
 
-def tool_search(args: dict) -> str:
+
+def tool_search_code(args: dict) -> str:
     try:
-        query = args.get('query', '').strip()
-        from tavily import TavilyClient
-        client = TavilyClient(os.getenv('TAVILY_API_KEY'))
-        return json.dumps(client.search(query=query), indent=3)
+        import code_index
+        return code_index.search(Path(os.getcwd()), args.get('query', ''), bool(args.get('regex')), bool(args.get('ignore_case')),
+                                 args.get('glob') or None, args.get('context') or 0,
+                                 args.get('max_results') or code_index.DEFAULT_MAX_RESULTS, bool(args.get('refresh')))
     except Exception as e:
-        return json.dumps({"error": f"Error during search call execution: {e}"})
+        return f"Error searching code: {e}"
+
+
+def tool_repo_map(args: dict) -> str:
+    try:
+        import repo_map
+        return repo_map.repo_map(Path(os.getcwd()), args.get('path') or "", args.get('max_tokens'))
+    except Exception as e:
+        return f"Error building repo map: {e}"
+
+
+def tool_fetch_url(args: dict, max_chars: int = 16000) -> str:
+    try:
+        import web_fetch
+        urls = args.get('urls') or []
+        if isinstance(urls, str):
+            urls = [urls]
+        if args.get('url'):
+            urls = [args['url']] + list(urls)
+        return web_fetch.fetch_many(urls, max_chars)
+    except Exception as e:
+        return f"Error fetching: {e}"
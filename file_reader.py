@@ -0,0 +1,164 @@
+"""Ranged file reads for the read_file tool, without loading whole files.
+
+Files are memory-mapped. A sparse line index (the line number at the start of
+every CHUNK_BYTES block, built with C-speed newline counts) is cached per file
+and reused while size and mtime are unchanged; a file that only grew (a log
+being appended to) extends its index from where it left off. Reading lines
+900000-900100 of a multi-GB log therefore touches one block; tail reads find
+their first line by scanning backwards from the end.
+"""
+import mmap
+import os
+import threading
+import zlib
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, List, Optional
+
+CHUNK_BYTES = 1024 * 1024
+DEFAULT_NUM_LINES = 200
+MAX_LINE_CHARS = 4000
+# Bytes before the old end of file compared to tell an append from a rewrite
+APPEND_CHECK_BYTES = 4096
+
+_indexes: Dict[str, "_LineIndex"] = {}
+_indexes_lock = threading.Lock()
+
+
+class _LineIndex:
+    def __init__(self):
+        self.size = 0
+        self.mtime_ns = 0
+        self.tail_crc = 0
+        # starts[k] is the number of newlines before offset k * CHUNK_BYTES
+        self.starts: List[int] = [0]
+        self.lines = 0
+
+    def extend(self, mm, size: int):
+        """Count newlines from the last complete chunk up to size."""
+        k = len(self.starts) - 1
+        count = self.starts[k]
+        del self.starts[k + 1:]
+        pos = k * CHUNK_BYTES
+        while pos < size:
+            end = min(pos + CHUNK_BYTES, size)
+            count += mm[pos:end].count(b"\n")
+            pos = end
+            if pos % CHUNK_BYTES == 0 and pos < size:
+                self.starts.append(count)
+        self.lines = count + (1 if size and mm[size - 1:size] != b"\n" else 0)
+        self.size = size
+
+    def offset_of_line(self, mm, line_no: int) -> int:
+        """Byte offset where 1-based line_no starts (size if past the end)."""
+        target = line_no - 1
+        # Last chunk starting before the target-th newline, so the line cannot begin before it
+        k = max(bisect_left(self.starts, target) - 1, 0)
+        pos, count = k * CHUNK_BYTES, self.starts[k]
+        while count < target:
+            nl = mm.find(b"\n", pos, self.size)
+            if nl == -1:
+                return self.size
+            pos, count = nl + 1, count + 1
+        return pos
+
+
+def _tail_crc(mm, size: int) -> int:
+    return zlib.crc32(mm[max(0, size - APPEND_CHECK_BYTES):size])
+
+
+def _index_for(path: str, mm, st) -> _LineIndex:
+    with _indexes_lock:
+        idx = _indexes.get(path)
+        if idx is not None and idx.size == st.st_size and idx.mtime_ns == st.st_mtime_ns:
+            return idx
+        # Only a file that grew and still ends with the bytes it ended with is treated as appended to;
+        # a same-size rewrite (new mtime) can move newlines anywhere, so it is recounted from scratch
+        if idx is None or st.st_size <= idx.size or _tail_crc(mm, idx.size) != idx.tail_crc:
+            idx = _LineIndex()
+        idx.extend(mm, st.st_size)
+        idx.mtime_ns = st.st_mtime_ns
+        idx.tail_crc = _tail_crc(mm, st.st_size)
+        _indexes[path] = idx
+        return idx
+
+
+def _format(first_line: int, data: bytes) -> List[str]:
+    text = data.decode("utf-8", errors="replace")
+    if text.endswith("\n"):
+        text = text[:-1]
+    rows = []
+    for i, line in enumerate(text.split("\n"), first_line):
+        line = line.rstrip("\r")
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS] + f" ... [{len(line) - MAX_LINE_CHARS} more chars]"
+        rows.append(f"{i}: {line}")
+    return rows
+
+
+def _fit(header: str, rows: List[str], max_chars: int, more: str) -> str:
+    out, size = [header], len(header)
+    for n, row in enumerate(rows):
+        if size + len(row) + 1 > max_chars and n:
+            out.append(f"... [cut to fit the output budget; {more.format(line=row.split(':', 1)[0])}]")
+            break
+        out.append(row)
+        size += len(row) + 1
+    return "\n".join(out)
+
+
+def _tail_offset(mm, size: int, n: int) -> int:
+    """Offset of the start of the last n lines (a trailing newline does not start a line)."""
+    pos = size - 1 if size and mm[size - 1:size] == b"\n" else size
+    for _ in range(n):
+        nl = mm.rfind(b"\n", 0, pos)
+        if nl == -1:
+            return 0
+        pos = nl
+    return pos + 1
+
+
+def read(file_path: str, start_line: Optional[int] = None, end_line: Optional[int] = None,
+         head: Optional[int] = None, tail: Optional[int] = None,
+         byte_start: Optional[int] = None, byte_end: Optional[int] = None,
+         max_chars: int = 16000) -> str:
+    """Line-numbered slice of a file: lines start_line..end_line, the first head or last tail lines, or a byte range."""
+    path = Path(os.getcwd(), file_path).resolve()
+    if not path.is_file():
+        return f"Error: {file_path} is not a file."
+    st = path.stat()
+    if st.st_size == 0:
+        return f"{file_path}: empty file"
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = st.st_size
+        if b"\0" in mm[:8192]:
+            return f"Error: {file_path} looks binary ({size} bytes); use byte_start/byte_end with bash (xxd) instead."
+        if byte_start is not None or byte_end is not None:
+            lo = max(0, int(byte_start or 0))
+            hi = min(size, int(byte_end) if byte_end is not None else lo + max_chars)
+            data = mm[lo:hi]
+            header = f"{file_path}: bytes {lo}-{hi} of {size}"
+            body = data.decode("utf-8", errors="replace")
+            if len(body) > max_chars:
+                body = body[:max_chars] + f"\n... [cut to fit the output budget; continue with byte_start={lo + len(body[:max_chars].encode('utf-8'))}]"
+            return f"{header}\n{body}"
+        if tail:
+            lo = _tail_offset(mm, size, int(tail))
+            # Line numbers need the index; counting newlines before lo is one C pass at worst
+            first = _index_for(str(path), mm, st).lines - int(tail) + 1 if lo else 1
+            rows = _format(max(first, 1), mm[lo:size])
+            return _fit(f"{file_path}: last {len(rows)} lines (lines {max(first, 1)}-{max(first, 1) + len(rows) - 1}, {size} bytes)",
+                        rows, max_chars, "read on with start_line={line}")
+        idx = _index_for(str(path), mm, st)
+        start = max(1, int(start_line or 1))
+        if head:
+            start, end = 1, int(head)
+        else:
+            end = int(end_line) if end_line else start + DEFAULT_NUM_LINES - 1
+        end = min(end, idx.lines)
+        if start > idx.lines:
+            return f"{file_path}: has only {idx.lines} lines."
+        lo = idx.offset_of_line(mm, start)
+        hi = idx.offset_of_line(mm, end + 1)
+        rows = _format(start, mm[lo:hi])
+        return _fit(f"{file_path}: lines {start}-{end} of {idx.lines}", rows, max_chars, "continue with start_line={line}")
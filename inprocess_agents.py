@@ -0,0 +1,258 @@
+"""In-process child agents on a shared asyncio event loop.
+
+spawn_agent_auto with runtime "inprocess" runs the child inside the parent
+process instead of starting chat.py: each child is a lightweight ChatClient-like
+object with its own message list and agent directory, driven by an asyncio task
+on one background loop. All children share one HTTP connection pool and one
+loaded model/provider index. Provider requests are non-streaming; blocking work
+(HTTP, tool execution) runs on a bounded thread pool (EG_INPROCESS_WORKERS).
+
+Children get a restricted tool set: no spawning or waiting (their identity is
+not in os.environ) and no javascript tool. python is offered only while the
+python tool runs in a kernel process (EG_PYTHON_KERNEL, on by default); the
+fallback exec()s in this process and swaps sys.stdout, which children must not
+do concurrently. Results go through the agent registry like every other runtime, and
+wait_agents awaits the children's futures directly when it only waits on them.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+from rich import box
+from rich.console import Console
+
+import agent_registry
+import agent_scheduler
+import chat_index
+import python_kernel
+import tool_manager
+from chat_client import ChatClient, HEADLESS_NUDGE, SUBAGENT_INSTRUCTION, headless_max_nudges
+from config import load_configs
+from display import DisplayManager
+
+INPROCESS_TOOLS = ("bash", "str_replace_editor", "multi_edit", "apply_patch", "replace_between", "search_tavily", "fetch_url", "read_artifact", "read_file", "search_code", "repo_map", "popContext")
+MAX_TURNS = 100
+HTTP_RETRIES = 3
+
+
+def inprocess_tools() -> tuple:
+    """Tools a child may call; python only when it runs out of process."""
+    return INPROCESS_TOOLS + (("python",) if python_kernel.enabled() else ())
+
+
+def max_workers() -> int:
+    try:
+        return max(1, int(os.environ.get('EG_INPROCESS_WORKERS', '32') or 32))
+    except ValueError:
+        return 32
+
+
+class _Shared:
+    """State shared by every in-process agent: event loop, worker pool, HTTP pool and model index."""
+
+    def __init__(self):
+        self.models_config, self.providers_config = load_configs()
+        workers = max_workers()
+        self.http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=workers)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inproc-agent")
+        self.loop = asyncio.new_event_loop()
+        self.system_prompt = ChatClient._build_system_prompt(self)
+        threading.Thread(target=self.loop.run_forever, daemon=True, name="inproc-agents-loop").start()
+
+    # _build_system_prompt is borrowed from ChatClient and only needs these
+    console = Console(stderr=True)
+    aimd_content = ""
+
+
+_shared: Optional[_Shared] = None
+_shared_lock = threading.Lock()
+# agent_id -> (future, agent) for children started by this process
+_agents: Dict[str, Any] = {}
+_exiting = False
+
+
+def _get_shared() -> _Shared:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = _Shared()
+        return _shared
+
+
+class InProcessAgent:
+    """Duck-typed stand-in for ChatClient that handle_tool_call can drive."""
+
+    # Reuse the provider payload helpers as-is
+    _sanitize_messages_for_api = ChatClient._sanitize_messages_for_api
+    _get_model_parameters = ChatClient._get_model_parameters
+
+    def __init__(self, shared: _Shared, tree_id: str, agent_id: str, parent_id: str, agent_dir: str, model_key: str, context_text: str):
+        self.tree_id, self.agent_id, self.parent_id = tree_id, agent_id, parent_id
+        self.agent_dir = Path(agent_dir)
+        self.models_config = shared.models_config
+        self.providers_config = shared.providers_config
+        self.http = shared.http
+        self.current_model_key = model_key if model_key in self.models_config else next(iter(self.models_config), "")
+        self.headless = True
+        self.yesToolFlag = True
+        self.in_single_turn_auto_execute_calls = True
+        self.allowed_tools = inprocess_tools()
+        self.tools = [t for t in tool_manager.TOOLS if t["function"]["name"] in self.allowed_tools]
+        self.borders_enabled = False
+        self.boxStyle = box.MINIMAL
+        self.show_thinking = True
+        self.short_recap: Optional[str] = None
+        self._log = open(self.agent_dir / 'output.log', 'a', encoding='utf-8')
+        self.console = Console(file=self._log, force_terminal=False, highlight=False, width=100)
+        self.display_manager = DisplayManager(self)
+        self.messages: List[Dict] = [
+            {"role": "system", "content": shared.system_prompt},
+            {"role": "user", "content": f"{context_text}\n\n{SUBAGENT_INSTRUCTION}"},
+        ]
+        self.result: Optional[Dict[str, Any]] = None
+        self.display_manager.render_message(self.messages[1])
+
+    # ---- provider -----------------------------------------------------------
+
+    def _request(self) -> Dict[str, Any]:
+        model_config = self.models_config.get(self.current_model_key, {})
+        provider_config = self.providers_config.get(model_config.get("provider"), {}) or {}
+        headers = {"Content-Type": "application/json"}
+        api_key_env = provider_config.get("api_key_env")
+        headers["Authorization"] = f"Bearer {os.environ.get(api_key_env, 'NOT_SET') if api_key_env else 'NOT_SET'}"
+        payload = {
+            "model": model_config.get("model_name"),
+            "messages": self._sanitize_messages_for_api(self.messages),
+            "tools": self.tools,
+            "tool_choice": "auto",
+            "stream": False,
+        }
+        payload.update(self._get_model_parameters(model_config))
+        delay = 2.0
+        for attempt in range(HTTP_RETRIES):
+            resp = self.http.post(provider_config.get("api_base"), headers=headers, json=payload, timeout=600)
+            if resp.status_code in (429, 500, 502, 503) and attempt < HTTP_RETRIES - 1:
+                time.sleep(delay)
+                delay *= 2
+                continue
+            resp.raise_for_status()
+            return (resp.json().get("choices") or [{}])[0].get("message") or {}
+        return {}
+
+    # ---- ChatClient surface used by handle_tool_call ------------------------
+
+    def pop_context(self, return_value: str) -> str:
+        self._finish({
+            "status": "done",
+            "return_value": return_value,
+            "short_recap": self.short_recap or "",
+            "finished_at": int(time.time()),
+        })
+        return f"Result recorded. Return value: {return_value}"
+
+    def _finish(self, result: Dict[str, Any]):
+        if self.result is not None:
+            return
+        self.result = result
+        if result.get("error"):
+            self.console.print(f"Stopped: {result['error']}", markup=False)
+        try:
+            tool_manager._write_json(self.agent_dir / 'messages.json', self.messages)
+            chat_index.index_messages(Path.cwd() / '.egg' / 'localChats', self.agent_dir / 'messages.json', self.messages)
+        except Exception:
+            pass
+        agent_registry.get_registry().finish(self.tree_id, self.agent_id, self.parent_id, result)
+        if not _exiting:
+            agent_scheduler.dispatch(self.tree_id)
+
+    # ---- driver -------------------------------------------------------------
+
+    async def run(self, shared: _Shared):
+        loop = asyncio.get_running_loop()
+        nudges = 0
+        try:
+            for _ in range(MAX_TURNS):
+                msg = await loop.run_in_executor(shared.executor, self._request)
+                assistant = {"role": "assistant", "content": msg.get("content") or "", "model_key": self.current_model_key}
+                if msg.get("reasoning_content"):
+                    assistant["reasoning_content"] = msg["reasoning_content"]
+                if msg.get("tool_calls"):
+                    assistant["tool_calls"] = msg["tool_calls"]
+                if assistant["content"]:
+                    self.short_recap = ChatClient.extract_short_recap(self, assistant["content"])
+                self.messages.append(assistant)
+                self.display_manager.render_message(assistant)
+                for tc in assistant.get("tool_calls") or []:
+                    await loop.run_in_executor(shared.executor, tool_manager.handle_tool_call, self, tc, False)
+                    if self.result is not None:
+                        return self.result
+                if not assistant.get("tool_calls"):
+                    if nudges >= headless_max_nudges():
+                        break
+                    nudges += 1
+                    self.messages.append({"role": "user", "content": HEADLESS_NUDGE})
+                    self.display_manager.render_message(self.messages[-1])
+            last = next((m.get("content") for m in reversed(self.messages) if m.get("role") == "assistant" and m.get("content")), "")
+            self._finish({"status": "error", "return_value": last or "", "short_recap": self.short_recap or "",
+                          "error": "agent did not call popContext", "finished_at": int(time.time())})
+        except Exception as e:
+            self._finish({"status": "error", "return_value": "", "error": f"{type(e).__name__}: {e}",
+                          "finished_at": int(time.time())})
+        finally:
+            try:
+                self._log.close()
+            except Exception:
+                pass
+        return self.result
+
+
+def start(tree_id: str, agent_id: str, parent_id: str, agent_dir: str, model_key: str, context_text: str) -> concurrent.futures.Future:
+    """Schedule a child on the shared loop; returns a future resolving to its result dict."""
+    shared = _get_shared()
+    agent = InProcessAgent(shared, tree_id, agent_id, parent_id, agent_dir, model_key, context_text)
+    fut = asyncio.run_coroutine_threadsafe(agent.run(shared), shared.loop)
+    _agents[agent_id] = (fut, agent)
+    return fut
+
+
+def futures_for(agent_ids) -> Dict[str, concurrent.futures.Future]:
+    return {cid: _agents[cid][0] for cid in agent_ids if cid in _agents}
+
+
+def wait(futures: List[concurrent.futures.Future], timeout: Optional[float], any_mode: bool):
+    concurrent.futures.wait(futures, timeout=timeout,
+                            return_when=concurrent.futures.FIRST_COMPLETED if any_mode else concurrent.futures.ALL_COMPLETED)
+
+
+@atexit.register
+def _abandon_running():
+    """Children die with their parent process; record that instead of leaving them 'active' forever."""
+    global _exiting
+    _exiting = True
+    for fut, agent in list(_agents.values()):
+        if not fut.done() and agent.result is None:
+            try:
+                agent._finish({"status": "error", "return_value": "", "error": "parent process exited",
+                               "finished_at": int(time.time())})
+            except Exception:
+                pass
+    # Queued in-process children of this process can no longer be started by anyone
+    try:
+        tree_id = tool_manager._resolve_tree_id()
+        reg = agent_registry.get_registry()
+        for row in reg.children(tree_id, status="queued"):
+            if (row.get("launch") or {}).get("owner_pid") == os.getpid():
+                reg.finish(tree_id, row["agent_id"], row["parent_id"], {
+                    "status": "error", "return_value": "", "error": "parent process exited",
+                    "finished_at": int(time.time())})
+    except Exception:
+        pass
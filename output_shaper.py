@@ -0,0 +1,208 @@
+"""Fit tool output into a token budget before it enters the transcript.
+
+Output is first cleaned of terminal noise only: ANSI/OSC escapes and control
+characters are stripped, carriage-return progress updates keep only their
+final state, runs of progress-bar redraws (a bar followed by a rate or ETA, as
+tqdm, pip and wget print them) collapse to the last one, and runs of identical
+lines collapse to one line plus a count. Output over budget is then condensed:
+long Python / JS / Java stack traces keep their outermost and innermost frames,
+and if that is still too long its head and tail are kept. Either way the full
+original is stored as an artifact the model can page through with read_artifact.
+
+Budgets are in tokens (estimated as characters / 4), resolved in this order:
+  1. models.json model entry "tool_output_tokens": {"<tool>": n, ...}
+  2. EG_OUTPUT_TOKENS_<TOOL> (e.g. EG_OUTPUT_TOKENS_BASH)
+  3. models.json model entry "tool_output_tokens": n
+  4. EG_OUTPUT_TOKENS (default 4000)
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import artifacts
+
+DEFAULT_BUDGET_TOKENS = 4000
+CHARS_PER_TOKEN = 4
+HEAD_SHARE = 0.6
+# Identical consecutive lines beyond this many are collapsed
+REPEAT_KEEP = 2
+# Traces with more frames than this keep TRACE_HEAD outermost and TRACE_TAIL innermost frames
+TRACE_MAX_FRAMES = 6
+TRACE_HEAD, TRACE_TAIL = 2, 3
+
+_ANSI_RE = re.compile(r"\x1B(?:\][^\x07\x1B]*(?:\x07|\x1B\\)|\[[0-?]*[ -/]*[@-~]|[@-Z\\-_])")
+_CTRL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+# A progress redraw is a bar followed by a rate or ETA; a bar alone may be a table row or a banner
+_PROGRESS_RE = re.compile(
+    r"^\s*(?:.{0,60}?\d{1,3}(?:\.\d+)?%\s*\|[^|]*\|"        # tqdm:  42%|████      |
+    r"|.{0,60}?\[[=#>\-. ]*>[=#>\-. ]*\]"                     # wget: [=====>    ]
+    r"|.{0,60}?[█▉▊▋▌▍▎▏░▒▓━╸╺]{5,})"                         # block / rich bars
+    r".*?(?:\d[\d.]*\s*(?:[kKMGT]?i?B|it)/s\b|\bs/it\b|\beta\b|<\d+:\d+)", re.I)  # 3.1it/s, 2MB/s, eta 0:01, [00:01<00:02
+_PY_FRAME_RE = re.compile(r'^\s*File ".*", line \d+')
+_AT_FRAME_RE = re.compile(r"^\s+at \S")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def budget(tool: Optional[str] = None, model_config: Optional[Dict[str, Any]] = None) -> int:
+    """Token budget for one output of tool under the given model entry."""
+    per_model = (model_config or {}).get("tool_output_tokens")
+    candidates = []
+    if isinstance(per_model, dict) and tool:
+        candidates.append(per_model.get(tool))
+    if tool:
+        candidates.append(os.environ.get(f"EG_OUTPUT_TOKENS_{re.sub(r'[^A-Za-z0-9]', '_', tool).upper()}"))
+    if not isinstance(per_model, dict):
+        candidates.append(per_model)
+    candidates.append(os.environ.get("EG_OUTPUT_TOKENS"))
+    for value in candidates:
+        try:
+            if value not in (None, ""):
+                return max(1, int(value))
+        except (TypeError, ValueError):
+            continue
+    return DEFAULT_BUDGET_TOKENS
+
+
+def _collapse_progress(lines: List[str]) -> List[str]:
+    out: List[str] = []
+    run = 0
+    for line in lines:
+        if _PROGRESS_RE.match(line):
+            if run:
+                out[-1] = line
+            else:
+                out.append(line)
+            run += 1
+        else:
+            run = 0
+            out.append(line)
+    return out
+
+
+def _collapse_repeats(lines: List[str]) -> List[str]:
+    out: List[str] = []
+    i = 0
+    while i < len(lines):
+        j = i
+        while j + 1 < len(lines) and lines[j + 1] == lines[i]:
+            j += 1
+        n = j - i + 1
+        if n > REPEAT_KEEP and lines[i].strip():
+            out.extend(lines[i:i + REPEAT_KEEP])
+            out.append(f"[previous line repeated {n - REPEAT_KEEP} more times]")
+        else:
+            out.extend(lines[i:j + 1])
+        i = j + 1
+    return out
+
+
+def _frames(lines: List[str], start: int) -> Tuple[List[List[str]], int]:
+    """Python frames from start: each 'File ...' line with its indented source lines. Returns (frames, end)."""
+    frames: List[List[str]] = []
+    i = start
+    while i < len(lines):
+        if _PY_FRAME_RE.match(lines[i]):
+            frames.append([lines[i]])
+        elif frames and lines[i].startswith("    ") and not _PY_FRAME_RE.match(lines[i]):
+            frames[-1].append(lines[i])
+        else:
+            break
+        i += 1
+    return frames, i
+
+
+def _summarize_traces(lines: List[str]) -> List[str]:
+    out: List[str] = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("Traceback (most recent call last):"):
+            frames, end = _frames(lines, i + 1)
+            out.append(line)
+            if len(frames) > TRACE_MAX_FRAMES:
+                kept = frames[:TRACE_HEAD] + [[f"  [... {len(frames) - TRACE_HEAD - TRACE_TAIL} frames omitted ...]"]] + frames[-TRACE_TAIL:]
+            else:
+                kept = frames
+            for frame in kept:
+                out.extend(frame)
+            i = end
+            continue
+        if _AT_FRAME_RE.match(line):
+            j = i
+            while j < len(lines) and _AT_FRAME_RE.match(lines[j]):
+                j += 1
+            run = lines[i:j]
+            if len(run) > TRACE_MAX_FRAMES:
+                run = run[:TRACE_HEAD] + [f"    [... {len(run) - TRACE_HEAD - TRACE_TAIL} frames omitted ...]"] + run[-TRACE_TAIL:]
+            out.extend(run)
+            i = j
+            continue
+        out.append(line)
+        i += 1
+    return out
+
+
+def clean(text: str) -> str:
+    """Noise-free version of text with nothing of substance dropped (repeats are counted, not lost)."""
+    if not isinstance(text, str) or not text:
+        return text
+    text = _ANSI_RE.sub("", text).replace("\r\n", "\n")
+    lines = []
+    for line in text.split("\n"):
+        if "\r" in line:
+            # A terminal shows only what the last carriage return wrote
+            line = next((seg for seg in reversed(line.split("\r")) if seg), "")
+        lines.append(_CTRL_RE.sub("", line))
+    lines = _collapse_progress(lines)
+    lines = _collapse_repeats(lines)
+    return "\n".join(lines)
+
+
+def _head_tail(lines: List[str], max_chars: int) -> Tuple[List[str], List[str]]:
+    head_chars = int(max_chars * HEAD_SHARE)
+    head, size = [], 0
+    for line in lines:
+        if size + len(line) + 1 > head_chars:
+            if not head:
+                head.append(line[:head_chars])
+            break
+        head.append(line)
+        size += len(line) + 1
+    tail, size = [], 0
+    tail_chars = max_chars - head_chars
+    for line in reversed(lines[len(head):]):
+        if size + len(line) + 1 > tail_chars:
+            if not tail:
+                tail.append(line[-tail_chars:])
+            break
+        tail.append(line)
+        size += len(line) + 1
+    return head, tail[::-1]
+
+
+def shape(text: str, tool: Optional[str] = None, model_config: Optional[Dict[str, Any]] = None) -> Tuple[str, bool]:
+    """(output for the transcript, whether anything beyond noise was cut to fit the budget)."""
+    if not isinstance(text, str) or not text:
+        return text, False
+    cleaned = clean(text)
+    limit = budget(tool, model_config)
+    if estimate_tokens(cleaned) <= limit:
+        return cleaned, False
+    try:
+        # The artifact keeps every line (repeats and frames included), minus terminal escapes
+        where = f"full output: artifact {artifacts.put(_CTRL_RE.sub('', _ANSI_RE.sub('', text)))}, readable with read_artifact"
+    except OSError:
+        where = "full output not stored"
+    condensed = "\n".join(_summarize_traces(cleaned.split("\n")))
+    if estimate_tokens(condensed) <= limit:
+        return condensed + f"\n[stack frames omitted to fit ~{limit} tokens; {where}]", True
+    lines = condensed.split("\n")
+    head, tail = _head_tail(lines, limit * CHARS_PER_TOKEN)
+    omitted = len(lines) - len(head) - len(tail)
+    kept_tokens = estimate_tokens("\n".join(head + tail))
+    note = (f"[... {omitted} of {len(lines)} lines (~{estimate_tokens(condensed) - kept_tokens} tokens) omitted"
+            f" to fit ~{limit} tokens; {where} ...]")
+    return "\n".join(head + [note] + tail), True
@@ -0,0 +1,262 @@
+"""Out-of-process, persistent Python kernel for the python tool.
+
+Each agent gets one worker process (started on its first python call) that
+keeps its globals between calls, so data loaded once stays loaded. Code runs
+there, not in the chat process: a long computation does not freeze the UI and
+a crash or memory blowup only costs the kernel, which is started again on the
+next call (the result says variables were lost).
+
+  - stdout/stderr of the cell (and of anything it runs) stream back live
+  - timeout_sec per call (default EG_PYTHON_TIMEOUT_SEC, 600): the cell gets a
+    KeyboardInterrupt first, so variables survive; a kernel that does not
+    respond within a few seconds is killed
+  - EG_PYTHON_MEMORY_MB caps the kernel's address space (RLIMIT_AS), so a
+    blowup raises MemoryError in the cell instead of taking the host down
+  - if the last statement of a cell is an expression, its repr is printed
+  - restart: true on the python tool starts from a fresh kernel
+
+Control messages travel over two extra pipes, so the cell's stdin/stdout stay
+ordinary. Set EG_PYTHON_KERNEL=0 to run code inside the chat process as before.
+"""
+import ast
+import atexit
+import codecs
+import json
+import linecache
+import os
+import select
+import selectors
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Callable, Optional
+
+import executors
+
+DEFAULT_TIMEOUT_SEC = 600
+INTERRUPT_GRACE_SEC = 3
+CELL_FILENAME = "<python tool>"
+
+_kernels: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_kernels_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.environ.get('EG_PYTHON_KERNEL', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+# ---- kernel side ------------------------------------------------------------
+
+def _run_cell(code: str, ns: dict):
+    # Lets tracebacks show the failing source lines of the cell
+    linecache.cache[CELL_FILENAME] = (len(code), None, code.splitlines(True), CELL_FILENAME)
+    tree = ast.parse(code, CELL_FILENAME, "exec")
+    last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+    exec(compile(tree, CELL_FILENAME, "exec"), ns)
+    if last is not None:
+        value = eval(compile(ast.Expression(last.value), CELL_FILENAME, "eval"), ns)
+        if value is not None:
+            print(repr(value))
+
+
+def serve(cmd_fd: int, evt_fd: int):
+    """Kernel main loop: run each cell received on cmd_fd, report completion on evt_fd."""
+    os.set_inheritable(cmd_fd, False)
+    os.set_inheritable(evt_fd, False)
+    limit_mb = executors._env_number('EG_PYTHON_MEMORY_MB', 0, int)
+    if limit_mb > 0:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (limit_mb * 1024 * 1024, limit_mb * 1024 * 1024))
+    ns = {"__name__": "__main__", "__builtins__": __builtins__}
+    cmd = os.fdopen(cmd_fd, "rb")
+    evt = os.fdopen(evt_fd, "wb", buffering=0)
+    # Interrupts are only meant for a running cell
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for raw in cmd:
+        try:
+            code = json.loads(raw)["code"]
+        except (ValueError, KeyError, TypeError):
+            continue
+        error = None
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            _run_cell(code, ns)
+        except KeyboardInterrupt:
+            error = "KeyboardInterrupt: the cell was interrupted (timeout or Ctrl+C); variables are kept"
+        except BaseException as e:
+            # Drop the kernel's own frames; the user only needs the cell's
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code.co_filename != CELL_FILENAME:
+                tb = tb.tb_next
+            error = "".join(traceback.format_exception(type(e), e, tb)).rstrip()
+        finally:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        evt.write((json.dumps({"done": True, "error": error}) + "\n").encode("utf-8"))
+
+
+# ---- chat side --------------------------------------------------------------
+
+class PythonKernel:
+    def __init__(self):
+        self.proc: Optional[subprocess.Popen] = None
+        self._cmd = None
+        self._evt_fd: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def _start(self):
+        cmd_r, cmd_w = os.pipe()
+        evt_r, evt_w = os.pipe()
+        try:
+            self.proc = subprocess.Popen(
+                [sys.executable, "-u", os.path.abspath(__file__), "--serve", str(cmd_r), str(evt_w)],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                pass_fds=(cmd_r, evt_w), start_new_session=True)
+        finally:
+            os.close(cmd_r)
+            os.close(evt_w)
+        self._cmd = os.fdopen(cmd_w, "wb", buffering=0)
+        self._evt_fd = evt_r
+
+    def close(self):
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                executors._kill_group(self.proc)
+            for f in (self.proc.stdout, self.proc.stderr):
+                try:
+                    f.close()
+                except (OSError, AttributeError):
+                    pass
+        for closer in (lambda: self._cmd and self._cmd.close(), lambda: self._evt_fd is not None and os.close(self._evt_fd)):
+            try:
+                closer()
+            except OSError:
+                pass
+        self._cmd, self._evt_fd = None, None
+
+    def restart(self):
+        with self._lock:
+            self.close()
+            self.proc = None
+
+    def run(self, code: str, timeout_sec: Optional[float] = None, on_output: Optional[Callable[[str], None]] = None) -> str:
+        timeout = float(timeout_sec) if timeout_sec else executors._env_number('EG_PYTHON_TIMEOUT_SEC', DEFAULT_TIMEOUT_SEC, float)
+        capacity = executors._env_number('EG_BASH_BUFFER_BYTES', executors.DEFAULT_STREAM_BUFFER_BYTES, int)
+        with self._lock:
+            notes = []
+            if not self.alive():
+                if self.proc is not None:
+                    notes.append(f"(the Python kernel had exited with code {self.proc.returncode} and was restarted; earlier variables are gone)")
+                self.close()
+                self._start()
+            buffers = {self.proc.stdout.fileno(): executors._StreamBuffer(capacity),
+                       self.proc.stderr.fileno(): executors._StreamBuffer(capacity)}
+            decoders = {fd: codecs.getincrementaldecoder("utf-8")(errors="replace") for fd in buffers}
+            sel = selectors.DefaultSelector()
+            for fd in buffers:
+                sel.register(fd, selectors.EVENT_READ)
+            sel.register(self._evt_fd, selectors.EVENT_READ)
+            evt_data = b""
+            done = None
+            interrupted_at = None
+            deadline = time.monotonic() + timeout
+            try:
+                self._cmd.write((json.dumps({"code": code}) + "\n").encode("utf-8"))
+            except OSError as e:
+                notes.append(f"Error sending code to the Python kernel: {e}")
+                done = {"error": None}
+            while done is None:
+                try:
+                    now = time.monotonic()
+                    if interrupted_at is None and now >= deadline:
+                        notes.append(f"Error: timed out after {timeout:g} seconds.")
+                        os.kill(self.proc.pid, signal.SIGINT)
+                        interrupted_at = now
+                    if interrupted_at is not None and now - interrupted_at > INTERRUPT_GRACE_SEC:
+                        executors._kill_group(self.proc)
+                        notes.append("(the kernel did not respond to the interrupt and was killed; variables are gone)")
+                        break
+                    for key, _ in sel.select(timeout=0.2):
+                        data = os.read(key.fd, 65536)
+                        if key.fd == self._evt_fd:
+                            evt_data += data
+                            if b"\n" in evt_data:
+                                done = json.loads(evt_data.split(b"\n", 1)[0])
+                            elif not data:
+                                done = {}
+                            continue
+                        if not data:
+                            sel.unregister(key.fd)
+                            continue
+                        buffers[key.fd].add(data)
+                        if on_output:
+                            try:
+                                on_output(decoders[key.fd].decode(data))
+                            except Exception:
+                                pass
+                    if done == {}:
+                        # Control pipe closed: the kernel died mid-cell
+                        self.proc.wait()
+                        notes.append(f"(the Python kernel died with exit code {self.proc.returncode}; variables are gone, the next call starts a new kernel)")
+                        break
+                except KeyboardInterrupt:
+                    if interrupted_at is None:
+                        os.kill(self.proc.pid, signal.SIGINT)
+                        interrupted_at = time.monotonic()
+            # The kernel flushed before reporting; collect what is still in the pipes
+            for fd, buf in buffers.items():
+                if fd in sel.get_map():
+                    while True:
+                        ready, _, _ = select.select([fd], [], [], 0)
+                        if not ready:
+                            break
+                        data = os.read(fd, 65536)
+                        if not data:
+                            break
+                        buf.add(data)
+                        if on_output:
+                            try:
+                                on_output(decoders[fd].decode(data))
+                            except Exception:
+                                pass
+            sel.close()
+            for buf in buffers.values():
+                buf.close()
+
+        stdout_buf, stderr_buf = buffers.values()
+        stdout, stderr = stdout_buf.text().strip(), stderr_buf.text().strip()
+        errors = [e for e in [stderr, (done or {}).get("error")] + notes if e]
+        output = ""
+        if stdout:
+            output += f"--- STDOUT ---\n{stdout}\n"
+        if errors:
+            output += "--- STDERR ---\n" + "\n".join(errors) + "\n"
+        return output.strip() or "--- The script executed successfully and produced no output ---"
+
+
+def for_client(client) -> PythonKernel:
+    """The agent's kernel; its process starts on the first call."""
+    with _kernels_lock:
+        kernel = _kernels.get(client)
+        if kernel is None:
+            kernel = PythonKernel()
+            _kernels[client] = kernel
+        return kernel
+
+
+@atexit.register
+def _close_all():
+    for kernel in list(_kernels.values()):
+        kernel.close()
+
+
+if __name__ == "__main__" and len(sys.argv) == 4 and sys.argv[1] == "--serve":
+    serve(int(sys.argv[2]), int(sys.argv[3]))
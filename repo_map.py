@@ -0,0 +1,267 @@
+"""Symbol outline of the working tree for the repo_map tool and the system prompt.
+
+Python files are parsed with ast (classes with their bases, functions and
+methods with their signatures); JS/TS, Go, Rust, Java/Kotlin/C#, C/C++, Ruby,
+PHP and shell use small line-based regex grammars. Each file's outline is
+cached in .egg/index/repo_map.json keyed by size and mtime, so a refresh only
+re-parses changed files. The file list is the one search_code indexes
+(git ls-files, .gitignore respected).
+
+With EG_REPO_MAP_TOKENS=n (default 0, off) the system prompt gets an n-token
+slice of the map. It is rendered from the cache as it is at startup, and a
+background thread brings the cache up to date, so a large or new repository
+never delays startup (its first session just starts without the map).
+"""
+import ast
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import code_index
+
+CACHE_FILE = "repo_map.json"
+DEFAULT_TOOL_TOKENS = 4000
+CHARS_PER_TOKEN = 4
+MAX_FILE_BYTES = 512 * 1024
+MAX_SIGNATURE_CHARS = 120
+
+_lock = threading.Lock()
+_refreshing: Dict[str, threading.Thread] = {}
+
+_DECL = r"(?:export\s+)?(?:default\s+)?(?:public\s+|private\s+|protected\s+|internal\s+|static\s+|abstract\s+|final\s+|async\s+|pub(?:\([^)]*\))?\s+|unsafe\s+|extern\s+\"C\"\s+)*"
+_GRAMMARS: Dict[str, List[Tuple[int, re.Pattern]]] = {}
+
+
+def _grammar(exts, rules):
+    compiled = [(indent, re.compile(rx)) for indent, rx in rules]
+    for ext in exts:
+        _GRAMMARS[ext] = compiled
+
+
+# (indent level, pattern matched against a stripped line); the whole matched line is the signature
+_grammar((".js", ".jsx", ".ts", ".tsx", ".mjs", ".cjs"), [
+    (0, rf"^{_DECL}(?:class|interface|enum|type)\s+\w+"),
+    (0, rf"^{_DECL}function\*?\s+\w+\s*[<(]"),
+    (0, rf"^{_DECL}(?:const|let|var)\s+\w+\s*(?::[^=]+)?=\s*(?:async\s+)?(?:\([^)]*\)|\w+)\s*(?::[^=]+)?=>"),
+])
+_grammar((".go",), [
+    (0, r"^type\s+\w+\s+(?:struct|interface)\b"),
+    (0, r"^func\s+(?:\([^)]*\)\s*)?\w+\s*[\[(]"),
+])
+_grammar((".rs",), [
+    (0, rf"^{_DECL}(?:struct|enum|trait|mod|union)\s+\w+"),
+    (0, r"^impl\b.*"),
+    (1, rf"^{_DECL}(?:const\s+)?fn\s+\w+"),
+])
+_grammar((".java", ".kt", ".kts", ".cs", ".scala"), [
+    (0, rf"^{_DECL}(?:sealed\s+|data\s+|open\s+|partial\s+)*(?:class|interface|enum|record|object|struct|trait)\s+\w+"),
+    (1, rf"^(?!return\b|new\b|throw\b|else\b){_DECL}(?:override\s+|suspend\s+|synchronized\s+)*(?:fun\s+\w+|def\s+\w+|[\w<>\[\],.? ]+\s+\w+\s*\([^;]*$)"),
+])
+_grammar((".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".hh"), [
+    (0, r"^(?:typedef\s+)?(?:struct|class|enum|union|namespace)\s+\w+[^;]*$"),
+    (0, r"^(?!return\b|else\b|if\b|for\b|while\b|switch\b)[A-Za-z_][\w:<>*&, ]*[\s*&]\**[A-Za-z_][\w:~]*\s*\([^;]*$"),
+])
+_grammar((".rb",), [
+    (0, r"^(?:class|module)\s+\w+.*"),
+    (1, r"^def\s+[\w.?!=]+.*"),
+])
+_grammar((".php",), [
+    (0, rf"^{_DECL}(?:class|interface|trait|enum)\s+\w+"),
+    (1, rf"^{_DECL}function\s+&?\w+\s*\("),
+])
+_grammar((".sh", ".bash", ".zsh"), [
+    (0, r"^(?:function\s+)?[\w:.-]+\s*\(\)\s*\{?"),
+])
+
+
+def _signature(text: str) -> str:
+    text = " ".join(text.split()).rstrip("{").rstrip()
+    return text if len(text) <= MAX_SIGNATURE_CHARS else text[:MAX_SIGNATURE_CHARS - 3] + "..."
+
+
+def _python_outline(source: str) -> List[List]:
+    """[[depth, line, signature], ...] for classes, functions and methods."""
+    tree = ast.parse(source)
+    out: List[List] = []
+
+    def visit(body, depth):
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                bases = ", ".join(ast.unparse(b) for b in node.bases + node.keywords)
+                out.append([depth, node.lineno, _signature(f"class {node.name}" + (f"({bases})" if bases else ""))])
+                visit(node.body, depth + 1)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+                ret = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+                out.append([depth, node.lineno, _signature(f"{prefix} {node.name}({ast.unparse(node.args)}){ret}")])
+            elif isinstance(node, (ast.If, ast.Try)) and depth == 0:
+                # Definitions guarded by `if TYPE_CHECKING:` / `try: import ...` still belong to the module
+                visit(node.body, depth)
+
+    visit(tree.body, 0)
+    return out
+
+
+def _regex_outline(source: str, rules) -> List[List]:
+    out: List[List] = []
+    for n, line in enumerate(source.splitlines(), 1):
+        stripped = line.strip()
+        if not stripped or stripped.startswith(("//", "#", "*", "/*")):
+            continue
+        indented = line[:1] in (" ", "\t")
+        for depth, rx in rules:
+            # Top-level rules only match unindented lines; member rules (depth 1) match either
+            if depth == 0 and indented:
+                continue
+            if rx.match(stripped):
+                out.append([1 if indented else 0, n, _signature(stripped)])
+                break
+    return out
+
+
+def outline(path: Path) -> Optional[List[List]]:
+    """Outline of one file, or None for files no grammar covers."""
+    ext = path.suffix.lower()
+    if ext != ".py" and ext not in _GRAMMARS:
+        return None
+    source = path.read_text(encoding="utf-8", errors="replace")
+    if ext == ".py":
+        try:
+            return _python_outline(source)
+        except (SyntaxError, ValueError, RecursionError):
+            return []
+    return _regex_outline(source, _GRAMMARS[ext])
+
+
+def _cache_path(root: Path) -> Path:
+    return code_index.index_dir(root) / CACHE_FILE
+
+
+def _load(root: Path) -> Dict[str, Dict]:
+    try:
+        with open(_cache_path(root), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def refresh(root: Path) -> Dict[str, Dict]:
+    """Bring the cached outlines up to date (re-parsing only changed files) and return them."""
+    root = Path(root)
+    with _lock:
+        cache = _load(root)
+        fresh, changed = {}, False
+        for rel in code_index.list_files(root):
+            p = root / rel
+            if Path(rel).suffix.lower() != ".py" and Path(rel).suffix.lower() not in _GRAMMARS:
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            if st.st_size > MAX_FILE_BYTES:
+                continue
+            entry = cache.get(rel)
+            if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+                fresh[rel] = entry
+                continue
+            try:
+                symbols = outline(p)
+            except OSError:
+                continue
+            if symbols is not None:
+                fresh[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "symbols": symbols}
+                changed = True
+        if changed or len(fresh) != len(cache):
+            d = code_index.index_dir(root)
+            d.mkdir(parents=True, exist_ok=True)
+            tmp = d / f".{CACHE_FILE}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(fresh, f)
+            os.replace(tmp, _cache_path(root))
+        return fresh
+
+
+def refresh_in_background(root: Path):
+    """Start a refresh unless one is already running for root."""
+    key = str(Path(root).resolve())
+    t = _refreshing.get(key)
+    if t is not None and t.is_alive():
+        return
+    t = threading.Thread(target=lambda: _quiet_refresh(root), name="repo-map-refresh", daemon=True)
+    _refreshing[key] = t
+    t.start()
+
+
+def _quiet_refresh(root: Path):
+    try:
+        refresh(root)
+    except Exception:
+        pass
+
+
+def render(entries: Dict[str, Dict], max_tokens: int, prefix: str = "") -> str:
+    """The map as an indented outline, shallow paths first, cut to max_tokens.
+
+    A file whose full outline does not fit is shown with its top-level symbols only, as many as fit;
+    files that do not fit at all are skipped so smaller ones after them still get in.
+    """
+    budget = max_tokens * CHARS_PER_TOKEN
+    paths = sorted((p for p in entries if p.startswith(prefix) and entries[p].get("symbols")),
+                   key=lambda p: (p.count("/"), p))
+    out, size, shown, partial = [], 0, 0, 0
+    for path in paths:
+        symbols = entries[path]["symbols"]
+        block = [path + ":"] + [f"{'  ' * (depth + 1)}{sig}  :{line}" for depth, line, sig in symbols]
+        text = "\n".join(block)
+        if size + len(text) + 1 > budget:
+            block = [path + ":"]
+            top = [f"  {sig}  :{line}" for depth, line, sig in symbols if depth == 0]
+            used = size + len(path) + 2
+            for row in top:
+                if used + len(row) + 1 > budget:
+                    break
+                block.append(row)
+                used += len(row) + 1
+            if len(block) == 1:
+                continue
+            if len(block) - 1 < len(top):
+                block.append(f"  [{len(top) - len(block) + 1} more symbol(s)]")
+                partial += 1
+            text = "\n".join(block)
+        out.append(text)
+        size += len(text) + 1
+        shown += 1
+    if shown < len(paths):
+        out.append(f"[{len(paths) - shown} more file(s) not shown; call repo_map with a path prefix or more max_tokens]")
+    elif partial:
+        out.append(f"[{partial} file(s) shown in part; call repo_map with a path prefix or more max_tokens]")
+    return "\n".join(out)
+
+
+def repo_map(root: Path, prefix: str = "", max_tokens: Optional[int] = None) -> str:
+    entries = refresh(root)
+    prefix = prefix or ""
+    if prefix.startswith("./"):
+        prefix = prefix[2:]
+    text = render(entries, max(1, int(max_tokens or DEFAULT_TOOL_TOKENS)), prefix)
+    return text or f"No outlined source files{' under ' + prefix if prefix else ''}."
+
+
+def prompt_section(root: Path) -> str:
+    """Map slice for the system prompt (empty when EG_REPO_MAP_TOKENS is unset); never blocks on parsing."""
+    try:
+        tokens = int(os.environ.get("EG_REPO_MAP_TOKENS", "0") or 0)
+    except ValueError:
+        tokens = 0
+    if tokens <= 0:
+        return ""
+    text = render(_load(root), tokens)
+    refresh_in_background(root)
+    if not text:
+        return ""
+    return ("\nREPOSITORY MAP (files, classes and functions with line numbers; the repo_map tool shows more):\n\n" + text + "\n")
@@ -0,0 +1,90 @@
+"""Memoized child results for identical spawns.
+
+With EG_RESULT_CACHE=1 (or cache: true on a spawn call), a child's successful
+result is stored under a key of (context_text hash, model_key, cwd, cache_files).
+A later spawn with the same key returns that result at once: the child is
+registered as already done, with `cached: true` in its result, so wait_agents
+and list_agents treat it like any other finished child.
+
+cache_files lists paths or globs (relative to cwd) the result depends on. Their
+size and mtime when the child was spawned form a fingerprint (taken before
+the child runs, so its own edits to those files are not mistaken for its
+inputs); an entry whose files changed since, or older than
+EG_RESULT_CACHE_TTL_SEC (default one day), is dropped on lookup. Entries live in the agent registry database.
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_TTL_SEC = 86400
+
+
+def ttl_sec() -> float:
+    try:
+        return float(os.environ.get('EG_RESULT_CACHE_TTL_SEC', DEFAULT_TTL_SEC))
+    except ValueError:
+        return DEFAULT_TTL_SEC
+
+
+def enabled_for(args: Dict[str, Any]) -> bool:
+    if isinstance(args.get('cache'), bool):
+        return args['cache']
+    return os.environ.get('EG_RESULT_CACHE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def make_key(context_text: str, model_key: str, cwd: str, files: List[str]) -> str:
+    ctx_hash = hashlib.sha256((context_text or '').encode('utf-8')).hexdigest()
+    raw = json.dumps([ctx_hash, model_key or '', str(cwd), sorted(files)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def fingerprint(cwd: str, files: List[str]) -> str:
+    """Hash of (path, size, mtime) for every file matched by files; directories count all files below."""
+    entries = []
+    for pattern in sorted(files):
+        matches = sorted(glob.glob(os.path.join(cwd, pattern), recursive=True))
+        if not matches:
+            entries.append([pattern, None])
+        for m in matches:
+            paths = [m] if not os.path.isdir(m) else sorted(str(p) for p in Path(m).rglob('*') if p.is_file())
+            for p in paths:
+                try:
+                    st = os.stat(p)
+                    entries.append([os.path.relpath(p, cwd), st.st_size, st.st_mtime_ns])
+                except OSError:
+                    entries.append([os.path.relpath(p, cwd), None])
+    return hashlib.sha256(json.dumps(entries).encode('utf-8')).hexdigest()
+
+
+def lookup(reg, key: str) -> Optional[Dict[str, Any]]:
+    """The cached result for key, or None (stale entries are removed)."""
+    entry = reg.cache_get(key)
+    if not entry:
+        return None
+    fresh = time.time() - (entry.get('created_at') or 0) < ttl_sec()
+    if fresh and entry.get('files'):
+        fresh = fingerprint(entry.get('cwd') or '', entry['files']) == entry.get('fingerprint')
+    if not fresh or not isinstance(entry.get('result'), dict):
+        reg.cache_delete(key)
+        return None
+    return dict(entry['result'], cached_from=entry.get('source') or '')
+
+
+def store(reg, row: Dict[str, Any], result: Dict[str, Any]):
+    """Called when a child with a cache key finishes; only clean, first-hand results are kept."""
+    cache = (row.get('launch') or {}).get('cache') or {}
+    if not cache.get('key') or result.get('cached') or result.get('status', 'done') != 'done' or result.get('error'):
+        return
+    if 'fingerprint' not in cache:
+        # Launched before fingerprints were taken at spawn time; the input state it saw is unknown
+        return
+    files = list(cache.get('files') or [])
+    cwd = row.get('cwd') or ''
+    try:
+        reg.cache_put(cache['key'], result, cwd, files, cache['fingerprint'], f"{row['tree_id']}/{row['agent_id']}")
+    except Exception:
+        pass
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Stand-in for Chrome's remote debugging endpoint, for trying the javascript tool without a browser.
+
+Serves /json, /json/list, /json/version and /json/new?<url> (GET or PUT) and a
+websocket per tab that answers Runtime.evaluate. It does not run JavaScript:
+  - document.readyState        -> "complete"
+  - `return <JSON literal>`    -> that value
+  - `return location.href`     -> the tab's URL, `return document.title` -> its title
+  - a body containing `throw`  -> exceptionDetails
+  - anything else              -> undefined
+Each reply is preceded by an unrelated event and a ping, as a real browser
+interleaves them.
+
+    python script/fake_cdp_server.py --port 9333 --tab https://example.com/?q=1
+    EG_CDP_ADDRESS=127.0.0.1:9333 ./chat.sh
+"""
+import argparse
+import base64
+import hashlib
+import json
+import re
+import socketserver
+import struct
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class State:
+    def __init__(self, port: int, urls):
+        self.port = port
+        self.tabs = []
+        self.lock = threading.Lock()
+        for url in urls or ["about:blank"]:
+            self.add(url)
+
+    def add(self, url: str):
+        tab_id = uuid.uuid4().hex[:16].upper()
+        tab = {"id": tab_id, "type": "page", "title": url, "url": url,
+               "webSocketDebuggerUrl": f"ws://127.0.0.1:{self.port}/devtools/page/{tab_id}"}
+        with self.lock:
+            self.tabs.append(tab)
+        return tab
+
+
+def _frame(opcode: int, payload: bytes) -> bytes:
+    n = len(payload)
+    if n < 126:
+        return struct.pack("!BB", 0x80 | opcode, n) + payload
+    if n < 1 << 16:
+        return struct.pack("!BBH", 0x80 | opcode, 126, n) + payload
+    return struct.pack("!BBQ", 0x80 | opcode, 127, n) + payload
+
+
+def _read_frame(rfile):
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None, b""
+    b0, b1 = head
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", rfile.read(2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", rfile.read(8))[0]
+    mask = rfile.read(4) if b1 & 0x80 else b""
+    data = rfile.read(n)
+    if mask:
+        data = bytes(c ^ mask[i % 4] for i, c in enumerate(data))
+    return b0 & 0x0F, data
+
+
+def _evaluate(tab, expression: str):
+    if expression == "document.readyState":
+        return {"result": {"type": "string", "value": "complete"}}
+    m = re.match(r"\(async function\(\) \{\n(.*)\n\}\)\(\)$", expression, re.S)
+    body = m.group(1) if m else expression
+    if "throw" in body:
+        return {"result": {"type": "object"},
+                "exceptionDetails": {"text": "Uncaught", "exception": {"description": "Error: thrown by script"}}}
+    r = re.search(r"return\s+(.+?);?\s*$", body, re.S)
+    if not r:
+        return {"result": {"type": "undefined"}}
+    expr = r.group(1).strip()
+    if expr == "location.href":
+        return {"result": {"type": "string", "value": tab["url"]}}
+    if expr == "document.title":
+        return {"result": {"type": "string", "value": tab["title"]}}
+    try:
+        return {"result": {"type": "object", "value": json.loads(expr)}}
+    except ValueError:
+        return {"result": {"type": "undefined"}}
+
+
+def make_handler(state: State):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _json(self, data):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_PUT(self):
+            self.do_GET()
+
+        def do_GET(self):
+            if self.headers.get("Upgrade", "").lower() == "websocket":
+                return self._websocket()
+            path, _, query = self.path.partition("?")
+            if path in ("/json", "/json/list"):
+                with state.lock:
+                    return self._json(list(state.tabs))
+            if path == "/json/version":
+                return self._json({"Browser": "FakeChrome/1.0", "Protocol-Version": "1.3"})
+            if path == "/json/new":
+                return self._json(state.add(unquote(query) or "about:blank"))
+            self.send_error(404)
+
+        def _websocket(self):
+            tab_id = self.path.rsplit("/", 1)[-1]
+            tab = next((t for t in state.tabs if t["id"] == tab_id), None)
+            if tab is None:
+                return self.send_error(404)
+            accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WS_GUID).encode()).digest()).decode()
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self.wfile.flush()
+            while True:
+                opcode, data = _read_frame(self.rfile)
+                if opcode is None or opcode == 0x8:
+                    break
+                if opcode != 0x1:
+                    continue
+                msg = json.loads(data)
+                if msg.get("method") == "Runtime.evaluate":
+                    result = _evaluate(tab, (msg.get("params") or {}).get("expression", ""))
+                    reply = {"id": msg["id"], "result": result}
+                else:
+                    reply = {"id": msg["id"], "error": {"code": -32601, "message": f"'{msg.get('method')}' wasn't found"}}
+                event = {"method": "Runtime.consoleAPICalled", "params": {"type": "log", "args": []}}
+                self.wfile.write(_frame(0x1, json.dumps(event).encode()) + _frame(0x9, b"hi")
+                                 + _frame(0x1, json.dumps(reply).encode()))
+                self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--port", type=int, default=9333)
+    ap.add_argument("--tab", action="append", help="URL of an open tab (repeatable)")
+    args = ap.parse_args()
+    state = State(args.port, args.tab)
+    with Server(("127.0.0.1", args.port), make_handler(state)) as srv:
+        print(f"fake CDP endpoint on 127.0.0.1:{args.port}", flush=True)
+        srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Persistent bash session for the bash tool (EG_PERSISTENT_SHELL=1).
+
+Each agent (ChatClient or in-process agent) gets one long-lived bash whose
+output side is a pty, so cd, exported variables, activated venvs and shell
+functions carry over between bash calls, and no bash is forked per call.
+
+A call writes the script to a file in the session's temp dir and sends
+`. <file> < /dev/null` followed by a printf of a per-session sentinel with the
+exit status; output is read from the pty until the sentinel appears. Scripts
+never read the command channel (stdin is /dev/null, as for one-shot calls).
+stdout and stderr arrive interleaved through the pty. On timeout or Ctrl+C the
+whole shell is killed and the next call starts a fresh one (and says so);
+a shell that exited (e.g. a script ran `exit`) is restarted the same way.
+"""
+import atexit
+import codecs
+import fcntl
+import os
+import re
+import select
+import shlex
+import shutil
+import struct
+import subprocess
+import tempfile
+import termios
+import threading
+import time
+import tty
+import uuid
+import weakref
+from pathlib import Path
+from typing import Callable, Optional
+
+import executors
+
+PTY_COLUMNS, PTY_ROWS = 200, 50
+# How long a shell whose pty closed gets to finish exiting before it is killed
+SHELL_EXIT_WAIT_SEC = 2
+
+_sessions: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_all: "weakref.WeakSet" = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.environ.get('EG_PERSISTENT_SHELL', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class ShellSession:
+    def __init__(self, cwd: Optional[str] = None):
+        self.cwd = cwd or os.getcwd()
+        self.proc: Optional[subprocess.Popen] = None
+        self.master: Optional[int] = None
+        self._lock = threading.Lock()
+        self._tmpdir = Path(tempfile.mkdtemp(prefix="eg_shell_"))
+        self._token = uuid.uuid4().hex[:16].encode()
+        self._done_re = re.compile(rb"\n__EG_DONE_" + self._token + rb"_(\d+)__\n")
+        # Longest prefix of a sentinel that can sit at the end of a chunk
+        self._hold = len(b"\n__EG_DONE__") + len(self._token) + 1 + 12 + 2
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def _start(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", PTY_ROWS, PTY_COLUMNS, 0, 0))
+        env = dict(os.environ, TERM="dumb", PAGER="cat", GIT_PAGER="cat")
+        try:
+            self.proc = subprocess.Popen(["/bin/bash", "--noprofile", "--norc"], stdin=subprocess.PIPE,
+                                         stdout=slave, stderr=slave, cwd=self.cwd, env=env, start_new_session=True)
+        finally:
+            os.close(slave)
+        self.master = master
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            executors._kill_group(self.proc)
+        if self.proc is not None and self.proc.stdin:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+        if self.master is not None:
+            try:
+                os.close(self.master)
+            except OSError:
+                pass
+            self.master = None
+
+    def _reap(self) -> str:
+        """After the pty closed: collect the exiting shell (killing it if it lingers) so the next call restarts it."""
+        try:
+            code = self.proc.wait(timeout=SHELL_EXIT_WAIT_SEC)
+        except subprocess.TimeoutExpired:
+            code = None
+        self.close()
+        return f"(the shell exited{'' if code is None else f' with code {code}'}; the next call starts a new one)"
+
+    def run(self, script: str, timeout_sec: Optional[float] = None, on_output: Optional[Callable[[str], None]] = None) -> str:
+        timeout = float(timeout_sec) if timeout_sec else executors._env_number('EG_BASH_TIMEOUT_SEC', executors.DEFAULT_BASH_TIMEOUT_SEC, float)
+        capacity = executors._env_number('EG_BASH_BUFFER_BYTES', executors.DEFAULT_STREAM_BUFFER_BYTES, int)
+        with self._lock:
+            notes = []
+            if not self.alive():
+                if self.proc is not None:
+                    notes.append("(the shell session had ended and was restarted; cd, exports and functions from earlier calls are gone)")
+                self.close()
+                self._start()
+            script_file = self._tmpdir / "script.sh"
+            script_file.write_text(script, encoding="utf-8")
+            line = f". {shlex.quote(str(script_file))} < /dev/null; printf '\\n__EG_DONE_{self._token.decode()}_%s__\\n' \"$?\"\n"
+            buf = executors._StreamBuffer(capacity)
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+            def feed(data: bytes):
+                if not data:
+                    return
+                buf.add(data)
+                if on_output:
+                    try:
+                        on_output(decoder.decode(data))
+                    except Exception:
+                        pass
+
+            rc = None
+            pending = b""
+            deadline = time.monotonic() + timeout
+            try:
+                try:
+                    self.proc.stdin.write(line.encode("utf-8"))
+                    self.proc.stdin.flush()
+                except BrokenPipeError:
+                    # The shell died between the alive() check and the write; start a new one and retry once
+                    self.close()
+                    self._start()
+                    notes.append("(the shell session had ended and was restarted; cd, exports and functions from earlier calls are gone)")
+                    self.proc.stdin.write(line.encode("utf-8"))
+                    self.proc.stdin.flush()
+                while True:
+                    now = time.monotonic()
+                    if now >= deadline:
+                        self.close()
+                        notes.append(f"Error: Command timed out after {timeout:g} seconds (shell killed; the next call starts a new one).")
+                        break
+                    ready, _, _ = select.select([self.master], [], [], min(0.2, deadline - now))
+                    if not ready:
+                        if self.proc.poll() is not None:
+                            notes.append(self._reap())
+                            break
+                        continue
+                    try:
+                        data = os.read(self.master, 65536)
+                    except OSError:
+                        data = b""
+                    if not data:
+                        notes.append(self._reap())
+                        break
+                    pending += data
+                    m = self._done_re.search(pending)
+                    if m:
+                        rc = int(m.group(1))
+                        feed(pending[:m.start()])
+                        pending = b""
+                        break
+                    if len(pending) > self._hold:
+                        feed(pending[:-self._hold])
+                        pending = pending[-self._hold:]
+            except KeyboardInterrupt:
+                self.close()
+                notes.append("--- Interrupted by user (shell killed; the next call starts a new one) ---")
+            except OSError as e:
+                self.close()
+                notes.append(f"Error talking to the shell session: {e}")
+            feed(pending)
+            buf.close()
+
+        output = buf.text().strip()
+        result = f"--- STDOUT ---\n{output}\n" if output else ""
+        if rc:
+            result += f"--- EXIT CODE {rc} ---\n"
+        if notes:
+            result += "--- STDERR ---\n" + "\n".join(notes) + "\n"
+        return result.strip() or "--- The command executed successfully and produced no output ---"
+
+    def __del__(self):
+        try:
+            self.close()
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+        except Exception:
+            pass
+
+
+def for_client(client) -> ShellSession:
+    """The agent's shell session, created on first use."""
+    with _sessions_lock:
+        session = _sessions.get(client)
+        if session is None:
+            session = ShellSession()
+            _sessions[client] = session
+            _all.add(session)
+        return session
+
+
+@atexit.register
+def _close_all():
+    for session in list(_all):
+        session.close()
+        shutil.rmtree(session._tmpdir, ignore_errors=True)
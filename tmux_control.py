@@ -0,0 +1,202 @@
+"""Persistent tmux control-mode (tmux -C) connection.
+
+One `tmux -C attach-session` client per tree session replaces the
+`/bin/bash -> tmux` subprocess pair that every pane operation used to spawn.
+Commands are written as lines and their replies come back in order inside
+%begin/%end (or %error) blocks flagged 1; notifications (%layout-change,
+%window-close, %exit, ...) arrive in between and invalidate the pane cache.
+
+run_batch() writes several commands in one go and waits for all replies, so a
+burst of spawns costs a single round trip. Set EG_TMUX_CONTROL=0 to disable.
+"""
+import collections
+import os
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+REPLY_TIMEOUT_SEC = 10
+# Notifications after which the set of live panes may have changed
+_PANE_CHANGING = ("%layout-change", "%window-close", "%unlinked-window-close", "%window-add", "%session-changed")
+
+
+def quote(arg: str) -> str:
+    """Quote one argument for the tmux command parser (double quotes; escape \\, " and $)."""
+    s = str(arg)
+    if s and all(c.isalnum() or c in "%@_-./:=,+" for c in s):
+        return s
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("$", "\\$").replace("\n", " ") + '"'
+
+
+class _Reply:
+    __slots__ = ("event", "ok", "lines")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.ok = False
+        self.lines: List[str] = []
+
+
+class TmuxControl:
+    def __init__(self, session: str):
+        self.session = session
+        self.proc = subprocess.Popen(
+            ["tmux", "-C", "attach-session", "-t", session, "-f", "ignore-size,no-output"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self.alive = True
+        self._write_lock = threading.Lock()
+        self._pending: "collections.deque[_Reply]" = collections.deque()
+        self._listeners: List[Callable[[str], None]] = []
+        self._panes: Optional[set] = None
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    # ---- reader -------------------------------------------------------------
+
+    def _read_loop(self):
+        block: Optional[Tuple[str, bool, List[str]]] = None  # (cmd number, ours, lines)
+        try:
+            for raw in self.proc.stdout:
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                if block is not None:
+                    num, ours, lines = block
+                    if line.startswith(("%end ", "%error ")) and line.split(" ")[2:3] == [num]:
+                        if ours and self._pending:
+                            reply = self._pending.popleft()
+                            reply.ok = line.startswith("%end ")
+                            reply.lines = lines
+                            reply.event.set()
+                        block = None
+                    else:
+                        lines.append(line)
+                    continue
+                if line.startswith("%begin "):
+                    parts = line.split(" ")
+                    # flags == 1 marks replies to commands sent by this client; the implicit attach reply is 0
+                    block = (parts[2] if len(parts) > 2 else "", parts[3:4] == ["1"], [])
+                    continue
+                self._notify(line)
+                if line.startswith("%exit"):
+                    break
+        except (OSError, ValueError):
+            pass
+        self.alive = False
+        while self._pending:
+            self._pending.popleft().event.set()
+
+    def _notify(self, line: str):
+        if line.startswith(_PANE_CHANGING):
+            self._panes = None
+        for cb in list(self._listeners):
+            try:
+                cb(line)
+            except Exception:
+                pass
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """Receive raw notification lines (e.g. '%layout-change @1 ...', '%window-close @2')."""
+        self._listeners.append(callback)
+
+    # ---- commands -----------------------------------------------------------
+
+    def run_batch(self, commands: Sequence[Sequence[str]], timeout: float = REPLY_TIMEOUT_SEC) -> List[Tuple[bool, List[str]]]:
+        """Send all commands in one write and return [(ok, output_lines)] in order."""
+        if not commands:
+            return []
+        if not self.alive:
+            return [(False, [])] * len(commands)
+        replies = [_Reply() for _ in commands]
+        data = "".join(" ".join(quote(a) for a in cmd) + "\n" for cmd in commands).encode("utf-8")
+        with self._write_lock:
+            self._pending.extend(replies)
+            try:
+                self.proc.stdin.write(data)
+                self.proc.stdin.flush()
+            except (OSError, ValueError):
+                self.alive = False
+        out = []
+        for r in replies:
+            if not r.event.wait(timeout):
+                # A lost reply would shift every later one; give up on this connection
+                self.close()
+            out.append((r.ok, r.lines))
+        return out
+
+    def run(self, *argv: str) -> Tuple[bool, List[str]]:
+        return self.run_batch([list(argv)])[0]
+
+    def pane_exists(self, pane_id: str) -> bool:
+        panes = self._panes
+        if panes is None:
+            ok, lines = self.run("list-panes", "-a", "-F", "#{pane_id}")
+            if not ok:
+                return False
+            panes = set(l.strip() for l in lines if l.strip())
+            self._panes = panes
+        return pane_id in panes
+
+    def note_pane(self, pane_id: str, exists: bool):
+        panes = self._panes
+        if panes is None or not pane_id:
+            return
+        if exists:
+            panes.add(pane_id)
+        else:
+            panes.discard(pane_id)
+
+    def close(self):
+        self.alive = False
+        try:
+            self.proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.proc.terminate()
+        except Exception:
+            pass
+
+
+_clients: Dict[str, TmuxControl] = {}
+_clients_lock = threading.Lock()
+# Sessions whose attach failed recently -> time of failure (avoid a tmux process per call)
+_failed: Dict[str, float] = {}
+RETRY_AFTER_SEC = 5
+
+
+def enabled() -> bool:
+    return os.environ.get("EG_TMUX_CONTROL", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def get_client(session: Optional[str]) -> Optional[TmuxControl]:
+    """Return a live control client attached to session, starting one if needed (None if unavailable)."""
+    if not session or not enabled():
+        return None
+    with _clients_lock:
+        client = _clients.get(session)
+        if client is not None and client.alive:
+            return client
+        if time.time() - _failed.get(session, 0) < RETRY_AFTER_SEC:
+            return None
+        try:
+            client = TmuxControl(session)
+        except (OSError, ValueError):
+            _failed[session] = time.time()
+            return None
+        _clients[session] = client
+    # Probe once: older tmux rejects the attach flags, and a missing session still leaves a client up
+    ok, out = client.run("display-message", "-p", "-t", session, "#{session_name}")
+    if not ok or out != [session] or not client.alive:
+        client.close()
+        with _clients_lock:
+            _clients.pop(session, None)
+            _failed[session] = time.time()
+        return None
+    return client
+
+
+def forget_failure(session: str):
+    """Allow an immediate attach retry, e.g. right after the session was created."""
+    _failed.pop(session, None)
@@ -1,35 +1,55 @@
 import json
 import time
 import os
+import sys
 import subprocess
+import threading
+import contextlib
+import uuid
 from pathlib import Path
 from typing import Dict, Any, List, Tuple, Optional
 import ast
 import re
 
-from executors import run_bash_script, run_python_script, str_replace_editor, run_javascript, tool_search, replace_between
+import agent_registry
+import output_shaper
+import python_kernel
+import shell_session
+import tmux_control
+
+from executors import run_bash_script, run_python_script, str_replace_editor, multi_edit, apply_patch, run_javascript, tool_search, replace_between, tool_read_artifact, tool_read_file, tool_search_code, tool_repo_map, tool_fetch_url
 
 TOOLS = [
     {
         "type": "function",
         "function": {
             "name": "bash",
-            "description": "Execute a bash script and return combined stdout/stderr.",
+            "description": """
+                Execute a bash script and return combined stdout/stderr.
+                Output streams live; the command is killed after timeout_sec (default 60), so pass a larger
+                timeout_sec for long builds or test suites.""",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "script": { "type": "string" }
+                    "script": { "type": "string" },
+                    "timeout_sec": { "type": "integer" }
                 },
                 "required": ["script"]}}},
     {
         "type": "function",
         "function": {
             "name": "python",
-            "description": "Execute a Python script and return combined stdout/stderr.",
+            "description": """
+                Execute a Python script and return combined stdout/stderr.
+                Runs in a persistent kernel process: variables and imports are kept between calls, and the value
+                of a final expression is printed. timeout_sec (default 600) interrupts the cell; restart=true starts
+                a fresh kernel first.""",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "script": { "type": "string" }
+                    "script": { "type": "string" },
+                    "timeout_sec": { "type": "integer" },
+                    "restart": { "type": "boolean" }
                 },
                 "required": ["script"]}}},
     {
@@ -57,6 +77,48 @@ TOOLS = [
                     "new_str": {"type": "string"}
                 },
                 "required": ["file_path", "old_str", "new_str"]}}},
+    {
+        "type": "function",
+        "function": {
+            "name": "multi_edit",
+            "description": """
+                Apply many str_replace_editor-style edits, across any number of files, in one call.
+                Edits to the same file apply in order. All edits are validated first: if any fails, no file is
+                changed and the per-edit report says why. Prefer this over many separate str_replace_editor calls.""",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "edits": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "file_path": {"type": "string"},
+                                "old_str": {"type": "string"},
+                                "new_str": {"type": "string"}
+                            },
+                            "required": ["file_path", "old_str", "new_str"]}}
+                },
+                "required": ["edits"]}}},
+    {
+        "type": "function",
+        "function": {
+            "name": "apply_patch",
+            "description": """
+                Apply a unified diff (as produced by git diff or diff -u) to files under the working directory.
+                Cheaper than str_replace_editor for multi-hunk changes: only context and changed lines are sent.
+                Supports new files (--- /dev/null), deletions (+++ /dev/null) and git renames. Hunks may sit at a
+                different line than stated and their context may differ in whitespace; up to fuzz context lines
+                (default 2) may be ignored at each end. If any hunk is rejected no file is changed and the report
+                shows the closest text for each rejected hunk.""",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "patch": {"type": "string"},
+                    "fuzz": {"type": "integer", "description": "Context lines that may be ignored at each end of a hunk (default 2)."},
+                    "max_offset": {"type": "integer", "description": "Farthest a hunk may be from its stated line (default: anywhere)."}
+                },
+                "required": ["patch"]}}},
     {
         "type": "function",
         "function": {
@@ -64,13 +126,19 @@ TOOLS = [
             "description": """
                 Spawn a single child agent using current CWD as working dir.
                 Please do not specify model_key unless user requested.
+                When child limits are configured the child may be queued (status "queued") until a slot frees;
+                higher priority starts first. With cache (default EG_RESULT_CACHE) an identical earlier spawn's result
+                is returned at once with cached: true; cache_files are paths/globs whose changes invalidate it.
                 Returns {tree_id,parent_id,child_id,dir,session}.""",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "context_text": {"type": "string"},
                     "label": {"type": "string"},
-                    "model_key": {"type": "string"}
+                    "model_key": {"type": "string"},
+                    "priority": {"type": "integer"},
+                    "cache": {"type": "boolean"},
+                    "cache_files": {"type": "array", "items": {"type": "string"}}
                 },
                 "required": ["context_text"]}}},
     {
@@ -80,26 +148,129 @@ TOOLS = [
             "description": """
                 Spawn a single child agent using current CWD as working dir with auto-approval for tool calls (EG_YES_TOOL_FLAG=1).
                 Please do not specify model_key unless user requested.
+                runtime "headless" runs the child as a background process without a tmux pane (output in <dir>/output.log);
+                prefer it when spawning many children. runtime "inprocess" runs it inside this process (cheapest; only
+                bash and file-editing tools, no spawning) for small tasks. runtime "worker" queues it on the job broker
+                (EG_BROKER) for a `chat.py --worker` process, possibly on another host. Defaults to EG_CHILD_RUNTIME or "pane".
+                When child limits are configured the child may be queued (status "queued") until a slot frees;
+                higher priority starts first. With cache (default EG_RESULT_CACHE) an identical earlier spawn's result
+                is returned at once with cached: true; cache_files are paths/globs whose changes invalidate it.
                 Returns {tree_id,parent_id,child_id,dir,session}.""",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "context_text": {"type": "string"},
                     "label": {"type": "string"},
-                    "model_key": {"type": "string"}
+                    "model_key": {"type": "string"},
+                    "runtime": {"type": "string", "enum": ["pane", "headless", "inprocess", "worker"]},
+                    "priority": {"type": "integer"},
+                    "cache": {"type": "boolean"},
+                    "cache_files": {"type": "array", "items": {"type": "string"}}
                 },
                 "required": ["context_text"]}}},
     {
         "type": "function",
         "function": {
-            "name": "search_tavily",
-            "description": "Perform a web search (using Tavily) and return the top 5 results with titles and direct URLs.",
+            "name": "read_artifact",
+            "description": """
+                Read a large tool output that was stored as an artifact (the truncated output names its id).
+                Returns lines start_line.. (1-based, num_lines of them, default 200) with line numbers;
+                with pattern (a regex) returns only matching lines from start_line on.""",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "artifact_id": {"type": "string"},
+                    "start_line": {"type": "integer"},
+                    "num_lines": {"type": "integer"},
+                    "pattern": {"type": "string"}
+                },
+                "required": ["artifact_id"]}}},
+    {
+        "type": "function",
+        "function": {
+            "name": "read_file",
+            "description": """
+                Read part of a text file with line numbers, without loading the whole file (fast even on multi-GB logs).
+                Give start_line/end_line (1-based, inclusive; default 200 lines from start_line), or head / tail
+                (first / last N lines), or byte_start/byte_end. Output is cut to the output budget and says where to continue.
+                Prefer this over cat/sed/head/tail in bash.""",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "query": {"type": "string"}
+                    "file_path": {"type": "string"},
+                    "start_line": {"type": "integer"},
+                    "end_line": {"type": "integer"},
+                    "head": {"type": "integer"},
+                    "tail": {"type": "integer"},
+                    "byte_start": {"type": "integer"},
+                    "byte_end": {"type": "integer"}
+                },
+                "required": ["file_path"]}}},
+    {
+        "type": "function",
+        "function": {
+            "name": "search_code",
+            "description": """
+                Search the files of the working directory (respecting .gitignore) for a literal string or a regex,
+                grep -n style (path:line:text, context lines as path-line-text). Answers from an index, so it is
+                much faster than grep -r in bash; prefer it for finding definitions and usages.
+                glob limits the files (e.g. "*.py" or "src/*"); max_results caps matches (default 100).""",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string"},
+                    "regex": {"type": "boolean", "description": "Treat query as a Python regex (default: literal)."},
+                    "ignore_case": {"type": "boolean"},
+                    "glob": {"type": "string"},
+                    "context": {"type": "integer", "description": "Lines of context around each match."},
+                    "max_results": {"type": "integer"},
+                    "refresh": {"type": "boolean", "description": "Re-check changed files now (done automatically every few seconds)."}
                 },
                 "required": ["query"]}}},
+    {
+        "type": "function",
+        "function": {
+            "name": "repo_map",
+            "description": """
+                Outline of the project's source files: classes, functions and methods with signatures and line numbers
+                (Python via ast; JS/TS, Go, Rust, Java/Kotlin/C#, C/C++, Ruby, PHP and shell approximately).
+                Use it to learn the project structure before reading files. path limits it to files under a prefix;
+                max_tokens sizes the output (default 4000).""",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string"},
+                    "max_tokens": {"type": "integer"}
+                }}}},
+    {
+        "type": "function",
+        "function": {
+            "name": "search_tavily",
+            "description": """
+                Perform a web search (using Tavily) and return the top results (default 5) with titles, direct URLs and snippets.
+                Pass several related queries in queries to run them concurrently in one call. Results are cached for a few hours.""",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string"},
+                    "queries": {"type": "array", "items": {"type": "string"}},
+                    "max_results": {"type": "integer"}
+                }}}},
+    {
+        "type": "function",
+        "function": {
+            "name": "fetch_url",
+            "description": """
+                Fetch web pages and return their readable content as markdown (HTML converted: headings, lists, links,
+                code, tables; scripts and page chrome removed); other text types as is. Several urls are fetched
+                concurrently. Responses are cached and revalidated (ETag/Last-Modified). A page too long for the
+                output is cut and stored whole as an artifact readable with read_artifact.""",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "url": {"type": "string"},
+                    "urls": {"type": "array", "items": {"type": "string"}}
+                }}}},
     {
         "type": "function",
         "function": {
@@ -168,18 +339,49 @@ TOOLS = [
 
 AGENTS_BASE = Path.cwd() / '.egg' / 'agents'
 
+# Session the tmux control connection attaches to (set by _ensure_session)
+_control_session = ""
+# Per-thread spawn batch (see spawn_batch)
+_spawn_local = threading.local()
+
+
+def _tmux_session() -> str:
+    if _control_session:
+        return _control_session
+    tree_id = os.environ.get('EG_TREE_ID')
+    return f"egg-tree-{tree_id}" if tree_id else ""
 
-def _tmux_raw(cmd: str) -> str:
+
+def _tmux_direct(cmd: List[str]) -> Tuple[bool, str]:
     try:
-        res = subprocess.run(cmd, shell=True, executable="/bin/bash", capture_output=True, text=True, timeout=10)
-        return (res.stdout or "").strip()
+        res = subprocess.run(["tmux", *cmd], capture_output=True, text=True, timeout=10)
+        return res.returncode == 0, (res.stdout or "").strip()
     except Exception:
-        return ""
+        return False, ""
+
+
+def _tmux_batch(commands: List[List[str]], session: Optional[str] = None) -> List[Tuple[bool, str]]:
+    """Run tmux commands in order: one write over the control connection, else one tmux process each."""
+    client = tmux_control.get_client(session or _tmux_session())
+    if client is not None:
+        return [(ok, "\n".join(lines).strip()) for ok, lines in client.run_batch(commands)]
+    return [_tmux_direct(cmd) for cmd in commands]
+
+
+def _tmux(*argv: str, session: Optional[str] = None) -> str:
+    ok, out = _tmux_batch([list(argv)], session)[0]
+    return out if ok else ""
 
 
 def _ensure_session(tree_id: str) -> str:
+    global _control_session
     session = f"egg-tree-{tree_id}"
-    run_bash_script(f"tmux has-session -t {session} 2>/dev/null || tmux new-session -d -s {session} 'bash'")
+    if session != _control_session or tmux_control.get_client(session) is None:
+        ok, _ = _tmux_direct(["has-session", "-t", session])
+        if not ok:
+            _tmux_direct(["new-session", "-d", "-s", session, "bash"])
+            tmux_control.forget_failure(session)
+    _control_session = session
     return session
 
 
@@ -197,7 +399,12 @@ def _read_json(path: Path) -> Any:
         return None
 
 
-def _next_child_id(children_dir: Path, base: str) -> str:
+def _registry():
+    return agent_registry.get_registry(AGENTS_BASE)
+
+
+def _max_child_index(children_dir: Path, base: str) -> int:
+    """Highest existing <base>-NNN index on disk; seeds the registry counter for pre-registry trees."""
     normalized_base = base.replace(" ", "_").replace("/", "_").replace("\\", "_")
     max_idx = 0
     if children_dir.exists():
@@ -208,218 +415,520 @@ def _next_child_id(children_dir: Path, base: str) -> str:
                     max_idx = max(max_idx, idx)
                 except ValueError:
                     continue
-    return f"{normalized_base}-{max_idx+1:03d}"
+    return max_idx
+
+
+def _next_child_id(tree_id: str, parent_id: str, base: str) -> str:
+    children_dir = AGENTS_BASE / tree_id / parent_id / 'children'
+    return _registry().allocate_child_id(tree_id, parent_id, base, seed=lambda: _max_child_index(children_dir, base))
+
+
+def _agent_parent(tree_id: str, agent_id: str) -> str:
+    """Parent id of an agent, used as part of its registry key (root has '')."""
+    if agent_id == 'root':
+        return ''
+    if agent_id == os.environ.get('EG_AGENT_ID'):
+        return os.environ.get('EG_PARENT_ID', '')
+    row = _registry().get(tree_id, agent_id)
+    return (row or {}).get('parent_id', '') or ''
+
+
+def _agent_row(tree_id: str, agent_id: str) -> Dict[str, Any]:
+    return _registry().get(tree_id, agent_id, _agent_parent(tree_id, agent_id)) or {}
+
+
+def _update_agent(tree_id: str, agent_id: str, **fields) -> Dict[str, Any]:
+    parent = _agent_parent(tree_id, agent_id)
+    if agent_id == 'root':
+        fields.setdefault('dir', str(AGENTS_BASE / tree_id / 'root'))
+    return _registry().upsert(tree_id, agent_id, parent, **fields)
 
 
 # Utilities for pane/window targeting
 
 def _window_of_pane(pane_id: str) -> str:
-    return _tmux_raw(f"tmux display -p -t {pane_id} '#{{window_id}}'")
+    return _tmux("display-message", "-p", "-t", pane_id, "#{window_id}")
 
 
 def _active_pane_in_window_id(window_id: str) -> str:
-    out = _tmux_raw("tmux list-panes -a -F '#{window_id} #{pane_id} #{pane_active}'")
+    out = _tmux("list-panes", "-t", window_id, "-F", "#{pane_id} #{pane_active}")
     if not out:
         return ""
     first = ""
     for line in out.splitlines():
         parts = line.strip().split()
-        if len(parts) >= 3 and parts[0] == window_id:
+        if len(parts) >= 2:
             if not first:
-                first = parts[1]
-            if parts[2] == '1':
-                return parts[1]
+                first = parts[0]
+            if parts[1] == '1':
+                return parts[0]
     return first
 
 
 def _read_parent_pane_id(tree_id: str, parent_id: str) -> str:
-    p = AGENTS_BASE / tree_id / parent_id / 'state.json'
-    st = _read_json(p)
-    if isinstance(st, dict):
-        pid = st.get('pane_id')
-        if isinstance(pid, str) and pid:
-            return pid
-    return ""
+    pid = _agent_row(tree_id, parent_id).get('pane_id')
+    return pid if isinstance(pid, str) else ""
 
 
 def _write_parent_right_column_pane(tree_id: str, parent_id: str, right_pane_id: str):
-    p = AGENTS_BASE / tree_id / parent_id / 'state.json'
-    st = _read_json(p) or {}
-    st['right_column_pane_id'] = right_pane_id
-    _write_json(p, st)
+    _update_agent(tree_id, parent_id, right_column_pane_id=right_pane_id)
 
 
 def _read_parent_right_column_pane(tree_id: str, parent_id: str) -> str:
-    p = AGENTS_BASE / tree_id / parent_id / 'state.json'
-    st = _read_json(p) or {}
-    v = st.get('right_column_pane_id')
+    v = _agent_row(tree_id, parent_id).get('right_column_pane_id')
     return v if isinstance(v, str) else ""
 
 
 def _write_child_pane_id(tree_id: str, parent_id: str, child_id: str, pane_id: str):
-    p = AGENTS_BASE / tree_id / parent_id / 'children' / child_id / 'state.json'
-    st = _read_json(p) or {}
-    st['pane_id'] = pane_id
-    _write_json(p, st)
+    _registry().upsert(tree_id, child_id, parent_id, pane_id=pane_id)
 
 
-def _pane_exists(pane_id: str) -> bool:
+def _pane_exists(pane_id: str, session: Optional[str] = None) -> bool:
     if not pane_id:
         return False
-    out = _tmux_raw("tmux list-panes -a -F '#{pane_id}' | grep -Fx %s || true" % pane_id)
-    return pane_id in (out.split() if out else [])
+    client = tmux_control.get_client(session or _tmux_session())
+    if client is not None:
+        return client.pane_exists(pane_id)
+    ok, out = _tmux_direct(["list-panes", "-a", "-F", "#{pane_id}"])
+    return ok and pane_id in out.split()
 
 
-def _split_h(target_pane: str) -> str:
-    run_bash_script(f"tmux split-window -h -t {target_pane}")
-    return _tmux_raw("tmux display-message -p '#{pane_id}'")
-
-
-def _split_v(target_pane: str) -> str:
-    run_bash_script(f"tmux split-window -v -t {target_pane}")
-    run_bash_script(f"tmux select-layout -E")
-    return _tmux_raw("tmux display-message -p '#{pane_id}'")
+def _note_panes(session: str, panes: List[str], exists: bool = True):
+    client = tmux_control.get_client(session)
+    if client is not None:
+        for p in panes:
+            client.note_pane(p, exists)
 
 
 def _kill_pane(pane_id: str):
     if not pane_id:
         return
-    run_bash_script(f"tmux kill-pane -t {pane_id} 2>/dev/null || true")
+    _tmux("kill-pane", "-t", pane_id)
+    _note_panes(_tmux_session(), [pane_id], exists=False)
+
+
+def _pane_command(run_script: str) -> str:
+    # Keep a shell in the pane once the agent exits, like the old send-keys launch did
+    return f"{run_script}; exec bash"
 
 
 # Spawning logic per requirements
 
-def _spawn_into_parent_layer(session: str, tree_id: str, parent_id: str, run_script: str) -> str:
-    parent_pane = _read_parent_pane_id(tree_id, parent_id)
+def _spawn_panes(session: str, tree_id: str, parent_id: str, run_scripts: List[str], retry: bool = True) -> List[str]:
+    """Create one pane per run script in the parent's right column. Returns pane ids ("" on failure).
+
+    The right column is split once per script and re-spread in the same round of commands; only
+    the first spawn of a parent needs an extra round to create the column itself.
+    """
+    failed = [""] * len(run_scripts)
+    parent_pane = _read_parent_pane_id(tree_id, parent_id) or os.environ.get('TMUX_PANE', '')
     if not parent_pane:
-        parent_pane = _tmux_raw("tmux display-message -p '#{pane_id}'")
-        if not parent_pane:
-            out = _tmux_raw(f"tmux list-panes -t {session} -F '#{{pane_id}}' | head -n1")
-            parent_pane = out.splitlines()[0].strip() if out else ""
+        out = _tmux("list-panes", "-t", session, "-F", "#{pane_id}", session=session)
+        parent_pane = out.splitlines()[0].strip() if out else ""
     if not parent_pane:
-        return ""
+        return failed
 
+    panes: List[str] = []
+    scripts = list(run_scripts)
     right_col = _read_parent_right_column_pane(tree_id, parent_id)
-    if not right_col or not _pane_exists(right_col):
-        right_col = _split_h(parent_pane)
+    if not right_col or not _pane_exists(right_col, session):
+        ok, right_col = _tmux_batch([["split-window", "-h", "-t", parent_pane, "-P", "-F", "#{pane_id}",
+                                      _pane_command(scripts[0])]], session)[0]
+        if not ok or not right_col:
+            return failed
         _write_parent_right_column_pane(tree_id, parent_id, right_col)
-        target_for_child = right_col
-    else:
-        target_for_child = _split_v(right_col)
+        panes.append(right_col)
+        scripts = scripts[1:]
+    if scripts:
+        cmds = [["split-window", "-v", "-t", right_col, "-P", "-F", "#{pane_id}", _pane_command(s)] for s in scripts]
+        cmds.append(["select-layout", "-E", "-t", right_col])
+        results = _tmux_batch(cmds, session)[:len(scripts)]
+        if retry and not panes and not any(ok for ok, _ in results):
+            # Cached right column was stale (closed outside this session's notifications)
+            _note_panes(session, [right_col], exists=False)
+            _write_parent_right_column_pane(tree_id, parent_id, "")
+            return _spawn_panes(session, tree_id, parent_id, run_scripts, retry=False)
+        panes.extend(out if ok else "" for ok, out in results)
+    _note_panes(session, [p for p in panes if p])
+    return panes
+
+
+@contextlib.contextmanager
+def spawn_batch():
+    """Defer pane creation for spawns made inside the block to one round of tmux commands at exit."""
+    depth = getattr(_spawn_local, 'depth', 0)
+    if depth == 0:
+        _spawn_local.pending = []
+    _spawn_local.depth = depth + 1
+    try:
+        yield
+    finally:
+        _spawn_local.depth = depth
+        if depth == 0:
+            flush_spawns()
+
+
+def flush_spawns():
+    """Create the panes of all deferred spawns on this thread, grouped by parent."""
+    pending = getattr(_spawn_local, 'pending', None) or []
+    _spawn_local.pending = []
+    groups: Dict[Tuple[str, str, str], List[Tuple[str, Any]]] = {}
+    for session, tree_id, parent_id, run_script, on_pane in pending:
+        groups.setdefault((session, tree_id, parent_id), []).append((run_script, on_pane))
+    for (session, tree_id, parent_id), items in groups.items():
+        try:
+            panes = _spawn_panes(session, tree_id, parent_id, [s for s, _ in items])
+        except Exception:
+            panes = [""] * len(items)
+        for (_, on_pane), pane in zip(items, panes):
+            if on_pane:
+                try:
+                    on_pane(pane)
+                except Exception:
+                    pass
 
-    escaped_script = run_script.replace("'", "'\"'\"'")
-    run_bash_script(f"tmux send-keys -t {target_for_child} '{escaped_script}' C-m")
-    return target_for_child
 
+def _spawn_into_parent_layer(session: str, tree_id: str, parent_id: str, run_script: str, on_pane=None) -> str:
+    """Launch run_script in a new pane next to the parent; on_pane(pane_id) is called once it exists.
 
-def _launch_child(session: str, parent_cwd: str, agent_dir: str, child_id: str, tree_id: str, parent_id: str, extra_env: Optional[dict] = None):
+    Inside spawn_batch() the pane is created when the batch flushes and "" is returned here.
+    """
+    if getattr(_spawn_local, 'depth', 0) > 0:
+        _spawn_local.pending.append((session, tree_id, parent_id, run_script, on_pane))
+        return ""
+    pane = _spawn_panes(session, tree_id, parent_id, [run_script])[0]
+    if on_pane:
+        on_pane(pane)
+    return pane
+
+
+def _resolve_tree_id() -> str:
+    tree_id = os.environ.get('EG_TREE_ID')
+    if not tree_id:
+        current = AGENTS_BASE / '.current_tree'
+        if current.exists():
+            try:
+                tree_id = current.read_text().strip()
+            except Exception:
+                tree_id = None
+    if not tree_id:
+        tree_id = str(int(time.time()))
+        (AGENTS_BASE).mkdir(parents=True, exist_ok=True)
+        (AGENTS_BASE / '.current_tree').write_text(tree_id)
+    return tree_id
+
+
+def _write_run_script(run_sh_path: Path, cwd: str, env: Dict[str, str], tree_id: str, extra_args: Tuple[str, ...] = ()):
+    """Write the run.sh used to start a chat.py process in a pane with the given environment."""
     repo_root = Path(__file__).resolve().parent
     chat_sh = (repo_root / 'chat.sh').resolve()
     chat_py = (repo_root / 'chat.py').resolve()
-    init_ctx = Path(agent_dir) / 'init_context.txt'
 
-    run_sh_path = Path(agent_dir) / 'run.sh'
     run_lines = [
         "#!/usr/bin/env bash",
         "set -e",
-        f"cd '{parent_cwd}'",
-        f"export EG_AGENT_DIR='{agent_dir}'",
-        f"export EG_TREE_ID='{tree_id}'",
-        f"export EG_PARENT_ID='{parent_id}'",
-        f"export EG_AGENT_ID='{child_id}'",
-        f"export EG_INIT_CONTEXT_FILE='{init_ctx}'",
+        f"cd '{cwd}'",
     ]
+    for k, v in env.items():
+        run_lines.append(f"export {k}='{v}'")
 
-    if extra_env:
-        for k, v in extra_env.items():
-            run_lines.append(f"export {k}='{v}'")
-
+    args = "".join(f" {a}" for a in extra_args)
     if chat_sh.exists():
-        run_lines.append(f"exec \"{str(chat_sh)}\" --tree '{tree_id}' --inline")
+        run_lines.append(f"exec \"{str(chat_sh)}\" --tree '{tree_id}' --inline{args}")
     else:
-        run_lines.append(f"exec python3 -u '{str(chat_py)}'")
+        run_lines.append(f"exec python3 -u '{str(chat_py)}'{args}")
 
     run_sh_path.write_text("\n".join(run_lines) + "\n", encoding='utf-8')
     os.chmod(run_sh_path, 0o755)
 
-    run_cmd = f"'{run_sh_path}'"
-    child_pane = _spawn_into_parent_layer(session, tree_id, parent_id, run_cmd)
-    if child_pane:
-        _write_child_pane_id(tree_id, parent_id, child_id, child_pane)
+
+def _child_env(agent_dir: str, child_id: str, tree_id: str, parent_id: str, extra_env: Optional[dict] = None) -> Dict[str, str]:
+    env = {
+        "EG_AGENT_DIR": agent_dir,
+        "EG_TREE_ID": tree_id,
+        "EG_PARENT_ID": parent_id,
+        "EG_AGENT_ID": child_id,
+        "EG_INIT_CONTEXT_FILE": str(Path(agent_dir) / 'init_context.txt'),
+    }
+    if extra_env:
+        env.update(extra_env)
+    return env
 
 
-def tool_spawn_agent(args: Dict) -> str:
+def _launch_child(session: str, parent_cwd: str, agent_dir: str, child_id: str, tree_id: str, parent_id: str, extra_env: Optional[dict] = None):
+    run_sh_path = Path(agent_dir) / 'run.sh'
+    _write_run_script(run_sh_path, parent_cwd, _child_env(agent_dir, child_id, tree_id, parent_id, extra_env), tree_id)
+
+    def _record(pane_id: str):
+        if pane_id:
+            _write_child_pane_id(tree_id, parent_id, child_id, pane_id)
+
+    _spawn_into_parent_layer(session, tree_id, parent_id, f"'{run_sh_path}'", on_pane=_record)
+
+
+# Headless children started by this process, so liveness checks can reap them
+_headless_procs: Dict[str, subprocess.Popen] = {}
+HEADLESS_CHECK_SEC = 2.0
+
+
+def _child_runtime(args: Dict, auto_approve: bool) -> str:
+    runtime = str(args.get('runtime') or os.environ.get('EG_CHILD_RUNTIME') or 'pane').strip().lower()
+    # Headless, in-process and worker children have nobody to answer tool approval prompts
+    return runtime if runtime in ('headless', 'inprocess', 'worker') and auto_approve else 'pane'
+
+
+def _popen_headless(parent_cwd: str, agent_dir: str, child_id: str, tree_id: str, parent_id: str, extra_env: Optional[dict] = None) -> subprocess.Popen:
+    """Start a child as a plain background process logging to <agent_dir>/output.log."""
+    run_sh_path = Path(agent_dir) / 'run.sh'
+    _write_run_script(run_sh_path, parent_cwd, _child_env(agent_dir, child_id, tree_id, parent_id, extra_env), tree_id,
+                      extra_args=("--headless",))
+    # Without TMUX/TMUX_PANE the child cannot mistake the parent's pane for its own
+    env = {k: v for k, v in os.environ.items() if k not in ('TMUX', 'TMUX_PANE')}
+    env['PYTHONUNBUFFERED'] = '1'
+    with open(Path(agent_dir) / 'output.log', 'ab') as log:
+        proc = subprocess.Popen(
+            ["bash", str(run_sh_path)], cwd=parent_cwd, env=env,
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    return proc
+
+
+def _launch_headless(parent_cwd: str, agent_dir: str, child_id: str, tree_id: str, parent_id: str, extra_env: Optional[dict] = None) -> int:
+    """Start a headless child of this process. Returns its pid."""
+    proc = _popen_headless(parent_cwd, agent_dir, child_id, tree_id, parent_id, extra_env)
+    _headless_procs[child_id] = proc
+    return proc.pid
+
+
+def _headless_alive(agent_id: str, row: Dict[str, Any]) -> bool:
+    proc = _headless_procs.get(agent_id)
+    if proc is not None and proc.pid == row.get('pid'):
+        return proc.poll() is None
+    pid = row.get('pid')
+    if not pid:
+        return True
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except PermissionError:
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def _spawn_child(args: Dict, auto_approve: bool) -> str:
+    """Shared implementation of spawn_agent and spawn_agent_auto."""
     context_text = args.get('context_text', '').strip()
     label = (args.get('label') or 'child').strip() or 'child'
     # Prefer explicit model key; if not provided, try parent state, then DEFAULT_MODEL env
     model_key = args.get('model_key')
 
-    tree_id = os.environ.get('EG_TREE_ID')
-    if not tree_id:
-        current = AGENTS_BASE / '.current_tree'
-        if current.exists():
-            try:
-                tree_id = current.read_text().strip()
-            except Exception:
-                tree_id = None
-    if not tree_id:
-        tree_id = str(int(time.time()))
-        (AGENTS_BASE).mkdir(parents=True, exist_ok=True)
-        (AGENTS_BASE / '.current_tree').write_text(tree_id)
-
+    tree_id = _resolve_tree_id()
     parent_id = os.environ.get('EG_AGENT_ID', 'root')
     parent_cwd = str(Path.cwd())
 
-    # If no model_key provided, attempt to read parent's state.json
+    # If no model_key provided, attempt to read the parent's registry entry
     if not model_key:
         try:
-            parent_state = _read_json(AGENTS_BASE / tree_id / parent_id / 'state.json')
-            if isinstance(parent_state, dict):
-                pmk = parent_state.get('model_key')
-                if isinstance(pmk, str) and pmk:
-                    model_key = pmk
+            pmk = _agent_row(tree_id, parent_id).get('model_key')
+            if isinstance(pmk, str) and pmk:
+                model_key = pmk
         except Exception:
             model_key = model_key
 
     if not model_key:
         model_key = os.environ.get('DEFAULT_MODEL') or ''
+    runtime = _child_runtime(args, auto_approve)
+
+    import result_cache
+    cache = None
+    cached_result = None
+    if result_cache.enabled_for(args):
+        files = [str(f) for f in (args.get('cache_files') or [])]
+        cache = {"key": result_cache.make_key(context_text, model_key, parent_cwd, files), "files": files}
+        cached_result = result_cache.lookup(_registry(), cache["key"])
+        # Taken now, before the child can touch its inputs; the result is stored under this state
+        cache["fingerprint"] = result_cache.fingerprint(str(parent_cwd), files) if files else ""
 
     base_dir = AGENTS_BASE / tree_id / parent_id / 'children'
     base_dir.mkdir(parents=True, exist_ok=True)
-    child_id = _next_child_id(base_dir, label)
+    child_id = _next_child_id(tree_id, parent_id, label)
     child_dir = base_dir / child_id
     child_dir.mkdir(parents=True, exist_ok=True)
 
-    state = {
-        "agent_id": child_id,
-        "parent_id": parent_id,
-        "status": "active",
-        "model_key": model_key,
-        "spawned_at": int(time.time()),
-        "children": [],
-        "cwd": str(parent_cwd)
-    }
-    _write_json(child_dir / 'state.json', state)
+    if cached_result is not None:
+        # Same context, model, cwd and file state as an earlier child: reuse its result
+        (child_dir / 'init_context.txt').write_text(context_text or '', encoding='utf-8')
+        result = dict(cached_result, cached=True)
+        _registry().upsert(tree_id, child_id, parent_id, label=label, model_key=model_key, cwd=str(parent_cwd),
+                           dir=str(child_dir), auto_approve=int(auto_approve), spawned_at=time.time(), runtime=runtime)
+        _registry().finish(tree_id, child_id, parent_id, result)
+        return json.dumps({
+            "tree_id": tree_id,
+            "parent_id": parent_id,
+            "child_id": child_id,
+            "dir": str(child_dir),
+            "session": "",
+            "cached": True,
+            "result": result,
+        }, indent=2)
+
+    session = _ensure_session(tree_id) if runtime == 'pane' else ''
+    extra_env = {}
+    if model_key:
+        # Export both EG_CHILD_MODEL (highest precedence in ChatClient) and DEFAULT_MODEL
+        extra_env.update({"EG_CHILD_MODEL": model_key, "DEFAULT_MODEL": model_key})
+    if auto_approve:
+        extra_env["EG_YES_TOOL_FLAG"] = "1"
+    # How to start the child, now or later when the scheduler dequeues it
+    launch = {"runtime": runtime, "session": session, "extra_env": extra_env}
+    if runtime == 'inprocess':
+        # Only this process can run it; importing registers the exit hook that reports unstarted ones
+        import inprocess_agents  # noqa: F401
+        launch["owner_pid"] = os.getpid()
+    elif runtime == 'worker':
+        launch["job_id"] = uuid.uuid4().hex
+    if cache:
+        launch["cache"] = cache
+
+    # Written before the row exists so any process's dispatch can start it
     _write_json(child_dir / 'messages.json', [
         {"role": "system", "content": "You are a helpful assistant."},
         {"role": "user", "content": context_text}
     ])
     (child_dir / 'init_context.txt').write_text(context_text or '', encoding='utf-8')
+    # Created up front so wait_agents can watch it before the child finishes
+    (child_dir / 'notify').mkdir(exist_ok=True)
 
-    session = _ensure_session(tree_id)
-    extra_env = None
-    if model_key:
-        # Export both EG_CHILD_MODEL (highest precedence in ChatClient) and DEFAULT_MODEL
-        extra_env = {"EG_CHILD_MODEL": model_key, "DEFAULT_MODEL": model_key}
-    _launch_child(session, parent_cwd, str(child_dir), child_id, tree_id, parent_id, extra_env=extra_env)
-
-    return json.dumps({
+    import agent_scheduler
+    scheduled = agent_scheduler.enabled()
+    now = time.time()
+    try:
+        priority = int(args.get('priority') or 0)
+    except (TypeError, ValueError):
+        priority = 0
+    row = _registry().upsert(
+        tree_id, child_id, parent_id,
+        label=label,
+        status="queued" if scheduled else "active",
+        model_key=model_key,
+        cwd=str(parent_cwd),
+        dir=str(child_dir),
+        auto_approve=int(auto_approve),
+        spawned_at=now,
+        runtime=runtime,
+        priority=priority,
+        provider=agent_scheduler.provider_of(model_key),
+        est_tokens=agent_scheduler.estimate_tokens(context_text),
+        launch=launch,
+        started_at=None if scheduled else now,
+    )
+
+    out = {
         "tree_id": tree_id,
         "parent_id": parent_id,
         "child_id": child_id,
         "dir": str(child_dir),
         "session": session
-    }, indent=2)
+    }
+    if scheduled:
+        if child_id not in agent_scheduler.dispatch(tree_id):
+            out["status"] = "queued"
+            queue = agent_scheduler.queue_state(tree_id)["queue"]
+            out["queue_position"] = next((q["position"] for q in queue if q["child_id"] == child_id), None)
+    else:
+        try:
+            if _start_child(row):
+                out["pooled"] = True
+        except Exception as e:
+            _registry().finish(tree_id, child_id, parent_id, {
+                "status": "error", "return_value": "", "error": f"failed to start: {e}",
+                "finished_at": int(time.time())})
+            raise
+    if runtime != 'pane':
+        out["runtime"] = runtime
+    return json.dumps(out, indent=2)
+
+
+def _start_child(row: Dict[str, Any]) -> bool:
+    """Start a registered child according to its launch spec. Returns True if a pooled agent took it."""
+    tree_id, child_id, parent_id = row['tree_id'], row['agent_id'], row['parent_id']
+    child_dir = row['dir']
+    parent_cwd = row.get('cwd') or str(Path.cwd())
+    model_key = row.get('model_key') or ''
+    launch = row.get('launch') or {}
+    runtime = launch.get('runtime') or row.get('runtime') or 'pane'
+    session = launch.get('session') or ''
+    extra_env = launch.get('extra_env') or {}
+
+    if runtime == 'headless':
+        pid = _launch_headless(parent_cwd, child_dir, child_id, tree_id, parent_id, extra_env=extra_env or None)
+        _registry().upsert(tree_id, child_id, parent_id, pid=pid)
+        return False
+    if runtime == 'worker':
+        import agent_broker
+        agent_broker.get_client().call("put", job={
+            "job_id": launch['job_id'],
+            "tree_id": tree_id,
+            "parent_id": parent_id,
+            "child_id": child_id,
+            "context_text": (Path(child_dir) / 'init_context.txt').read_text(encoding='utf-8'),
+            "model_key": model_key,
+            "cwd": parent_cwd,
+            "extra_env": extra_env,
+        })
+        return False
+    if runtime == 'inprocess':
+        import inprocess_agents
+        context_text = (Path(child_dir) / 'init_context.txt').read_text(encoding='utf-8')
+        _registry().upsert(tree_id, child_id, parent_id, pid=os.getpid())
+        inprocess_agents.start(tree_id, child_id, parent_id, child_dir, model_key, context_text)
+        return False
+
+    import agent_pool
+    if not session:
+        session = _ensure_session(tree_id)
+    if agent_pool.pool_size() > 0:
+        env = _child_env(child_dir, child_id, tree_id, parent_id, extra_env)
+        pane_id = agent_pool.claim(tree_id, env, model_key)
+        agent_pool.refill_async(tree_id, parent_id, session, parent_cwd)
+        if pane_id is not None:
+            if pane_id:
+                _write_child_pane_id(tree_id, parent_id, child_id, pane_id)
+            return True
+    _launch_child(session, parent_cwd, child_dir, child_id, tree_id, parent_id, extra_env=extra_env or None)
+    return False
+
+
+def tool_spawn_agent(args: Dict) -> str:
+    return _spawn_child(args, auto_approve=False)
+
+
+def _pull_worker_results(tree_id: str, rows: List[Dict[str, Any]]) -> List[str]:
+    """Record results the broker holds for unfinished worker children. Returns the finished ids."""
+    jobs = {(r.get('launch') or {}).get('job_id'): r for r in rows
+            if r.get('runtime') == 'worker' and r.get('result') is None and (r.get('launch') or {}).get('job_id')}
+    if not jobs:
+        return []
+    import agent_broker
+    try:
+        results = agent_broker.get_client().call("results", job_ids=list(jobs)).get("results") or {}
+    except Exception:
+        return []
+    done = []
+    for job_id, res in results.items():
+        row = jobs.get(job_id)
+        if row and isinstance(res, dict):
+            _registry().finish(tree_id, row['agent_id'], row['parent_id'], res)
+            done.append(row['agent_id'])
+    return done
+
+
+def _kill_child_pane(row: Dict[str, Any]):
+    pane_id = row.get('pane_id') or ''
+    if pane_id:
+        _kill_pane(pane_id)
 
 
 def tool_wait_agents(args: Dict) -> str:
@@ -439,13 +948,13 @@ def tool_wait_agents(args: Dict) -> str:
     if not isinstance(which, list):
         return json.dumps({"error": "which must be a list (empty list means all children)"})
 
-    all_children = _list_all_children_dirs(tree_id)
-    name_to_dir = {name: p for name, p in all_children}
-
+    reg = _registry()
     if len(which) == 0:
-        target_ids = [name for name, _ in all_children]
+        name_to_row = {row['agent_id']: row for row in reg.children(tree_id)}
+        target_ids = list(name_to_row.keys())
     else:
         target_ids = [str(x) for x in which]
+        name_to_row = reg.find(tree_id, target_ids)
 
     start = time.time()
     results: Dict[str, Any] = {}
@@ -454,42 +963,103 @@ def tool_wait_agents(args: Dict) -> str:
     if not pending:
         return json.dumps({"completed": [], "results": {}, "pending": []}, indent=2)
 
-    while pending:
-        for cid in list(pending):
-            cdir = name_to_dir.get(cid)
-            if cdir and (cdir / 'result.json').exists():
-                try:
-                    results[cid] = _read_json(cdir / 'result.json')
-                except Exception:
-                    results[cid] = {"status": "done"}
-                pending.remove(cid)
-                if any_mode:
-                    pending_list = list(pending)
-                    st = _read_json(cdir / 'state.json') or {}
-                    pane_id = st.get('pane_id', '') if isinstance(st, dict) else ''
-                    if pane_id:
-                        _kill_pane(pane_id)
-                    return json.dumps({
-                        "completed": list(results.keys()),
-                        "results": results,
-                        "pending": pending_list
-                    }, indent=2)
-        if not pending:
-            break
-        if timeout and (time.time() - start) > timeout:
-            break
-        all_children = _list_all_children_dirs(tree_id)
-        name_to_dir = {name: p for name, p in all_children}
-        time.sleep(1)
-
-    for cid, res in list(results.items()):
-        cdir = name_to_dir.get(cid)
-        if not cdir:
-            continue
-        st = _read_json(cdir / 'state.json') or {}
-        pane_id = st.get('pane_id', '') if isinstance(st, dict) else ''
-        if pane_id:
-            _kill_pane(pane_id)
+    import agent_scheduler
+    import agent_watch
+    watcher = agent_watch.make_watcher()
+    # notify/ dir -> child id, and children/ dirs watched for ids that do not exist yet
+    notify_to_cid: Dict[Path, str] = {}
+
+    def _watch_child(cid: str, row: Dict[str, Any]):
+        if not row.get('dir'):
+            return
+        notify_dir = Path(row['dir']) / 'notify'
+        try:
+            notify_dir.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            return
+        if watcher.add(notify_dir):
+            notify_to_cid[notify_dir] = cid
+
+    def _collect_finished() -> List[str]:
+        known = [cid for cid in pending if cid in name_to_row]
+        # Worker children report through the broker, not this host's registry
+        _pull_worker_results(tree_id, [name_to_row[cid] for cid in known])
+        fresh = reg.find(tree_id, known)
+        done = []
+        for cid in known:
+            row = fresh.get(cid) or name_to_row[cid]
+            name_to_row[cid] = row
+            res = row.get('result')
+            if res is None and row.get('dir'):
+                # Children started before the registry only write result.json
+                res = _read_json(Path(row['dir']) / 'result.json')
+            if res is None and row.get('runtime') == 'headless' and not _headless_alive(cid, row):
+                # Exited without popContext (crash, kill): report it instead of waiting forever
+                row = reg.get(tree_id, cid, row['parent_id']) or row
+                res = row.get('result')
+                if res is None:
+                    res = {"status": "error", "return_value": "",
+                           "error": f"headless agent exited without popContext; see {Path(row.get('dir') or '') / 'output.log'}",
+                           "finished_at": int(time.time())}
+                    row = reg.finish(tree_id, cid, row['parent_id'], res) or row
+                name_to_row[cid] = row
+            if res is None and row.get('status') != 'done':
+                continue
+            results[cid] = res if res is not None else {"status": "done"}
+            pending.discard(cid)
+            done.append(cid)
+        return done
+
+    tree_dir = AGENTS_BASE / tree_id
+    children_roots = list(tree_dir.glob('*/children')) if tree_dir.exists() else []
+    # Children running inside this process are awaited directly
+    import inprocess_agents
+    futures = inprocess_agents.futures_for(pending)
+    if futures and len(futures) == len(pending):
+        inprocess_agents.wait(list(futures.values()), timeout or None, any_mode)
+
+    try:
+        # Register watches before the first check so a completion in between is not missed
+        for cid in pending:
+            if cid in name_to_row:
+                _watch_child(cid, name_to_row[cid])
+        if any(cid not in name_to_row for cid in pending):
+            for root in children_roots:
+                watcher.add(root)
+
+        while pending:
+            if any(name_to_row.get(cid, {}).get('status') == 'queued' for cid in pending):
+                # Token budgets free up with time, not with events; start whatever fits now
+                agent_scheduler.dispatch(tree_id)
+            newly_done = _collect_finished()
+            if any_mode and newly_done:
+                break
+            if not pending:
+                break
+            remaining = None
+            if timeout:
+                remaining = timeout - (time.time() - start)
+                if remaining <= 0:
+                    break
+            if any(name_to_row.get(cid, {}).get('runtime') in ('headless', 'worker') or name_to_row.get(cid, {}).get('status') == 'queued'
+                   for cid in pending):
+                # Dying processes and remote workers leave no notify event, and queued children wait on budgets;
+                # re-check periodically
+                remaining = HEADLESS_CHECK_SEC if remaining is None else min(remaining, HEADLESS_CHECK_SEC)
+            events = watcher.wait(remaining)
+            # Late-created children: resolve them with an indexed lookup instead of rescanning the tree
+            unresolved = [cid for cid in pending if cid not in name_to_row]
+            if unresolved and any(path not in notify_to_cid for path, _ in events):
+                for cid, row in reg.find(tree_id, unresolved).items():
+                    name_to_row[cid] = row
+                    _watch_child(cid, row)
+    finally:
+        watcher.close()
+
+    for cid in list(results.keys()):
+        row = name_to_row.get(cid)
+        if row:
+            _kill_child_pane(row)
 
     return json.dumps({
         "completed": list(results.keys()),
@@ -499,20 +1069,7 @@ def tool_wait_agents(args: Dict) -> str:
 
 
 def _list_all_children_dirs(tree_id: str) -> List[Tuple[str, Path]]:
-    base = AGENTS_BASE / tree_id
-    out: List[Tuple[str, Path]] = []
-    if not base.exists():
-        return out
-    for parent_dir in base.iterdir():
-        if not parent_dir.is_dir():
-            continue
-        children_root = parent_dir / 'children'
-        if not children_root.exists():
-            continue
-        for c in children_root.iterdir():
-            if c.is_dir():
-                out.append((c.name, c))
-    return out
+    return [(row['agent_id'], Path(row['dir'])) for row in _registry().children(tree_id) if row.get('dir')]
 
 
 def parse_tool_calls_from_content(message_content: str) -> list:
@@ -553,6 +1110,18 @@ def parse_tool_calls_from_content(message_content: str) -> list:
     return tool_calls
 
 
+def _live_output(client):
+    """Writer that shows a command's output as it arrives on the agent's console (pane or log file)."""
+    if os.environ.get('EG_BASH_LIVE', '1').strip().lower() in ('0', 'false', 'no', 'off'):
+        return None
+    out = getattr(getattr(client, 'console', None), 'file', None) or sys.stdout
+
+    def emit(text: str):
+        out.write(text)
+        out.flush()
+    return emit
+
+
 def handle_tool_call(client, call: Dict, display_call: bool = True):
     fn_name = call["function"]["name"]
     # Parse arguments robustly. Accept either a single JSON object, a Python-dict-like object, or
@@ -660,6 +1229,9 @@ def handle_tool_call(client, call: Dict, display_call: bool = True):
             execute = False
 
     outputs = []
+    raw_outputs = []
+    cut = False
+    model_config = (getattr(client, "models_config", None) or {}).get(getattr(client, "current_model_key", None)) or {}
     if not execute:
         outputs = ["--- SKIPPED BY USER ---"] * len(parsed_args_list)
     else:
@@ -718,17 +1290,31 @@ def handle_tool_call(client, call: Dict, display_call: bool = True):
                             args["model_key"] = mk
                 except Exception:
                     pass
+            if cur_name not in ("spawn_agent", "spawn_agent_auto"):
+                # Children spawned earlier in this batch must be running before anything else runs
+                flush_spawns()
+            allowed = getattr(client, "allowed_tools", None)
             try:
-                if cur_name == "bash":
-                    out = run_bash_script(args.get("script", ""))
+                if allowed is not None and cur_name not in allowed:
+                    out = f"Tool {cur_name} is not available to this agent. Available: {', '.join(allowed)}"
+                elif cur_name == "bash":
+                    out = run_bash_script(args.get("script", ""), args.get("timeout_sec"), _live_output(client),
+                                          session=shell_session.for_client(client) if shell_session.enabled() else None)
                 elif cur_name == "python":
-                    out = run_python_script(args.get("script", ""))
+                    kernel = python_kernel.for_client(client) if python_kernel.enabled() else None
+                    if kernel is not None and args.get("restart"):
+                        kernel.restart()
+                    out = run_python_script(args.get("script", ""), args.get("timeout_sec"), _live_output(client), kernel=kernel)
                 elif cur_name == "javascript":
                     out = run_javascript(args)
                 elif cur_name == "popContext":
                     out = client.pop_context(args.get("return_value", ""))
                 elif cur_name == "str_replace_editor":
                     out = str_replace_editor(args.get("file_path"), args.get("old_str"), args.get("new_str"))
+                elif cur_name == "multi_edit":
+                    out = multi_edit(args.get("edits"))
+                elif cur_name == "apply_patch":
+                    out = apply_patch(args.get("patch"), args.get("fuzz"), args.get("max_offset"))
                 elif cur_name == "replace_between":
                     out = replace_between(args.get("file_path"), args.get("start_text"), args.get("end_text"), args.get("new_text"))
                 elif cur_name == "spawn_agent":
@@ -746,10 +1332,26 @@ def handle_tool_call(client, call: Dict, display_call: bool = True):
                     out = tool_spawn_agent_auto(args)
                 elif cur_name == "search_tavily":
                     out = tool_search(args)
+                elif cur_name == "read_artifact":
+                    out = tool_read_artifact(args)
+                elif cur_name == "search_code":
+                    out = tool_search_code(args)
+                elif cur_name == "repo_map":
+                    out = tool_repo_map(args)
+                elif cur_name == "fetch_url":
+                    out = tool_fetch_url(args, output_shaper.budget(cur_name, model_config) * output_shaper.CHARS_PER_TOKEN)
+                elif cur_name == "read_file":
+                    out = tool_read_file(args, output_shaper.budget(cur_name, model_config) * output_shaper.CHARS_PER_TOKEN)
                 else:
                     out = f"Unknown tool: {cur_name}"
             except Exception as e:
                 out = f"Error executing {cur_name}: {e}"
+            raw_outputs.append(out)
+            if cur_name not in ("read_artifact", "read_file", "fetch_url"):
+                # Fit the output to its token budget; anything cut stays readable as an artifact
+                # (read_file and fetch_url fit their own output to the budget)
+                out, was_cut = output_shaper.shape(out, cur_name, model_config)
+                cut = cut or was_cut
             outputs.append(out)
 
     # Aggregate outputs into a single tool message for display and transcript
@@ -758,43 +1360,27 @@ def handle_tool_call(client, call: Dict, display_call: bool = True):
     else:
         final_output = "\n\n==== SPLIT RESULTS ===\n\n".join(outputs)
     
-    # Check if output is long (more than 800 lines or more than 100,000 characters)
-    line_count = len(final_output.split('\n'))
-    char_count = len(final_output)
-    is_long_output = line_count > 800 or char_count > 100000
-    
-    if is_long_output:
+    # Only an attended, manually approved call may ask to keep the full output
+    attended = not (getattr(client, 'headless', False) or client.yesToolFlag or client.in_single_turn_auto_execute_calls)
+    if cut and attended:
         console = getattr(client, 'console', None)
-        if console:
-            if line_count > 800:
-                console.print(f"[yellow]Warning: Tool output is {line_count} lines long (over 800 lines).[/yellow]")
-            elif char_count > 100000:
-                console.print(f"[yellow]Warning: Tool output is {char_count} characters long (over 100,000 characters).[/yellow]")
-            try:
-                while True:
-                    response = input("Include full output in context? [y/n] ").strip().lower()
-                    if response in ('y', 'n'):
-                        break
+        full = [output_shaper.clean(o) for o in raw_outputs]
+        tokens = sum(output_shaper.estimate_tokens(o) for o in full)
+        try:
+            if console:
+                console.print(f"[yellow]Tool output was cut to fit its token budget (full output ~{tokens} tokens).[/yellow]")
+            while True:
+                response = input("Include full output in context? [y/n] ").strip().lower()
+                if response in ('y', 'n'):
+                    break
+                if console:
                     console.print("Invalid input. Please enter y or n")
-                
-                if response == 'n':
-                    # For tool outputs, we'll use a smaller preview size to keep context manageable
-                    MAX_PREVIEW = 15000  # characters
-                    if len(final_output) > MAX_PREVIEW:
-                        final_output = final_output[:MAX_PREVIEW] + "\n... [truncated]"
-                    elif line_count > 800:
-                        # Truncate to 100 lines if it's too many lines
-                        lines = final_output.split('\n')
-                        final_output = '\n'.join(lines[:100]) + f"\n... [truncated, {line_count - 100} more lines]"
-            except:
-                # If there's any issue with user input, default to truncation
-                MAX_PREVIEW = 15000  # characters
-                if len(final_output) > MAX_PREVIEW:
-                    final_output = final_output[:MAX_PREVIEW] + "\n... [truncated]"
-                elif line_count > 800:
-                    # Truncate to 100 lines if it's too many lines
-                    lines = final_output.split('\n')
-                    final_output = '\n'.join(lines[:100]) + f"\n... [truncated, {line_count - 100} more lines]"
+                else:
+                    print("Invalid input. Please enter y or n")
+            if response == 'y':
+                final_output = full[0] if len(full) == 1 else "\n\n==== SPLIT RESULTS ===\n\n".join(full)
+        except (EOFError, KeyboardInterrupt):
+            pass
 
     tool_msg = {"role": "tool", "name": fn_name, "tool_call_id": call.get("id"), "content": final_output}
     client.messages.append(tool_msg)
@@ -811,105 +1397,54 @@ def tool_list_agents(args: Dict) -> str:
     if not tree_id:
         return json.dumps({"error": "No tree context found"})
     listing: Dict[str, List[Dict[str, Any]]] = {}
-    base = AGENTS_BASE / tree_id
-    if not base.exists():
-        return json.dumps({"tree_id": tree_id, "parents": listing}, indent=2)
-    for parent_dir in base.iterdir():
-        if not parent_dir.is_dir():
-            continue
-        parent_id = parent_dir.name
-        children_root = parent_dir / 'children'
-        if not children_root.exists():
-            continue
-        children: List[Dict[str, Any]] = []
-        for c in children_root.iterdir():
-            if not c.is_dir():
-                continue
-            state = _read_json(c / 'state.json') or {}
-            # Read result.json if present to reflect done status and return value
-            res = _read_json(c / 'result.json')
-            status = "done" if isinstance(res, dict) else state.get("status", "active")
-            rv = res.get("return_value") if isinstance(res, dict) else None
-            children.append({
-                "child_id": c.name,
-                "status": status,
-                "return_value": rv
-            })
-        if children:
-            listing[parent_id] = children
-    return json.dumps({"tree_id": tree_id, "parents": listing}, indent=2)
-
+    rows = _registry().children(tree_id)
+    if _pull_worker_results(tree_id, rows):
+        rows = _registry().children(tree_id)
+    for row in rows:
+        res = row.get('result')
+        rv = res.get("return_value") if isinstance(res, dict) else None
+        entry = {
+            "child_id": row['agent_id'],
+            "status": "done" if isinstance(res, dict) else row.get("status", "active"),
+            "return_value": rv
+        }
+        if row.get('runtime') and row['runtime'] != 'pane':
+            entry["runtime"] = row['runtime']
+        listing.setdefault(row['parent_id'], []).append(entry)
+    out = {"tree_id": tree_id, "parents": listing}
+    import agent_scheduler
+    if agent_scheduler.enabled():
+        agent_scheduler.dispatch(tree_id)
+        out.update(agent_scheduler.queue_state(tree_id))
+    return json.dumps(out, indent=2)
 
 
 def tool_spawn_agent_auto(args: Dict) -> str:
-    context_text = args.get('context_text', '').strip()
-    label = (args.get('label') or 'child').strip() or 'child'
-    model_key = args.get('model_key')
-
-    tree_id = os.environ.get('EG_TREE_ID')
-    if not tree_id:
-        current = AGENTS_BASE / '.current_tree'
-        if current.exists():
-            try:
-                tree_id = current.read_text().strip()
-            except Exception:
-                tree_id = None
-    if not tree_id:
-        tree_id = str(int(time.time()))
-        (AGENTS_BASE).mkdir(parents=True, exist_ok=True)
-        (AGENTS_BASE / '.current_tree').write_text(tree_id)
-
-    parent_id = os.environ.get('EG_AGENT_ID', 'root')
-    parent_cwd = str(Path.cwd())
-
-    # If no model_key provided, attempt to read parent's state.json
-    if not model_key:
-        try:
-            parent_state = _read_json(AGENTS_BASE / tree_id / parent_id / 'state.json')
-            if isinstance(parent_state, dict):
-                pmk = parent_state.get('model_key')
-                if isinstance(pmk, str) and pmk:
-                    model_key = pmk
-        except Exception:
-            model_key = model_key
-
-    if not model_key:
-        model_key = os.environ.get('DEFAULT_MODEL') or ''
-
-    base_dir = AGENTS_BASE / tree_id / parent_id / 'children'
-    base_dir.mkdir(parents=True, exist_ok=True)
-    child_id = _next_child_id(base_dir, label)
-    child_dir = base_dir / child_id
-    child_dir.mkdir(parents=True, exist_ok=True)
-
-    state = {
-        "agent_id": child_id,
-        "parent_id": parent_id,
-        "status": "active",
-        "model_key": model_key,
-        "spawned_at": int(time.time()),
-        "children": [],
-        "cwd": str(parent_cwd)
-    }
-    _write_json(child_dir / 'state.json', state)
-    _write_json(child_dir / 'messages.json', [
-        {"role": "system", "content": "You are a helpful assistant."},
-        {"role": "user", "content": context_text}
-    ])
-    (child_dir / 'init_context.txt').write_text(context_text or '', encoding='utf-8')
-
-    session = _ensure_session(tree_id)
-    extra_env = None
-    if model_key:
-        extra_env = {"EG_CHILD_MODEL": model_key, "DEFAULT_MODEL": model_key, "EG_YES_TOOL_FLAG": "1"}
-    else:
-        extra_env = {"EG_YES_TOOL_FLAG": "1"}
-    _launch_child(session, parent_cwd, str(child_dir), child_id, tree_id, parent_id, extra_env=extra_env)
-
-    return json.dumps({
-        "tree_id": tree_id,
-        "parent_id": parent_id,
-        "child_id": child_id,
-        "dir": str(child_dir),
-        "session": session
-    }, indent=2)
+    return _spawn_child(args, auto_approve=True)
+
+
+def attach_agent(child_id: str, tree_id: Optional[str] = None, tail_lines: int = 40) -> str:
+    """Open a pane tailing a headless child's output.log; outside tmux return the log's tail instead."""
+    tree_id = tree_id or _resolve_tree_id()
+    row = _registry().get(tree_id, child_id)
+    if not row or not row.get('dir'):
+        return f"Unknown agent: {child_id}"
+    log_path = Path(row['dir']) / 'output.log'
+    if not log_path.exists():
+        return f"{child_id} has no output.log (runtime: {row.get('runtime') or 'pane'})"
+    pane = row.get('pane_id') or ''
+    if pane and _pane_exists(pane):
+        return f"{child_id} is already shown in pane {pane}"
+    if os.environ.get('TMUX'):
+        session = _ensure_session(tree_id)
+        pane = _spawn_into_parent_layer(session, tree_id, os.environ.get('EG_AGENT_ID', 'root'), f"tail -n +1 -f '{log_path}'")
+        if pane:
+            # Recorded as the child's pane so wait_agents closes it when the child finishes
+            _write_child_pane_id(tree_id, row['parent_id'], child_id, pane)
+            return f"Attached {child_id} in pane {pane}"
+    try:
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+            lines = f.readlines()
+    except OSError as e:
+        return f"Error reading {log_path}: {e}"
+    return "".join(lines[-tail_lines:])
@@ -0,0 +1,358 @@
+"""Fetching web pages for the fetch_url tool: pooled HTTP, on-disk HTTP cache, HTML to markdown.
+
+One requests.Session (keep-alive connection pool) serves every fetch in the
+process. Responses are cached in .egg/cache/http/<sha256 of url>.{json,body}:
+a cached response younger than its Cache-Control max-age (or
+EG_FETCH_CACHE_TTL_SEC, default 0) is used without contacting the server;
+an older one is revalidated with If-None-Match / If-Modified-Since, and a 304
+reuses the stored body. no-store responses are not kept.
+
+HTML is turned into compact markdown (headings, paragraphs, lists, links,
+code blocks, table rows; scripts, styles, navigation chrome dropped) with the
+stdlib parser, other text types pass through, binary types are only
+described. Several URLs are fetched concurrently, and each page gets an equal
+share of the output budget; a page cut to fit is stored whole as an artifact
+for read_artifact.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import artifacts
+import executors
+
+DEFAULT_TIMEOUT_SEC = 30
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+MAX_CONCURRENT = 8
+MAX_URLS = 20
+MIN_PAGE_CHARS = 1000
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) egg-fetch/1.0"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=MAX_CONCURRENT * 2, max_retries=1)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update({"User-Agent": USER_AGENT, "Accept": "text/html,application/xhtml+xml,text/plain,application/json;q=0.9,*/*;q=0.5"})
+            _session = s
+        return _session
+
+
+# ---- cache ------------------------------------------------------------------
+
+def cache_dir() -> Path:
+    return Path.cwd() / ".egg" / "cache" / "http"
+
+
+def _cache_paths(url: str) -> Tuple[Path, Path]:
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+    d = cache_dir() / key[:2]
+    return d / f"{key}.json", d / f"{key}.body"
+
+
+def _load_cached(url: str) -> Optional[Tuple[Dict, bytes]]:
+    meta_path, body_path = _cache_paths(url)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return meta, body_path.read_bytes()
+    except (OSError, ValueError):
+        return None
+
+
+def _store(url: str, meta: Dict, body: Optional[bytes]):
+    meta_path, body_path = _cache_paths(url)
+    meta_path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    if body is not None:
+        tmp = body_path.with_name(body_path.name + suffix)
+        tmp.write_bytes(body)
+        os.replace(tmp, body_path)
+    tmp = meta_path.with_name(meta_path.name + suffix)
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, meta_path)
+
+
+def _max_age(cache_control: str) -> Optional[int]:
+    cc = (cache_control or "").lower()
+    if "no-cache" in cc or "no-store" in cc:
+        return 0
+    m = re.search(r"max-age=(\d+)", cc)
+    return int(m.group(1)) if m else None
+
+
+def get(url: str) -> Dict:
+    """{url, final_url, status, content_type, body, cache} where cache is "fresh", "revalidated" or "miss"."""
+    timeout = executors._env_number("EG_FETCH_TIMEOUT_SEC", DEFAULT_TIMEOUT_SEC, float)
+    max_bytes = executors._env_number("EG_FETCH_MAX_BYTES", DEFAULT_MAX_BYTES, int)
+    cached = _load_cached(url)
+    headers = {}
+    if cached:
+        meta, body = cached
+        age = time.time() - meta.get("fetched_at", 0)
+        fresh_for = max(meta.get("max_age") or 0, executors._env_number("EG_FETCH_CACHE_TTL_SEC", 0, float))
+        if age < fresh_for:
+            return dict(meta, body=body, cache="fresh")
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    with session().get(url, headers=headers, timeout=timeout, stream=True, allow_redirects=True) as resp:
+        if resp.status_code == 304 and cached:
+            meta, body = cached
+            meta.update(fetched_at=time.time(), max_age=_max_age(resp.headers.get("Cache-Control", "")) or meta.get("max_age"))
+            _store(url, meta, None)
+            return dict(meta, body=body, cache="revalidated")
+        chunks, size, truncated = [], 0, False
+        for chunk in resp.iter_content(65536):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                truncated = True
+                break
+        body = b"".join(chunks)[:max_bytes]
+        meta = {"url": url, "final_url": resp.url, "status": resp.status_code,
+                "content_type": resp.headers.get("Content-Type", ""), "encoding": resp.encoding,
+                "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified"),
+                "max_age": _max_age(resp.headers.get("Cache-Control", "")), "fetched_at": time.time(),
+                "truncated": truncated}
+        cacheable = resp.status_code == 200 and not truncated and "no-store" not in resp.headers.get("Cache-Control", "").lower()
+    if cacheable:
+        try:
+            _store(url, meta, body)
+        except OSError:
+            pass
+    return dict(meta, body=body, cache="miss")
+
+
+# ---- HTML to markdown -------------------------------------------------------
+
+_SKIP = {"script", "style", "noscript", "svg", "template", "iframe", "canvas", "head", "nav", "footer", "button", "select"}
+_BLOCK = {"p", "div", "section", "article", "main", "header", "aside", "blockquote", "figure", "figcaption",
+          "ul", "ol", "dl", "dt", "dd", "table", "thead", "tbody", "tr", "hr", "address", "details", "summary", "form"}
+_VOID = {"br", "hr", "img", "input", "meta", "link", "area", "base", "col", "embed", "source", "track", "wbr"}
+
+
+class _Markdown(HTMLParser):
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.out: List[str] = []
+        self.title = ""
+        self._in_title = False
+        self._skip = 0
+        self._pre = 0
+        self._links: List[Tuple[str, int]] = []
+        self._list: List[str] = []
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+
+    def _emit(self, text: str):
+        if self._cell is not None:
+            self._cell.append(text)
+        else:
+            self.out.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        if tag in _SKIP and tag not in _VOID:
+            self._skip += 1
+            return
+        if self._skip:
+            return
+        a = dict(attrs)
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self._emit("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag == "pre":
+            self._pre += 1
+            self._emit("\n\n```\n")
+        elif tag == "code" and not self._pre:
+            self._emit("`")
+        elif tag in ("ul", "ol"):
+            self._list.append(tag)
+            self._emit("\n")
+        elif tag == "li":
+            indent = "  " * max(len(self._list) - 1, 0)
+            self._emit(f"\n{indent}{'1.' if self._list and self._list[-1] == 'ol' else '-'} ")
+        elif tag == "br":
+            self._emit("\n")
+        elif tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+        elif tag == "a" and a.get("href") and not a["href"].startswith(("javascript:", "#")):
+            self._links.append((urljoin(self.base_url, a["href"]), len(self.out)))
+            self._emit("[")
+        elif tag == "img" and a.get("alt"):
+            self._emit(f"[image: {a['alt']}]")
+        elif tag in ("strong", "b"):
+            self._emit("**")
+        elif tag in ("em", "i"):
+            self._emit("_")
+        elif tag in _BLOCK:
+            self._emit("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        if tag in _SKIP and tag not in _VOID:
+            self._skip = max(0, self._skip - 1)
+            return
+        if self._skip:
+            return
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self._emit("\n\n")
+        elif tag == "pre":
+            self._pre = max(0, self._pre - 1)
+            self._emit("\n```\n\n")
+        elif tag == "code" and not self._pre:
+            self._emit("`")
+        elif tag in ("ul", "ol"):
+            if self._list:
+                self._list.pop()
+            self._emit("\n")
+        elif tag in ("td", "th") and self._cell is not None and self._row is not None:
+            self._row.append(" ".join("".join(self._cell).split()))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            row, self._row = self._row, None
+            if any(row):
+                self._emit("\n| " + " | ".join(row) + " |")
+        elif tag == "a" and self._links:
+            href, _ = self._links.pop()
+            self._emit(f"]({href})")
+        elif tag in ("strong", "b"):
+            self._emit("**")
+        elif tag in ("em", "i"):
+            self._emit("_")
+        elif tag in _BLOCK:
+            self._emit("\n\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        if self._skip:
+            return
+        self._emit(data if self._pre else re.sub(r"\s+", " ", data))
+
+
+def html_to_markdown(html: str, base_url: str = "") -> Tuple[str, str]:
+    """(title, markdown) of an HTML document."""
+    parser = _Markdown(base_url)
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass
+    text = "".join(parser.out)
+    # Tidy: empty links and emphasis, trailing spaces, runs of blank lines
+    text = re.sub(r"\[\s*\]\([^)]*\)", "", text)
+    text = re.sub(r"(\*\*|_)\s*\1", "", text)
+    lines = [l.rstrip() for l in text.split("\n")]
+    out, blank = [], 0
+    for line in lines:
+        if not line.strip():
+            blank += 1
+            if blank > 1:
+                continue
+        else:
+            blank = 0
+        out.append(line if line.startswith("  ") else line.lstrip(" "))
+    return " ".join(parser.title.split()), "\n".join(out).strip()
+
+
+# ---- tool -------------------------------------------------------------------
+
+def _decode(page: Dict) -> str:
+    body = page["body"]
+    enc = page.get("encoding")
+    ctype = (page.get("content_type") or "").lower()
+    if not enc or (enc.lower() == "iso-8859-1" and "charset" not in ctype):
+        m = re.search(rb"<meta[^>]+charset=[\"']?([\w-]+)", body[:4096], re.I)
+        enc = m.group(1).decode() if m else "utf-8"
+    try:
+        return body.decode(enc, errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def render(page: Dict) -> str:
+    """Readable text of a fetched page with a one-line header."""
+    ctype = (page.get("content_type") or "").split(";")[0].strip().lower()
+    url = page.get("final_url") or page["url"]
+    header = f"# {url} ({page['status']}, {ctype or 'unknown type'}, {len(page['body'])} bytes, cache: {page['cache']})"
+    if page.get("truncated"):
+        header += f" [download stopped at {len(page['body'])} bytes]"
+    if not page["body"]:
+        return header + "\n\n(empty body)"
+    if "html" in ctype or (not ctype and page["body"][:200].lstrip().lower().startswith((b"<!doctype html", b"<html"))):
+        title, text = html_to_markdown(_decode(page), url)
+        if not text:
+            text = "(no readable text in the page; it may be built by JavaScript, try the javascript tool)"
+        return header + (f"\nTitle: {title}" if title else "") + "\n\n" + text
+    if ctype.startswith("text/") or ctype.endswith(("json", "xml", "javascript")) or not ctype:
+        text = _decode(page)
+        if ctype.endswith("json"):
+            try:
+                text = json.dumps(json.loads(text), indent=1, ensure_ascii=False)
+            except ValueError:
+                pass
+        return header + "\n\n" + text
+    return header + "\n\n(binary content, not shown; download it with bash if you need it)"
+
+
+def _fit(text: str, max_chars: int, what: str = "page") -> str:
+    if len(text) <= max_chars:
+        return text
+    try:
+        where = f"full text: artifact {artifacts.put(text)}, readable with read_artifact"
+    except OSError:
+        where = "full text not stored"
+    cut = text[:max_chars].rsplit("\n", 1)[0]
+    return cut + f"\n[... {what} cut at {len(cut)} of {len(text)} chars to fit the output budget; {where} ...]"
+
+
+def fetch(url: str, max_chars: int) -> str:
+    try:
+        if not re.match(r"https?://", url):
+            url = "https://" + url
+        return _fit(render(get(url)), max_chars)
+    except Exception as e:
+        return f"# {url}\nError fetching: {e}"
+
+
+def fetch_many(urls: List[str], max_chars: int) -> str:
+    """Fetch urls concurrently; each page gets an equal share of max_chars, and the whole stays within it."""
+    urls = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+    if not urls:
+        return "Error: give url or urls."
+    skipped = urls[MAX_URLS:]
+    urls = urls[:MAX_URLS]
+    share = max(MIN_PAGE_CHARS, max_chars // len(urls))
+    if len(urls) == 1:
+        text = fetch(urls[0], share)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT, len(urls))) as pool:
+            pages = list(pool.map(lambda u: fetch(u, share), urls))
+        text = "\n\n".join(pages)
+    note = f"\n\n[{len(skipped)} more url(s) not fetched (at most {MAX_URLS} per call): {' '.join(skipped)}]" if skipped else ""
+    # Many pages at the minimum share can still add up to more than the budget
+    return _fit(text, max(MIN_PAGE_CHARS, max_chars - len(note)), "output") + note
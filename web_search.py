@@ -0,0 +1,190 @@
+"""Web search for the search_tavily tool and /search: backends, shared cache, batching.
+
+A backend turns one query into a list of {title, url, content} results.
+"tavily" (the default; needs TAVILY_API_KEY) keeps one client per process;
+"fixtures" answers from a JSON file (EG_SEARCH_FIXTURES: {"query": [results]})
+so searches can be exercised offline. EG_SEARCH_BACKEND picks one, and
+register_backend adds more.
+
+Results are cached in .egg/cache/search.db keyed by backend, result count and
+the normalized query (case-folded, whitespace collapsed) for
+EG_SEARCH_CACHE_TTL_SEC seconds (default 6 hours; 0 disables the cache). All
+agents working in the project share it, so siblings asking the same question
+cost one network call. Several queries in one call run concurrently,
+and results are formatted compactly (title, URL, trimmed snippet) instead of as
+raw JSON.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import executors
+
+DEFAULT_BACKEND = "tavily"
+DEFAULT_MAX_RESULTS = 5
+DEFAULT_CACHE_TTL_SEC = 6 * 3600
+MAX_CONCURRENT = 8
+SNIPPET_CHARS = 300
+
+Result = Dict[str, str]
+
+_backends: Dict[str, Callable[[], "Backend"]] = {}
+_instances: Dict[str, "Backend"] = {}
+_instances_lock = threading.Lock()
+
+
+class Backend(ABC):
+    name = ""
+
+    @abstractmethod
+    def search(self, query: str, max_results: int) -> List[Result]:
+        """Up to max_results {title, url, content} results for query."""
+
+
+def register_backend(name: str, factory: Callable[[], Backend]):
+    _backends[name] = factory
+    _instances.pop(name, None)
+
+
+class TavilyBackend(Backend):
+    name = "tavily"
+
+    def __init__(self):
+        from tavily import TavilyClient
+        self.client = TavilyClient(os.getenv('TAVILY_API_KEY'))
+
+    def search(self, query: str, max_results: int) -> List[Result]:
+        raw = self.client.search(query=query, max_results=max_results)
+        return [{"title": r.get("title", ""), "url": r.get("url", ""), "content": r.get("content", "")}
+                for r in (raw or {}).get("results", [])][:max_results]
+
+
+class FixturesBackend(Backend):
+    """Canned results from the JSON file named by EG_SEARCH_FIXTURES; unknown queries return nothing."""
+    name = "fixtures"
+
+    def __init__(self):
+        with open(os.environ.get("EG_SEARCH_FIXTURES", ""), "r", encoding="utf-8") as f:
+            self.results = {normalize(q): r for q, r in json.load(f).items()}
+
+    def search(self, query: str, max_results: int) -> List[Result]:
+        return list(self.results.get(normalize(query), []))[:max_results]
+
+
+register_backend("tavily", TavilyBackend)
+register_backend("fixtures", FixturesBackend)
+
+
+def backend() -> Backend:
+    name = os.environ.get("EG_SEARCH_BACKEND", DEFAULT_BACKEND).strip() or DEFAULT_BACKEND
+    with _instances_lock:
+        if name not in _instances:
+            if name not in _backends:
+                raise ValueError(f"unknown search backend {name!r} (known: {', '.join(sorted(_backends))})")
+            _instances[name] = _backends[name]()
+        return _instances[name]
+
+
+def normalize(query: str) -> str:
+    return " ".join((query or "").casefold().split())
+
+
+def _ttl() -> float:
+    return executors._env_number("EG_SEARCH_CACHE_TTL_SEC", DEFAULT_CACHE_TTL_SEC, float)
+
+
+def _connect() -> sqlite3.Connection:
+    d = Path.cwd() / ".egg" / "cache"
+    d.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(d / "search.db"), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, query TEXT, results TEXT, created REAL)")
+    return conn
+
+
+def _key(backend_name: str, query: str, max_results: int) -> str:
+    return hashlib.sha256(json.dumps([backend_name, normalize(query), max_results]).encode("utf-8")).hexdigest()
+
+
+def _cached(key: str, ttl: float) -> Optional[List[Result]]:
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT results, created FROM search_cache WHERE key = ?", (key,)).fetchone()
+    finally:
+        conn.close()
+    if row and time.time() - row[1] < ttl:
+        return json.loads(row[0])
+    return None
+
+
+def _store(key: str, query: str, results: List[Result]):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO search_cache(key, query, results, created) VALUES (?, ?, ?, ?)",
+                         (key, normalize(query), json.dumps(results), time.time()))
+    finally:
+        conn.close()
+
+
+def search(query: str, max_results: int = DEFAULT_MAX_RESULTS) -> Dict:
+    """{query, results, cached} or {query, error} for one query."""
+    try:
+        b = backend()
+        ttl = _ttl()
+        key = _key(b.name, query, max_results)
+        if ttl > 0:
+            hit = _cached(key, ttl)
+            if hit is not None:
+                return {"query": query, "results": hit, "cached": True}
+        results = b.search(query, max_results)
+        if ttl > 0:
+            _store(key, query, results)
+        return {"query": query, "results": results, "cached": False}
+    except Exception as e:
+        return {"query": query, "error": str(e)}
+
+
+def search_many(queries: List[str], max_results: int = DEFAULT_MAX_RESULTS) -> List[Dict]:
+    """Run queries concurrently (queries equal after normalize() once); results in the order given."""
+    seen: Dict[str, str] = {}
+    for q in queries:
+        if normalize(q):
+            seen.setdefault(normalize(q), q)
+    unique = list(seen.values())
+    if len(unique) <= 1:
+        done = {q: search(q, max_results) for q in unique}
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT, len(unique))) as pool:
+            done = dict(zip(unique, pool.map(lambda q: search(q, max_results), unique)))
+    return [done[q] for q in unique]
+
+
+def _snippet(text: str) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= SNIPPET_CHARS else text[:SNIPPET_CHARS].rsplit(" ", 1)[0] + " ..."
+
+
+def format_results(answers: List[Dict]) -> str:
+    blocks = []
+    for a in answers:
+        lines = []
+        if len(answers) > 1:
+            lines.append(f"## {a['query']}")
+        if "error" in a:
+            lines.append(f"Error during search: {a['error']}")
+        elif not a["results"]:
+            lines.append("No results.")
+        for n, r in enumerate(a.get("results") or [], 1):
+            lines.append(f"{n}. {r.get('title') or r.get('url')}\n   {r.get('url')}")
+            if r.get("content"):
+                lines.append(f"   {_snippet(r['content'])}")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)